@@ -1,13 +1,37 @@
+import os
+from functools import partial
+
 from flask import Flask, jsonify
 from flask_cors import CORS
 
 from config import Config
-from extensions.db import init_db
+from extensions.admission import get_stream_admission_stats, init_stream_admission
+from extensions.coalesce import get_coalesce_stats, init_coalescer
+from extensions.db import get_pool_stats, init_db
+from extensions.hashing import get_hashing_stats, init_password_hasher
+from extensions.hls import get_hls_stats, init_hls_packager
 from extensions.jwt import init_jwt
+from extensions.metrics import init_metrics
+from extensions.prefetch import get_stream_prefetch_stats, init_stream_prefetcher
+from extensions.resolver import get_resolver_stats, init_upstream_resolver
+from extensions.segment_cache import get_segment_cache_stats, init_segment_cache
+from extensions.sessions import get_session_stats, init_sessions
+from extensions.shared_state import get_shared_state_stats, init_shared_state
+from extensions.upstream import get_upstream_stats, init_upstream
+from extensions.watch_events import (
+    get_watch_event_buffer,
+    get_watch_event_stats,
+    init_watch_events,
+)
 from middleware.auth import jwt_unauthorized_loader
+from middleware.internal import internal_only
+from models.video import get_video_cache_stats, init_video_cache
+from models.watch import apply_watch_aggregates
 from routes.auth import auth_bp
 from routes.dashboard import dashboard_bp
 from routes.video import video_bp
+from utils.stats import collect_stats, register_stats
+from utils.token import get_playback_token_cache_stats
 
 
 def create_app(config_class: type[Config] = Config) -> Flask:
@@ -18,9 +42,42 @@ def create_app(config_class: type[Config] = Config) -> Flask:
     # Enable CORS for the React Native client
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-    # Init extensions
+    # Init extensions (metrics first: it hooks pymongo before the client exists)
+    init_metrics(app)
     init_db(app)
+    init_video_cache(app)
+    init_shared_state(app)
+    init_sessions(app)
     init_jwt(app)
+    init_password_hasher(app)
+    init_upstream(app)
+    init_upstream_resolver(app)
+    init_stream_admission(app)
+    init_watch_events(app)
+    get_watch_event_buffer().add_flush_hook(
+        partial(
+            apply_watch_aggregates,
+            bucket_seconds=app.config["WATCH_STATS_BUCKET_SECONDS"],
+        )
+    )
+    init_coalescer(app)
+    init_segment_cache(app)
+    init_stream_prefetcher(app)
+    init_hls_packager(app)
+    register_stats("mongodb_pools", get_pool_stats)
+    register_stats("upstream_pool", get_upstream_stats)
+    register_stats("upstream_resolver", get_resolver_stats)
+    register_stats("stream_admission", get_stream_admission_stats)
+    register_stats("segment_cache", get_segment_cache_stats)
+    register_stats("stream_prefetch", get_stream_prefetch_stats)
+    register_stats("coalesce", get_coalesce_stats)
+    register_stats("hls", get_hls_stats)
+    register_stats("playback_tokens", get_playback_token_cache_stats)
+    register_stats("video_cache", get_video_cache_stats)
+    register_stats("watch_events", get_watch_event_stats)
+    register_stats("password_hashing", get_hashing_stats)
+    register_stats("revocations", get_shared_state_stats)
+    register_stats("sessions", get_session_stats)
 
     # Register blueprints (all under /api prefix)
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
@@ -32,6 +89,12 @@ def create_app(config_class: type[Config] = Config) -> Flask:
     def health():
         return jsonify({"status": "ok"})
 
+    # Per-worker counters for proxy internals (pool hits/misses, etc.)
+    @app.get("/api/health/stats")
+    @internal_only
+    def health_stats():
+        return jsonify({"worker": os.getpid(), **collect_stats()})
+
     # Attach custom JWT unauthorized handler
     jwt_unauthorized_loader(app)
 
@@ -0,0 +1,367 @@
+"""
+ASGI entry point with a non-blocking stream proxy.
+
+``GET /api/video/<id>/stream`` is served natively on the event loop with
+httpx, so a stream does not hold a worker thread for its whole duration.
+Every other route is delegated to the regular Flask app from ``create_app``.
+
+Run:
+    uvicorn --factory asgi:create_asgi_app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+from config import Config
+from extensions.metrics import count_stream_bytes, meter_stream, observe_stage
+from extensions.prefetch import get_stream_prefetcher
+from extensions.resolver import ResolutionError, get_upstream_resolver
+from extensions.segment_cache import get_segment_cache
+from extensions.upstream import new_chunk_sizer
+from routes.video import admit_stream, authorize_stream
+from utils.proxy import forwarded_response_headers, upstream_request_headers
+
+STREAM_PATH_RE = re.compile(r"^/api/video/([^/]+)/stream$")
+
+
+class AsyncStreamProxy:
+    """ASGI handler for the video stream route.
+
+    Applies the same token check (``authorize_stream``), admission control
+    (``admit_stream``) and header forwarding rules as
+    ``routes.video.stream_video``. Fully cached ranges are read from the
+    segment cache; everything else streams from the origin through a shared
+    ``httpx.AsyncClient``.
+
+    Blocking segment-cache work (planning, recording, disk reads) runs on
+    a dedicated pool of ``ASGI_BLOCKING_THREADS`` threads rather than the
+    loop's default executor, so many cached streams cannot starve the
+    token checks and resolves that use ``asyncio.to_thread``.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._client: httpx.AsyncClient | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            config = self.flask_app.config
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config["UPSTREAM_POOL_HOSTS"]
+                    * config["UPSTREAM_POOL_MAXSIZE"],
+                    max_keepalive_connections=config["UPSTREAM_POOL_MAXSIZE"],
+                    keepalive_expiry=config["UPSTREAM_KEEPALIVE_SECONDS"],
+                ),
+                timeout=httpx.Timeout(
+                    config["UPSTREAM_READ_TIMEOUT"],
+                    connect=config["UPSTREAM_CONNECT_TIMEOUT"],
+                ),
+            )
+        return self._client
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.flask_app.config["ASGI_BLOCKING_THREADS"],
+                thread_name_prefix="asgi-blocking",
+            )
+        return self._executor
+
+    async def _blocking(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), partial(fn, *args, **kwargs)
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __call__(self, scope, receive, send, video_id: str):
+        started_at = time.perf_counter()
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        token = query.get("token", [None])[0]
+        if not token:
+            await _send_json(send, 400, {"message": "Missing playback token"})
+            return
+
+        # Usually served from the token and catalog caches; a catalog cache
+        # miss queries MongoDB, so run the check off the loop.
+        def authorize():
+            with self.flask_app.app_context():
+                return authorize_stream(token, video_id)
+
+        youtube_id, claims, status, message = await asyncio.to_thread(authorize)
+        if youtube_id is None:
+            await _send_json(send, status, {"message": message})
+            return
+
+        # A token's first request takes a shared lease, a MongoDB write.
+        def admit():
+            with self.flask_app.app_context():
+                return admit_stream(claims, token)
+
+        ticket, retry_after = await self._blocking(admit)
+        expires_at = claims["exp"]
+        if ticket is None:
+            await _send_json(
+                send,
+                503,
+                {"message": "Too many streams, retry later"},
+                [("Retry-After", str(retry_after))],
+            )
+            return
+        read_ahead = partial(_read_ahead, token, youtube_id, expires_at)
+        try:
+            await self._serve(
+                scope, receive, send, youtube_id, ticket, started_at, read_ahead
+            )
+        finally:
+            # Not awaited, so a cancelled request still frees its slot.
+            self._get_executor().submit(ticket.release)
+
+    async def _serve(
+        self, scope, receive, send, youtube_id, ticket, started_at, read_ahead
+    ):
+        resolver = get_upstream_resolver()
+        resolve_started = time.perf_counter()
+        try:
+            # Usually a cache hit; a miss blocks on the resolver's worker pool.
+            upstream_urls = await asyncio.to_thread(resolver.resolve, youtube_id)
+        except ResolutionError:
+            await _send_json(send, 502, {"message": "Upstream unavailable"})
+            return
+        observe_stage("resolve", time.perf_counter() - resolve_started)
+        request_headers = {
+            k.decode("latin-1").lower(): v.decode("latin-1")
+            for k, v in scope.get("headers", [])
+        }
+
+        # Run the body alongside a disconnect watcher so an aborted client
+        # cancels the upstream read instead of draining it.
+        body = asyncio.ensure_future(
+            self._respond(
+                send,
+                youtube_id,
+                upstream_urls,
+                request_headers,
+                ticket,
+                started_at,
+                read_ahead,
+            )
+        )
+        watcher = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({body, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (body, watcher):
+                task.cancel()
+        if body.done() and not body.cancelled() and body.exception():
+            raise body.exception()
+
+    async def _respond(
+        self,
+        send,
+        source: str,
+        upstream_urls: list[str],
+        request_headers: dict,
+        ticket,
+        started_at: float,
+        read_ahead,
+    ):
+        range_header = request_headers.get("range")
+        cache = get_segment_cache()
+        if cache is not None:
+            lookup_started = time.perf_counter()
+            plan = await self._blocking(
+                cache.plan,
+                upstream_urls[0],
+                range_header,
+                require_cached=True,
+                request_headers=request_headers,
+                source=source,
+                sizer=new_chunk_sizer(),
+            )
+            observe_stage("cache_lookup", time.perf_counter() - lookup_started)
+            if plan is not None:
+                await _send_start(send, plan["status"], list(plan["headers"].items()))
+                if plan["body"] is not None:
+                    await self._send_cached(
+                        send, meter_stream(plan["body"], "cache", started_at), ticket
+                    )
+                await send({"type": "http.response.body", "body": b""})
+                if plan["body"] is not None:
+                    read_ahead(upstream_urls[0], plan["headers"])
+                return
+
+        connect_started = time.perf_counter()
+        upstream, upstream_url = await self._open_with_failover(
+            upstream_urls,
+            upstream_request_headers(range_header, request_headers.get("if-range")),
+        )
+        if upstream is None:
+            await _send_json(send, 502, {"message": "Upstream unavailable"})
+            return
+        observe_stage("upstream_connect", time.perf_counter() - connect_started)
+
+        sent = 0
+        try:
+            if cache is not None and upstream.is_success:
+                await self._blocking(
+                    cache.observe,
+                    upstream_url,
+                    upstream.status_code,
+                    upstream.headers,
+                    range_header,
+                    source=source,
+                )
+
+            headers = forwarded_response_headers(upstream.headers)
+            if "Content-Length" in upstream.headers:
+                headers.append(("Content-Length", upstream.headers["Content-Length"]))
+            await _send_start(send, upstream.status_code, headers)
+            # Forward chunks as they arrive instead of re-buffering them into
+            # fixed sizes; the server's flow control paces slow clients.
+            async for chunk in upstream.aiter_bytes():
+                for delay in ticket.pacing_delays(len(chunk)):
+                    await asyncio.sleep(delay)
+                if not sent:
+                    observe_stage("first_byte", time.perf_counter() - started_at)
+                sent += len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+            if upstream.is_success:
+                read_ahead(upstream_url, upstream.headers)
+        finally:
+            count_stream_bytes("upstream", sent)
+            await upstream.aclose()
+
+    async def _send_cached(self, send, body, ticket):
+        """Send a cached body, reading each block on the blocking pool.
+
+        The generator is closed when sending stops, including when the
+        client disconnects. If a read is still running on the pool at
+        that point, the close waits for it to return.
+        """
+        reading = None
+        try:
+            while True:
+                reading = self._get_executor().submit(next, body, None)
+                chunk = await asyncio.wrap_future(reading)
+                if chunk is None:
+                    break
+                for delay in ticket.pacing_delays(len(chunk)):
+                    await asyncio.sleep(delay)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        finally:
+            if reading is None:
+                body.close()
+            else:
+                # Runs now if the read is done, else on the pool thread after it.
+                reading.add_done_callback(lambda _: body.close())
+
+    async def _open_with_failover(self, upstream_urls: list[str], headers: dict):
+        """Async twin of ``routes.video._open_with_failover``."""
+        client = self._get_client()
+        resolver = get_upstream_resolver()
+        upstream = None
+        for attempt, upstream_url in enumerate(upstream_urls, 1):
+            try:
+                upstream = await client.send(
+                    client.build_request("GET", upstream_url, headers=headers),
+                    stream=True,
+                )
+            except httpx.HTTPError:
+                resolver.report_failure(upstream_url)
+                continue
+            if upstream.status_code < 500:
+                return upstream, upstream_url
+            resolver.report_failure(upstream_url)
+            if attempt < len(upstream_urls):
+                await upstream.aclose()
+                upstream = None
+        if upstream is None:
+            return None, None
+        return upstream, upstream_urls[-1]
+
+
+def _read_ahead(token: str, source: str, expires_at: float, url: str, headers):
+    prefetcher = get_stream_prefetcher()
+    if prefetcher is not None:
+        prefetcher.read_ahead(token, url, source, headers, expires_at)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _send_start(send, status: int, headers: list[tuple[str, str]]):
+    raw = [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers]
+    # Mirrors the flask_cors policy applied to /api/* in create_app.
+    raw.append((b"access-control-allow-origin", b"*"))
+    await send({"type": "http.response.start", "status": status, "headers": raw})
+
+
+async def _send_json(send, status: int, payload: dict, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await _send_start(
+        send,
+        status,
+        [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            *headers,
+        ],
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(config_class: type[Config] = Config):
+    """ASGI application: async stream proxy in front of the Flask app."""
+    flask_app = create_app(config_class)
+    wsgi_app = WsgiToAsgi(flask_app)
+    stream_proxy = AsyncStreamProxy(flask_app)
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await stream_proxy.aclose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = STREAM_PATH_RE.match(scope["path"])
+            if match:
+                await stream_proxy(scope, receive, send, match.group(1))
+                return
+
+        await wsgi_app(scope, receive, send)
+
+    app.flask_app = flask_app
+    return app
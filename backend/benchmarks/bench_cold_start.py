@@ -0,0 +1,156 @@
+"""
+Cold start: import time per module and time to the first served /api/health.
+
+The import profile runs ``create_app()`` in a fresh interpreter under
+``python -X importtime``. It reports the modules with the largest own import
+time, the totals per top-level package and how long ``create_app`` itself
+took once everything was imported.
+
+The cold start benchmark launches the server ``--runs`` times and measures
+from process start until ``/api/health`` first answers 200. The server is
+``benchmarks/serve.py`` for ``wsgi`` / ``asgi`` and ``server.py`` with one
+worker for ``prefork``. No MongoDB is needed: nothing connects before the
+first query.
+
+Run:
+    python benchmarks/bench_cold_start.py [--runs 5] [--top 20] \
+        [--server wsgi|asgi|prefork] [--imports-only]
+"""
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.loadtest import _free_port  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROFILE_SNIPPET = """
+import time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+print(imported - started, time.perf_counter() - imported)
+"""
+
+
+def profile_imports(top: int):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROFILE_SNIPPET],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line.split(":", 1)[1].split("|")
+        modules.append((int(own), int(cumulative), name.strip()))
+    import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+
+    packages: Counter = Counter()
+    for own, _, name in modules:
+        packages[name.split(".")[0]] += own
+
+    print(f"{'own ms':>8} {'cum ms':>8}  module")
+    for own, cumulative, name in sorted(modules, reverse=True)[:top]:
+        print(f"{own / 1000:>8.1f} {cumulative / 1000:>8.1f}  {name}")
+    print(f"\n{'own ms':>8}  package")
+    for name, own in packages.most_common(top):
+        print(f"{own / 1000:>8.1f}  {name}")
+    print(
+        f"\n{len(modules)} modules, {sum(m[0] for m in modules) / 1000:.1f} ms "
+        f"importing; import app {import_seconds * 1000:.1f} ms, "
+        f"create_app {create_seconds * 1000:.1f} ms"
+    )
+
+
+def _command(server: str, port: int) -> list[str]:
+    if server == "prefork":
+        return [
+            sys.executable,
+            os.path.join(BACKEND_DIR, "server.py"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            "1",
+        ]
+    return [
+        sys.executable,
+        os.path.join(BACKEND_DIR, "benchmarks", "serve.py"),
+        # Never contacted: only /api/health is requested.
+        "--origin-url",
+        "http://127.0.0.1:9/unused.mp4",
+        "--port",
+        str(port),
+        "--server",
+        server,
+    ]
+
+
+def _health_ok(port: int) -> bool:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", "/api/health")
+        return conn.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def time_cold_start(server: str, timeout: float = 60.0) -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        _command(server, port),
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while not _health_ok(port):
+            if proc.poll() is not None:
+                raise SystemExit(f"server exited with status {proc.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise SystemExit("timed out waiting for /api/health")
+            time.sleep(0.002)
+        return time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--server", choices=["wsgi", "asgi", "prefork"], default="wsgi")
+    parser.add_argument("--imports-only", action="store_true")
+    args = parser.parse_args()
+
+    profile_imports(args.top)
+    if args.imports_only:
+        return
+
+    samples = [time_cold_start(args.server) for _ in range(args.runs)]
+    print(
+        f"\ncold start to first /api/health ({args.server}, {args.runs} runs): "
+        f"min {min(samples) * 1000:.0f} ms, "
+        f"median {statistics.median(samples) * 1000:.0f} ms, "
+        f"max {max(samples) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
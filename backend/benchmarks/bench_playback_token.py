@@ -0,0 +1,77 @@
+"""
+Per-request cost of authorizing a /stream request.
+
+"before" is the original path: a Video lookup plus a full JWT decode on every
+Range request. "after" is the current path: the in-process verified-token
+cache plus a Video lookup served from the catalog cache. Without --with-db
+"before" leaves the lookup out and only measures the token decode, and the
+catalog cache is primed with a stand-in document.
+
+Run:
+    python benchmarks/bench_playback_token.py [--iterations 20000] [--with-db VIDEO_ID]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models.video import Video  # noqa: E402
+from routes.video import authorize_stream  # noqa: E402
+from utils.token import _decode_playback_claims, generate_playback_token  # noqa: E402
+
+
+def _time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument(
+        "--with-db",
+        metavar="VIDEO_ID",
+        help="include a real Video.find_by_id in the 'before' path",
+    )
+    args = parser.parse_args()
+
+    app = create_app()
+    video_id = args.with_db or "000000000000000000000000"
+
+    with app.app_context():
+        secret = app.config["PLAYBACK_TOKEN_SECRET"]
+        token, _ = generate_playback_token(
+            video_id=video_id, youtube_id="bench", active=True
+        )
+        if not args.with_db:
+            stand_in = {"_id": ObjectId(video_id), "youtube_id": "bench"}
+            Video._cached(("id", ObjectId(video_id)), lambda: stand_in)
+
+        def before():
+            if args.with_db:
+                Video.find_by_id(video_id)
+            _decode_playback_claims(token, secret)
+
+        def after():
+            authorize_stream(token, video_id)
+
+        after()  # warm the verified-token cache
+        before_us = _time_per_call(before, args.iterations)
+        after_us = _time_per_call(after, args.iterations)
+
+    print(f"iterations: {args.iterations}")
+    print(f"before: {before_us:8.2f} us/request")
+    print(f"after:  {after_us:8.2f} us/request")
+    print(f"speedup: {before_us / after_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
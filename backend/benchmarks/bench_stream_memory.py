@@ -0,0 +1,262 @@
+"""
+Server memory per open stream when clients read slowly.
+
+Starts a local origin and the API (``benchmarks/serve.py``) in a subprocess,
+then for each level in ``--levels`` opens that many streams from clients that
+read at ``--read-kbps`` through a small receive buffer, holds them for
+``--hold`` seconds and samples the server's RSS. Reports the idle baseline,
+the peak and median RSS while the streams are open and the increase per
+stream.
+
+Every stream re-checks that its video is still active, so one video document
+is seeded into a MongoDB: ``--mongodb-uri``, or a ``mongod`` started from
+PATH (or ``--mongod``). Each token carries its own upstream key, so streams
+do not share an upstream source. The segment cache and coalescing are off
+unless ``--cache`` / ``--coalesce`` are given, so the numbers are for the
+pass-through path. ``--chunk-min-kb`` / ``--chunk-max-kb`` override
+``STREAM_CHUNK_*``; setting both to 1024 approximates fixed 1 MiB chunks for
+comparison.
+
+Run:
+    python benchmarks/bench_stream_memory.py [--levels 8,32,128] \
+        [--hold 10] [--read-kbps 256] [--server wsgi|asgi]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from bson import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.loadtest import (  # noqa: E402
+    _free_port,
+    _read_rss_bytes,
+    _start_mongod,
+    _wait_for,
+)
+from benchmarks.origin import MediaOrigin  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_ID = "0" * 24
+DB_NAME = "video_app_bench_memory"
+
+
+class SlowClient:
+    """One raw-socket stream request that drains at a fixed rate."""
+
+    def __init__(self, base_url: str, token: str, read_bps: int, rcvbuf: int):
+        parts = urlsplit(base_url)
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.connect((parts.hostname, parts.port))
+        self.sock.sendall(
+            (
+                f"GET /api/video/{VIDEO_ID}/stream?token={token} HTTP/1.1\r\n"
+                f"Host: {parts.netloc}\r\n"
+                "Range: bytes=0-\r\n"
+                "\r\n"
+            ).encode()
+        )
+        self.read_bps = read_bps
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        slice_seconds = 0.05
+        per_slice = max(1, int(self.read_bps * slice_seconds))
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                data = self.sock.recv(per_slice)
+                if not data:
+                    return
+                self.received += len(data)
+                self._stop.wait(max(0.0, slice_seconds - (time.monotonic() - started)))
+        except OSError:
+            return
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.sock.close()
+        finally:
+            self._thread.join(2)
+
+
+def _mint_tokens(count: int) -> list[str]:
+    # Same environment as the server, so the same signing secret.
+    from app import create_app
+    from utils.token import generate_playback_token
+
+    app = create_app()
+    with app.app_context():
+        return [
+            generate_playback_token(VIDEO_ID, youtube_id=f"bench-{i}", active=True)[0]
+            for i in range(count)
+        ]
+
+
+def _sample_rss(pid: int, seconds: float, interval: float = 0.1) -> list[int]:
+    samples = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        rss = _read_rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        time.sleep(interval)
+    return samples
+
+
+def run_level(args, base_url: str, pid: int, tokens: list[str], count: int) -> dict:
+    baseline = statistics.median(_sample_rss(pid, 1.0))
+    clients = [
+        SlowClient(base_url, tokens[i], args.read_kbps * 1024, args.rcvbuf_kb * 1024)
+        for i in range(count)
+    ]
+    try:
+        # Let every stream reach its steady state before measuring.
+        time.sleep(min(2.0, args.hold / 2))
+        samples = _sample_rss(pid, args.hold)
+    finally:
+        for client in clients:
+            client.close()
+    # Give the server time to notice the disconnects before the next level.
+    time.sleep(1.0)
+    median = statistics.median(samples)
+    return {
+        "streams": count,
+        "baseline_mb": baseline / 2**20,
+        "median_mb": median / 2**20,
+        "peak_mb": max(samples) / 2**20,
+        "per_stream_kb": (median - baseline) / count / 1024,
+        "received_mb": sum(c.received for c in clients) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", default="8,32,128")
+    parser.add_argument("--hold", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--read-kbps", type=int, default=256)
+    parser.add_argument(
+        "--rcvbuf-kb", type=int, default=16, help="client socket receive buffer"
+    )
+    parser.add_argument("--media-mb", type=int, default=1024)
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--cache", action="store_true", help="enable the segment cache")
+    parser.add_argument("--coalesce", action="store_true", help="enable coalescing")
+    parser.add_argument("--chunk-min-kb", type=int)
+    parser.add_argument("--chunk-max-kb", type=int)
+    parser.add_argument(
+        "--mongodb-uri", help="use this MongoDB instead of starting one"
+    )
+    parser.add_argument("--mongod", default="mongod", help="mongod binary to start")
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.levels.split(",") if n]
+    workdir = tempfile.mkdtemp(prefix="bench-mem-")
+    env_overrides = {
+        "MONGODB_DB_NAME": DB_NAME,
+        "MONGODB_ENSURE_INDEXES": "0",
+        "SEGMENT_CACHE_ENABLED": "1" if args.cache else "0",
+        "SEGMENT_CACHE_DIR": os.path.join(workdir, "segments"),
+        "COALESCE_ENABLED": "1" if args.coalesce else "0",
+        "HLS_ENABLED": "0",
+        "STREAM_MAX_PER_USER": "0",
+        "STREAM_MAX_PER_TOKEN": "0",
+        "STREAM_MAX_CONCURRENT": "0",
+        "STREAM_EGRESS_BYTES_PER_SECOND": "0",
+    }
+    if args.chunk_min_kb:
+        env_overrides["STREAM_CHUNK_MIN_BYTES"] = str(args.chunk_min_kb * 1024)
+    if args.chunk_max_kb:
+        env_overrides["STREAM_CHUNK_MAX_BYTES"] = str(args.chunk_max_kb * 1024)
+    os.environ.update(env_overrides)
+
+    mongod = origin = server = None
+    results = []
+    try:
+        if args.mongodb_uri:
+            mongodb_uri = args.mongodb_uri
+        else:
+            binary = shutil.which(args.mongod)
+            if binary is None:
+                raise SystemExit(
+                    f"{args.mongod!r} not found; install MongoDB or pass --mongodb-uri"
+                )
+            mongod, mongodb_uri = _start_mongod(binary, workdir)
+        os.environ["MONGODB_URI"] = mongodb_uri
+        with MongoClient(mongodb_uri) as mongo:
+            mongo[DB_NAME]["videos"].replace_one(
+                {"_id": ObjectId(VIDEO_ID)},
+                {"title": "Bench", "youtube_id": "bench0video", "is_active": True},
+                upsert=True,
+            )
+
+        origin = MediaOrigin(args.media_mb * 2**20).start()
+        port = _free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BACKEND_DIR, "benchmarks", "serve.py"),
+                "--origin-url",
+                origin.url,
+                "--port",
+                str(port),
+                "--server",
+                args.server,
+            ],
+            cwd=BACKEND_DIR,
+            env=dict(os.environ),
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        _wait_for(
+            lambda: requests.get(base_url + "/api/health", timeout=1).ok,
+            60,
+            "API server",
+        )
+        tokens = _mint_tokens(max(levels))
+        for count in levels:
+            print(f"holding {count} slow streams ...", file=sys.stderr)
+            results.append(run_level(args, base_url, server.pid, tokens, count))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+        if origin is not None:
+            origin.stop()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait(30)
+        elif args.mongodb_uri:
+            MongoClient(args.mongodb_uri).drop_database(DB_NAME)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"{'streams':>8} {'base MB':>9} {'median MB':>10} {'peak MB':>9} "
+        f"{'KiB/stream':>11} {'read MB':>9}"
+    )
+    for row in results:
+        print(
+            f"{row['streams']:>8} {row['baseline_mb']:>9.1f} {row['median_mb']:>10.1f} "
+            f"{row['peak_mb']:>9.1f} {row['per_stream_kb']:>11.1f} "
+            f"{row['received_mb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
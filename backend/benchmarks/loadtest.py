@@ -0,0 +1,515 @@
+"""
+Load test for the API and the stream proxy.
+
+Boots the app (``benchmarks/serve.py``) in a subprocess against a throwaway
+MongoDB and a local origin serving a large MP4 (``benchmarks/origin.py``),
+then drives each scenario with a pool of client threads:
+
+    login       login bursts over the seeded users
+    dashboard   dashboard polling
+    play_token  playback-token issuance
+    stream      concurrent Range requests with random seeks
+    watch       watch-event floods through the batch endpoint
+    mixed       a weighted mix of all of the above
+
+For each scenario it reports p50/p95/p99 latency, requests/s, bytes/s and the
+server's peak RSS. ``--save-baseline`` stores the results as JSON and
+``--compare`` fails (exit 1) when a run regresses past ``--tolerance``.
+
+MongoDB: without ``--mongodb-uri`` a ``mongod`` from PATH (or ``--mongod``)
+is started on a temporary dbpath and removed afterwards. With a URI, the
+``--db-name`` database is dropped at the end unless ``--keep-db`` is given.
+
+Run:
+    python benchmarks/loadtest.py [--scenarios stream,dashboard] \
+        [--duration 20] [--concurrency 16] \
+        [--save-baseline benchmarks/baselines/local.json] \
+        [--compare benchmarks/baselines/local.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import requests
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.origin import MediaOrigin  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["login", "dashboard", "play_token", "stream", "watch", "mixed"]
+MIXED_WEIGHTS = {
+    "dashboard": 40,
+    "play_token": 15,
+    "stream": 25,
+    "watch": 15,
+    "login": 5,
+}
+# Metric -> direction in which a change is a regression.
+COMPARED_METRICS = {
+    "p50_ms": "higher",
+    "p95_ms": "higher",
+    "p99_ms": "higher",
+    "rps": "lower",
+    "bytes_per_s": "lower",
+    "peak_rss_mb": "higher",
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"timed out waiting for {what}")
+
+
+def _start_mongod(binary: str, workdir: str) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    dbpath = os.path.join(workdir, "db")
+    os.makedirs(dbpath)
+    proc = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    uri = f"mongodb://127.0.0.1:{port}"
+    client = MongoClient(uri, serverSelectionTimeoutMS=500)
+    _wait_for(lambda: client.admin.command("ping"), 30, "mongod")
+    client.close()
+    return proc, uri
+
+
+def _read_rss_bytes(pid: int) -> int | None:
+    """Current resident set size of ``pid`` (Linux /proc, else psutil)."""
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+        return None
+
+
+class RssSampler:
+    """Samples a process's RSS in the background and keeps the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: int | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _read_rss_bytes(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    last = len(sorted_values) - 1
+    return sorted_values[min(last, int(round(pct / 100 * last)))]
+
+
+class Client:
+    """One simulated user: a logged-in session plus a cached playback token."""
+
+    def __init__(self, ctx: dict, user: dict):
+        self.ctx = ctx
+        self.user = user
+        self.http = requests.Session()
+        self.http.headers["Authorization"] = f"Bearer {user['access_token']}"
+        self.play_tokens: dict[str, tuple[str, float]] = {}
+
+    def url(self, path: str) -> str:
+        return self.ctx["base_url"] + path
+
+    def playback_token(self, video_id: str) -> tuple[str | None, int]:
+        """Cached token for ``video_id``, or ``(None, status)`` if minting failed."""
+        token, expires_at = self.play_tokens.get(video_id, (None, 0))
+        if token is None or expires_at - time.monotonic() < 30:
+            resp = self.http.post(self.url(f"/api/video/{video_id}/play"))
+            if not resp.ok:
+                return None, resp.status_code
+            body = resp.json()
+            token = body["playback_token"]
+            self.play_tokens[video_id] = (token, time.monotonic() + body["expires_in"])
+        return token, 200
+
+    # Each operation returns (status_code, bytes_received).
+
+    def login(self):
+        resp = requests.post(
+            self.url("/api/auth/login"),
+            json={"email": self.user["email"], "password": self.user["password"]},
+        )
+        return resp.status_code, len(resp.content)
+
+    def dashboard(self):
+        resp = self.http.get(self.url("/api/dashboard"))
+        return resp.status_code, len(resp.content)
+
+    def play_token(self):
+        video_id = random.choice(self.ctx["video_ids"])
+        resp = self.http.post(self.url(f"/api/video/{video_id}/play"))
+        return resp.status_code, len(resp.content)
+
+    def stream(self):
+        video_id = random.choice(self.ctx["video_ids"])
+        token, status = self.playback_token(video_id)
+        if token is None:
+            return status, 0
+        length = self.ctx["range_bytes"]
+        # Some requests open the video at byte 0, the rest seek somewhere random.
+        if random.random() < 0.3:
+            start = 0
+        else:
+            start = random.randrange(0, self.ctx["media_size"] - length)
+        resp = self.http.get(
+            self.url(f"/api/video/{video_id}/stream"),
+            params={"token": token},
+            headers={"Range": f"bytes={start}-{start + length - 1}"},
+            stream=True,
+        )
+        received = 0
+        try:
+            for chunk in resp.iter_content(64 * 1024):
+                received += len(chunk)
+        finally:
+            resp.close()
+        return resp.status_code, received
+
+    def watch(self):
+        events = [
+            {
+                "video_id": random.choice(self.ctx["video_ids"]),
+                "event": random.choice(["progress", "pause", "resume"]),
+                "timestamp": random.randint(0, 600),
+            }
+            for _ in range(self.ctx["watch_batch"])
+        ]
+        resp = self.http.post(
+            self.url("/api/video/watch/batch"), json={"events": events}
+        )
+        return resp.status_code, len(resp.content)
+
+    def mixed(self):
+        names = list(MIXED_WEIGHTS)
+        name = random.choices(names, weights=[MIXED_WEIGHTS[n] for n in names])[0]
+        return getattr(self, name)()
+
+
+def run_scenario(
+    name: str, clients: list[Client], duration: float, server_pid: int
+) -> dict:
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    totals = {"bytes": 0, "errors": 0}
+
+    def worker(client: Client):
+        op = getattr(client, name)
+        local_latencies = []
+        local_statuses = Counter()
+        local_bytes = local_errors = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status, received = op()
+            except requests.RequestException:
+                status, received = "connection_error", 0
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] += 1
+            local_bytes += received
+            if status == "connection_error" or status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+            totals["bytes"] += local_bytes
+            totals["errors"] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in clients]
+    started = time.perf_counter()
+    with RssSampler(server_pid) as rss:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": totals["errors"],
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "rps": round(len(latencies) / elapsed, 1),
+        "bytes_per_s": round(totals["bytes"] / elapsed),
+        "peak_rss_mb": round(rss.peak / 2**20, 1) if rss.peak is not None else None,
+    }
+
+
+def _seed(db, video_count: int) -> list[str]:
+    db["videos"].delete_many({"title": {"$regex": "^Bench video "}})
+    result = db["videos"].insert_many(
+        [
+            {
+                "title": f"Bench video {i}",
+                "description": "Load-test fixture.",
+                "youtube_id": f"bench{i:06d}",
+                "thumbnail_url": "",
+                "is_active": True,
+            }
+            for i in range(video_count)
+        ]
+    )
+    return [str(_id) for _id in result.inserted_ids]
+
+
+def _create_users(base_url: str, count: int) -> list[dict]:
+    users = []
+    for i in range(count):
+        user = {"email": f"bench{i}@example.com", "password": f"bench-password-{i}"}
+        requests.post(
+            base_url + "/api/auth/signup",
+            json={"name": f"Bench {i}", **user},
+        )
+        resp = requests.post(base_url + "/api/auth/login", json=user)
+        resp.raise_for_status()
+        user["access_token"] = resp.json()["access_token"]
+        users.append(user)
+    return users
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Describe every metric that moved the wrong way by more than ``tolerance``."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, worse in COMPARED_METRICS.items():
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (worse == "higher" and change > tolerance) or (
+                worse == "lower" and change < -tolerance
+            ):
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def _print_table(results: dict):
+    header = f"{'scenario':<11} {'reqs':>7} {'err':>5} {'p50 ms':>8} {'p95 ms':>8} "
+    header += f"{'p99 ms':>8} {'req/s':>8} {'MB/s':>8} {'peak RSS MB':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        rss = "n/a" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.1f}"
+        print(
+            f"{name:<11} {r['requests']:>7} {r['errors']:>5} {r['p50_ms']:>8.1f} "
+            f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['rps']:>8.1f} "
+            f"{r['bytes_per_s'] / 2**20:>8.1f} {rss:>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument(
+        "--duration", type=float, default=15.0, help="seconds per scenario"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--media-mb", type=int, default=1024)
+    parser.add_argument(
+        "--range-kb", type=int, default=1024, help="KiB per stream request"
+    )
+    parser.add_argument("--watch-batch", type=int, default=50)
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument(
+        "--mongodb-uri", help="use this MongoDB instead of starting one"
+    )
+    parser.add_argument("--mongod", default="mongod", help="mongod binary to start")
+    parser.add_argument("--db-name", default="video_app_bench")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument(
+        "--keep-login-limit",
+        action="store_true",
+        help="keep LOGIN_RATE_LIMIT (otherwise raised so login bursts measure hashing)",
+    )
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    mongod = server = origin = None
+    try:
+        if args.mongodb_uri:
+            mongodb_uri = args.mongodb_uri
+        else:
+            binary = shutil.which(args.mongod)
+            if binary is None:
+                raise SystemExit(
+                    f"{args.mongod!r} not found; install MongoDB or pass --mongodb-uri"
+                )
+            mongod, mongodb_uri = _start_mongod(binary, workdir)
+
+        mongo = MongoClient(mongodb_uri)
+        video_ids = _seed(mongo[args.db_name], args.videos)
+
+        origin = MediaOrigin(args.media_mb * 2**20).start()
+        port = _free_port()
+        env = {
+            **os.environ,
+            "MONGODB_URI": mongodb_uri,
+            "MONGODB_DB_NAME": args.db_name,
+            "SEGMENT_CACHE_DIR": os.path.join(workdir, "segments"),
+            "WATCH_EVENT_SPILL_PATH": os.path.join(workdir, "watch-spill.jsonl"),
+        }
+        if not args.keep_login_limit:
+            env["LOGIN_RATE_LIMIT"] = "1000000 per minute"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BACKEND_DIR, "benchmarks", "serve.py"),
+                "--origin-url",
+                origin.url,
+                "--port",
+                str(port),
+                "--server",
+                args.server,
+            ],
+            cwd=BACKEND_DIR,
+            env=env,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        _wait_for(
+            lambda: requests.get(base_url + "/api/health", timeout=1).ok,
+            60,
+            "API server",
+        )
+
+        ctx = {
+            "base_url": base_url,
+            "video_ids": video_ids,
+            "media_size": origin.size,
+            "range_bytes": args.range_kb * 1024,
+            "watch_batch": args.watch_batch,
+        }
+        users = _create_users(base_url, args.users)
+        clients = [Client(ctx, users[i % len(users)]) for i in range(args.concurrency)]
+
+        results = {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "server": args.server,
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "media_mb": args.media_mb,
+                "range_kb": args.range_kb,
+                "watch_batch": args.watch_batch,
+            },
+            "scenarios": {},
+        }
+        for name in scenarios:
+            print(f"running {name} ...", file=sys.stderr)
+            results["scenarios"][name] = run_scenario(
+                name, clients, args.duration, server.pid
+            )
+        results["origin"] = origin.stats()
+        results["server_stats"] = requests.get(base_url + "/api/health/stats").json()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+        if origin is not None:
+            origin.stop()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait(30)
+        elif args.mongodb_uri and not args.keep_db:
+            MongoClient(args.mongodb_uri).drop_database(args.db_name)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_table(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"regressions beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
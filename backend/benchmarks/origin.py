@@ -0,0 +1,169 @@
+"""
+Local HTTP origin serving one large MP4 with Range support.
+
+Stands in for the YouTube upstream in benchmarks so results do not depend on
+the network. The file is sparse (an ``ftyp`` box followed by a zero-filled
+``mdat``), so a multi-GB "video" costs no disk space.
+
+Run standalone:
+    python benchmarks/origin.py [--port 8090] [--size-mb 512]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_SIZE = 256 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def make_sample_mp4(path: str, size: int) -> str:
+    """Create a sparse file of ``size`` bytes that starts like an MP4."""
+    ftyp = b"\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2"
+    mdat_size = size - len(ftyp)
+    with open(path, "wb") as fh:
+        fh.write(ftyp)
+        fh.write((1).to_bytes(4, "big") + b"mdat" + mdat_size.to_bytes(8, "big"))
+        fh.truncate(size)
+    return path
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002 - stdlib signature
+        pass
+
+    def _byte_range(self, size: int):
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        match = _RANGE_RE.match(header.strip())
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first == "":
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return False
+        return start, end
+
+    def _respond(self, send_body: bool):
+        server = self.server
+        size = server.media_size
+        byte_range = self._byte_range(size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", server.last_modified)
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with server.stats_lock:
+            server.requests += 1
+        if not send_body:
+            return
+
+        remaining = end - start + 1
+        with open(server.media_path, "rb") as fh:
+            fh.seek(start)
+            try:
+                while remaining > 0:
+                    data = fh.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        with server.stats_lock:
+            server.bytes_sent += end - start + 1 - remaining
+
+    def do_GET(self):  # noqa: N802 - stdlib naming
+        self._respond(send_body=True)
+
+    def do_HEAD(self):  # noqa: N802 - stdlib naming
+        self._respond(send_body=False)
+
+
+class MediaOrigin:
+    """Threaded origin server; ``url`` is the MP4 address once started."""
+
+    def __init__(self, size: int, host: str = "127.0.0.1", port: int = 0):
+        self._tmpdir = tempfile.TemporaryDirectory(prefix="bench-origin-")
+        path = make_sample_mp4(os.path.join(self._tmpdir.name, "sample.mp4"), size)
+        self.server = ThreadingHTTPServer((host, port), _OriginHandler)
+        self.server.daemon_threads = True
+        self.server.media_path = path
+        self.server.media_size = size
+        self.server.etag = f'"bench-{size:x}"'
+        self.server.last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+        self.server.stats_lock = threading.Lock()
+        self.server.requests = 0
+        self.server.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/sample.mp4"
+
+    @property
+    def size(self) -> int:
+        return self.server.media_size
+
+    def start(self) -> "MediaOrigin":
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="bench-origin", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stats(self) -> dict:
+        with self.server.stats_lock:
+            return {
+                "requests": self.server.requests,
+                "bytes_sent": self.server.bytes_sent,
+            }
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._tmpdir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--size-mb", type=int, default=512)
+    args = parser.parse_args()
+
+    origin = MediaOrigin(args.size_mb * 1024 * 1024, args.host, args.port)
+    print(f"serving {args.size_mb} MB at {origin.url}")
+    try:
+        origin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        origin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Run the API for benchmarks, with every video resolving to a local origin.
+
+Started as a subprocess by ``loadtest.py`` so the server's memory can be
+measured on its own. The upstream resolver's URL template is set to
+``--origin-url``; everything else is the normal ``create_app``.
+
+Run:
+    python benchmarks/serve.py --origin-url http://127.0.0.1:8090/sample.mp4 \
+        [--port 5055] [--server wsgi|asgi]
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--origin-url", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    args = parser.parse_args()
+
+    # Config reads the environment at import time, so set it first.
+    os.environ["UPSTREAM_RESOLVER_BACKEND"] = "template"
+    os.environ["UPSTREAM_URL_TEMPLATES"] = args.origin_url
+
+    if args.server == "asgi":
+        import uvicorn
+
+        import asgi
+
+        uvicorn.run(
+            asgi.create_asgi_app(),
+            host=args.host,
+            port=args.port,
+            log_level="warning",
+        )
+    else:
+        from werkzeug.serving import run_simple
+
+        from app import create_app
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        run_simple(args.host, args.port, create_app(), threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 
@@ -14,6 +15,40 @@ class Config:
     # MongoDB
     MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/video_app")
     MONGODB_DB_NAME = os.environ.get("MONGODB_DB_NAME", "video_app")
+    MONGODB_ENSURE_INDEXES = (
+        os.environ.get("MONGODB_ENSURE_INDEXES", "1") == "1"
+    )  # create registered model indexes at startup
+    # Per-workload client options (connection string syntax, over the URI's)
+    MONGODB_DEFAULT_OPTIONS = os.environ.get(
+        "MONGODB_DEFAULT_OPTIONS", "maxPoolSize=50&waitQueueTimeoutMS=2000"
+    )  # users, sessions, rate limits, revocations
+    MONGODB_STREAM_OPTIONS = os.environ.get(
+        "MONGODB_STREAM_OPTIONS",
+        "maxPoolSize=20&waitQueueTimeoutMS=500&readPreference=primaryPreferred",
+    )  # video lookups on the way to starting playback
+    MONGODB_CATALOG_OPTIONS = os.environ.get(
+        "MONGODB_CATALOG_OPTIONS",
+        "maxPoolSize=20&waitQueueTimeoutMS=2000"
+        "&readPreference=secondaryPreferred&maxStalenessSeconds=120",
+    )  # catalog listings; may lag the primary by up to the staleness bound
+    MONGODB_ANALYTICS_OPTIONS = os.environ.get(
+        "MONGODB_ANALYTICS_OPTIONS", "maxPoolSize=10&waitQueueTimeoutMS=10000&w=1"
+    )  # watch events and aggregates; e.g. add &compressors=zstd,zlib
+
+    # Read-through cache for Video catalog queries
+    VIDEO_CACHE_ENABLED = os.environ.get("VIDEO_CACHE_ENABLED", "1") == "1"
+    VIDEO_CACHE_TTL_SECONDS = float(os.environ.get("VIDEO_CACHE_TTL_SECONDS", "60"))
+    VIDEO_CACHE_MAX_ENTRIES = int(os.environ.get("VIDEO_CACHE_MAX_ENTRIES", "1024"))
+    VIDEO_CACHE_POLL_SECONDS = float(
+        os.environ.get("VIDEO_CACHE_POLL_SECONDS", "5")
+    )  # fallback when change streams are unavailable (standalone mongod)
+    VIDEO_CACHE_COALESCE_SECONDS = float(
+        os.environ.get("VIDEO_CACHE_COALESCE_SECONDS", "1")
+    )  # at most one change-stream invalidation per window (0: every event)
+
+    # Catalog listing (GET /api/videos)
+    CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", "20"))
+    CATALOG_PAGE_MAX = int(os.environ.get("CATALOG_PAGE_MAX", "100"))
 
     # JWT (for auth access/refresh tokens)
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "dev-jwt-secret-change-me")
@@ -29,10 +64,249 @@ class Config:
     PLAYBACK_TOKEN_EXPIRES_SECONDS = int(
         os.environ.get("PLAYBACK_TOKEN_EXPIRES_SECONDS", "300")
     )  # <= 5 minutes
+    PLAYBACK_TOKEN_CACHE_SIZE = int(
+        os.environ.get("PLAYBACK_TOKEN_CACHE_SIZE", "10000")
+    )  # verified tokens kept in-process until they expire
+
+    # Buffered watch analytics ingestion
+    WATCH_EVENT_QUEUE_SIZE = int(os.environ.get("WATCH_EVENT_QUEUE_SIZE", "20000"))
+    WATCH_EVENT_BATCH_SIZE = int(os.environ.get("WATCH_EVENT_BATCH_SIZE", "500"))
+    WATCH_EVENT_FLUSH_SECONDS = float(os.environ.get("WATCH_EVENT_FLUSH_SECONDS", "1"))
+    WATCH_EVENT_ENQUEUE_TIMEOUT = float(
+        os.environ.get("WATCH_EVENT_ENQUEUE_TIMEOUT", "0.05")
+    )  # wait this long for queue space before spilling / rejecting
+    WATCH_EVENT_SPILL_PATH = os.environ.get(
+        "WATCH_EVENT_SPILL_PATH", ""
+    )  # optional local write-ahead file; empty disables spilling
+    WATCH_EVENT_MAX_BATCH = int(os.environ.get("WATCH_EVENT_MAX_BATCH", "500"))
+    WATCH_STATS_BUCKET_SECONDS = int(
+        os.environ.get("WATCH_STATS_BUCKET_SECONDS", "86400")
+    )  # per-video rollup granularity (UTC-aligned)
+    WATCH_STATS_MAX_BUCKETS = int(os.environ.get("WATCH_STATS_MAX_BUCKETS", "90"))
+
+    # Password hashing (runs on a dedicated process pool). The method string
+    # includes its cost parameters; hashes made with anything else are
+    # upgraded on the next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(
+        os.environ.get("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))
+    )
+    PASSWORD_HASH_MAX_PENDING = int(
+        os.environ.get("PASSWORD_HASH_MAX_PENDING", "32")
+    )  # running + queued jobs before requests are rejected with 503
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "5"))
+
+    # Shared state for rate limits and token revocation: "mongodb" is shared
+    # by all workers, "memory" is per-process (dev / tests only).
+    SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "mongodb")
 
     # Rate limiting (for login endpoint)
-    RATELIMIT_STORAGE_URI = os.environ.get(
-        "RATELIMIT_STORAGE_URI", "memory://"
-    )  # for dev; in prod use redis
     LOGIN_RATE_LIMIT = os.environ.get("LOGIN_RATE_LIMIT", "5 per minute")
+    RATELIMIT_SYNC_SECONDS = float(
+        os.environ.get("RATELIMIT_SYNC_SECONDS", "0")
+    )  # 0 = write every hit through; >0 batches counter increments per key
+
+    # Login sessions (rotating refresh tokens)
+    SESSION_IDENTITY_CACHE_SIZE = int(
+        os.environ.get("SESSION_IDENTITY_CACHE_SIZE", "10000")
+    )  # resolved users kept per worker, by token jti, until the token expires
+
+    # JWT revocation (logout)
+    REVOCATION_SYNC_SECONDS = float(
+        os.environ.get("REVOCATION_SYNC_SECONDS", "5")
+    )  # how quickly other workers see a revocation
+    REVOCATION_REBUILD_SECONDS = float(
+        os.environ.get("REVOCATION_REBUILD_SECONDS", "3600")
+    )  # rebuild the Bloom filter to drop expired tokens
+    REVOCATION_BLOOM_CAPACITY = int(
+        os.environ.get("REVOCATION_BLOOM_CAPACITY", "100000")
+    )
+    REVOCATION_BLOOM_ERROR_RATE = float(
+        os.environ.get("REVOCATION_BLOOM_ERROR_RATE", "0.001")
+    )
+
+    # Upstream video proxy connection pool (per worker process)
+    UPSTREAM_POOL_HOSTS = int(os.environ.get("UPSTREAM_POOL_HOSTS", "4"))
+    UPSTREAM_POOL_MAXSIZE = int(
+        os.environ.get("UPSTREAM_POOL_MAXSIZE", "32")
+    )  # max open connections per upstream host
+    UPSTREAM_KEEPALIVE_SECONDS = int(os.environ.get("UPSTREAM_KEEPALIVE_SECONDS", "60"))
+    UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+    UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "30"))
+
+    # Upstream URL resolution: "template" or a "module:Class" ResolverBackend
+    UPSTREAM_RESOLVER_BACKEND = os.environ.get("UPSTREAM_RESOLVER_BACKEND", "template")
+    UPSTREAM_URL_TEMPLATES = os.environ.get(
+        "UPSTREAM_URL_TEMPLATES",
+        "http://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4",
+    )  # comma-separated origins, preferred first; "{key}" becomes the youtube_id
+    UPSTREAM_URL_TTL_SECONDS = float(
+        os.environ.get("UPSTREAM_URL_TTL_SECONDS", "0")
+    )  # lifetime of template URLs; 0 = never expire
+    UPSTREAM_RESOLVE_MARGIN_SECONDS = float(
+        os.environ.get("UPSTREAM_RESOLVE_MARGIN_SECONDS", "60")
+    )  # stop handing out a URL this long before it expires
+    UPSTREAM_REFRESH_AHEAD_SECONDS = float(
+        os.environ.get("UPSTREAM_REFRESH_AHEAD_SECONDS", "300")
+    )  # re-resolve hot entries in the background this early
+    UPSTREAM_RESOLVER_HOT_SECONDS = float(
+        os.environ.get("UPSTREAM_RESOLVER_HOT_SECONDS", "900")
+    )  # an entry used this recently is kept fresh
+    UPSTREAM_RESOLVER_MAX_ENTRIES = int(
+        os.environ.get("UPSTREAM_RESOLVER_MAX_ENTRIES", "10000")
+    )
+    UPSTREAM_RESOLVER_WORKERS = int(os.environ.get("UPSTREAM_RESOLVER_WORKERS", "4"))
+    UPSTREAM_RESOLVE_TIMEOUT = float(
+        os.environ.get("UPSTREAM_RESOLVE_TIMEOUT", "5")
+    )  # max wait for a resolution on the request path
+    UPSTREAM_ORIGIN_COOLDOWN_SECONDS = float(
+        os.environ.get("UPSTREAM_ORIGIN_COOLDOWN_SECONDS", "30")
+    )  # a failed origin is tried last for this long
+
+    # Stream admission control and egress pacing (0 = off). The user limit
+    # holds across workers, the token limit per worker; the others are per
+    # host, split evenly across SERVER_WORKERS.
+    STREAM_MAX_PER_USER = int(
+        os.environ.get("STREAM_MAX_PER_USER", "4")
+    )  # playback tokens in use at once
+    STREAM_MAX_PER_TOKEN = int(
+        os.environ.get("STREAM_MAX_PER_TOKEN", "4")
+    )  # open requests; players overlap parallel ranges and seeks
+    STREAM_MAX_CONCURRENT = int(os.environ.get("STREAM_MAX_CONCURRENT", "0"))
+    STREAM_EGRESS_BYTES_PER_SECOND = int(
+        os.environ.get("STREAM_EGRESS_BYTES_PER_SECOND", "0")
+    )  # shared by every stream on the host
+    STREAM_EGRESS_BURST_BYTES = int(
+        os.environ.get("STREAM_EGRESS_BURST_BYTES", str(4 * 1024 * 1024))
+    )
+    STREAM_EGRESS_MAX_BACKLOG_SECONDS = float(
+        os.environ.get("STREAM_EGRESS_MAX_BACKLOG_SECONDS", "2")
+    )  # refuse new streams while the egress bucket is this far behind
+    STREAM_BUSY_RETRY_SECONDS = int(os.environ.get("STREAM_BUSY_RETRY_SECONDS", "2"))
+    STREAM_LEASE_SECONDS = float(
+        os.environ.get("STREAM_LEASE_SECONDS", "60")
+    )  # idle or orphaned playback tokens stop counting after about this
+
+    # Stream body chunking
+    STREAM_CHUNK_MIN_BYTES = int(
+        os.environ.get("STREAM_CHUNK_MIN_BYTES", str(16 * 1024))
+    )
+    STREAM_CHUNK_MAX_BYTES = int(
+        os.environ.get("STREAM_CHUNK_MAX_BYTES", str(256 * 1024))
+    )  # also the most one stream holds while its client drains it
+    STREAM_CHUNK_TARGET_SECONDS = float(
+        os.environ.get("STREAM_CHUNK_TARGET_SECONDS", "0.1")
+    )  # chunks are sized to what the client drains in this long
+
+    # On-disk block cache for proxied video bytes
+    SEGMENT_CACHE_ENABLED = os.environ.get("SEGMENT_CACHE_ENABLED", "1") == "1"
+    SEGMENT_CACHE_DIR = os.environ.get(
+        "SEGMENT_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "video_segment_cache"),
+    )
+    SEGMENT_CACHE_BLOCK_BYTES = int(
+        os.environ.get("SEGMENT_CACHE_BLOCK_BYTES", str(1024 * 1024))
+    )
+    SEGMENT_CACHE_MAX_BYTES = int(
+        os.environ.get("SEGMENT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))
+    )
+    SEGMENT_CACHE_FILL_WORKERS = int(os.environ.get("SEGMENT_CACHE_FILL_WORKERS", "2"))
+    SEGMENT_CACHE_MAX_RUN_BLOCKS = int(
+        os.environ.get("SEGMENT_CACHE_MAX_RUN_BLOCKS", "16")
+    )  # blocks fetched per upstream request on a miss
+    SEGMENT_CACHE_META_TTL_SECONDS = float(
+        os.environ.get("SEGMENT_CACHE_META_TTL_SECONDS", "5")
+    )  # re-check a file's meta.json (another worker may rewrite it) after this
+
+    # Stream prefetch into the segment cache (needs SEGMENT_CACHE_ENABLED)
+    STREAM_PREFETCH_ENABLED = os.environ.get("STREAM_PREFETCH_ENABLED", "1") == "1"
+    STREAM_PREFETCH_OPENING_BYTES = int(
+        os.environ.get("STREAM_PREFETCH_OPENING_BYTES", str(2 * 1024 * 1024))
+    )  # fetched when a playback token is issued (0 = off)
+    STREAM_PREFETCH_MOOV_MAX_BYTES = int(
+        os.environ.get("STREAM_PREFETCH_MOOV_MAX_BYTES", str(8 * 1024 * 1024))
+    )  # a trailing MP4 moov atom up to this size is fetched too (0 = off)
+    STREAM_READ_AHEAD_BYTES = int(
+        os.environ.get("STREAM_READ_AHEAD_BYTES", str(4 * 1024 * 1024))
+    )  # fetched past the end of each bounded Range served (0 = off)
+    STREAM_PREFETCH_WORKERS = int(os.environ.get("STREAM_PREFETCH_WORKERS", "2"))
+    STREAM_PREFETCH_MAX_PENDING = int(
+        os.environ.get("STREAM_PREFETCH_MAX_PENDING", "64")
+    )  # further jobs are dropped
+
+    # Single-flight coalescing of identical concurrent upstream fetches
+    COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "1") == "1"
+    COALESCE_BUFFER_BYTES = int(
+        os.environ.get("COALESCE_BUFFER_BYTES", str(8 * 1024 * 1024))
+    )  # max bytes buffered per in-flight fetch
+    COALESCE_STALL_SECONDS = float(
+        os.environ.get("COALESCE_STALL_SECONDS", "5")
+    )  # a reader holding back the others this long gets its own connection
+
+    # HLS packaging for adaptive playback (needs ffmpeg on PATH)
+    HLS_ENABLED = os.environ.get("HLS_ENABLED", "1") == "1"
+    HLS_FFMPEG = os.environ.get("HLS_FFMPEG", "ffmpeg")
+    HLS_CACHE_DIR = os.environ.get(
+        "HLS_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "video_hls_cache"),
+    )
+    HLS_CACHE_MAX_BYTES = int(
+        os.environ.get("HLS_CACHE_MAX_BYTES", str(10 * 1024 * 1024 * 1024))
+    )
+    HLS_SEGMENT_SECONDS = int(os.environ.get("HLS_SEGMENT_SECONDS", "4"))
+    HLS_RENDITIONS = os.environ.get(
+        "HLS_RENDITIONS", ""
+    )  # e.g. "720p:2800k,480p:1200k,360p:700k"; empty = one variant, no re-encode
+    HLS_PACKAGE_WORKERS = int(os.environ.get("HLS_PACKAGE_WORKERS", "1"))
+    HLS_PACKAGE_TIMEOUT = float(os.environ.get("HLS_PACKAGE_TIMEOUT", "1800"))
+    HLS_RETRY_SECONDS = float(
+        os.environ.get("HLS_RETRY_SECONDS", "300")
+    )  # wait this long before re-packaging a source that failed
+    HLS_TOKEN_EXPIRES_SECONDS = int(
+        os.environ.get("HLS_TOKEN_EXPIRES_SECONDS", "14400")
+    )  # lifetime of the token embedded in playlists
+
+    # Prometheus metrics on /api/metrics (per worker process)
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+    STATS_TOKEN = os.environ.get(
+        "STATS_TOKEN", ""
+    )  # bearer token for /api/metrics and /api/health/stats; empty = loopback only
+    METRICS_PROFILE_KEY = os.environ.get(
+        "METRICS_PROFILE_KEY", ""
+    )  # send as X-Profile to sample-profile one request; empty disables
+    METRICS_PROFILE_SAMPLE_RATE = float(
+        os.environ.get("METRICS_PROFILE_SAMPLE_RATE", "0")
+    )  # fraction of all requests to profile
+    METRICS_PROFILE_INTERVAL_MS = float(
+        os.environ.get("METRICS_PROFILE_INTERVAL_MS", "5")
+    )
+    METRICS_PROFILE_DIR = os.environ.get(
+        "METRICS_PROFILE_DIR",
+        os.path.join(tempfile.gettempdir(), "video_app_profiles"),
+    )
 
+    # Production server (server.py): preforked workers with split thread pools
+    SERVER_BIND = os.environ.get("SERVER_BIND", "0.0.0.0:5000")
+    SERVER_WORKERS = int(
+        os.environ.get("SERVER_WORKERS", "0")
+    )  # 0 = one per CPU core; set it when another server runs several workers
+    SERVER_PRELOAD = (
+        os.environ.get("SERVER_PRELOAD", "1") == "1"
+    )  # build the app once in the parent and share it copy-on-write
+    SERVER_API_THREADS = int(os.environ.get("SERVER_API_THREADS", "16"))
+    SERVER_STREAM_THREADS = int(
+        os.environ.get("SERVER_STREAM_THREADS", "64")
+    )  # per worker; /stream and /hls requests
+    SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "2048"))
+    SERVER_REQUEST_LINE_TIMEOUT = float(
+        os.environ.get("SERVER_REQUEST_LINE_TIMEOUT", "10")
+    )  # close connections that send no request line in this time
+    SERVER_REQUEST_READ_TIMEOUT = float(
+        os.environ.get("SERVER_REQUEST_READ_TIMEOUT", "30")
+    )  # then each read of the request (headers, body) must progress in this time
+    SERVER_GRACEFUL_TIMEOUT = float(
+        os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30")
+    )  # drain deadline on reload/stop; remaining streams are then cut
+    ASGI_BLOCKING_THREADS = int(
+        os.environ.get("ASGI_BLOCKING_THREADS", "16")
+    )  # asgi.py: segment-cache lookups and disk reads, off the event loop
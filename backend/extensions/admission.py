@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from extensions.shared_state import get_state_backend
+from utils.pacing import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+stream_admission = None
+
+# Streams reserve egress in slices of this size, so large chunks cannot
+# jump ahead of other viewers' smaller ones.
+PACING_QUANTUM_BYTES = 64 * 1024
+
+
+class _Session:
+    """This worker's open requests for one playback token."""
+
+    def __init__(self, holders: list[str]):
+        self.holders = holders
+        self.leased = bool(holders)
+        self.requests = 0
+        self.idle_since: float | None = None
+
+
+class StreamTicket:
+    """One admitted stream; ``release`` frees its slots (idempotent)."""
+
+    def __init__(self, controller: "StreamAdmission", session_key: str):
+        self._controller = controller
+        self._session_key = session_key
+        self._released = False
+
+    @property
+    def is_paced(self) -> bool:
+        return self._controller.bucket is not None
+
+    def pacing_delays(self, nbytes: int):
+        """Per-slice waits before ``nbytes`` may be sent (empty when unpaced)."""
+        bucket = self._controller.bucket
+        if bucket is None:
+            return
+        for offset in range(0, nbytes, PACING_QUANTUM_BYTES):
+            delay = bucket.reserve(min(PACING_QUANTUM_BYTES, nbytes - offset))
+            if delay > 0:
+                self._controller.add_paced(delay)
+                yield delay
+
+    def paced(self, chunks):
+        """Pass ``chunks`` through at this stream's share of the egress budget.
+
+        Closing this generator closes ``chunks``.
+        """
+        try:
+            for chunk in chunks:
+                for delay in self.pacing_delays(len(chunk)):
+                    time.sleep(delay)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self._session_key)
+
+
+class StreamAdmission:
+    """Admission control for the stream proxy.
+
+    A stream is admitted only while its user has fewer than ``per_user``
+    other playback tokens in use, its playback token has fewer than
+    ``per_token`` open requests on this worker, the worker has fewer than
+    ``max_streams`` in total, and the egress bucket is less than
+    ``max_backlog`` seconds behind. Anything else is refused at once so the
+    caller can answer ``503`` with ``Retry-After`` rather than queue.
+
+    The user limit spans all workers. A playback token in use holds one
+    lease in the shared-state ``backend``, keyed by the token, which every
+    Range request and seek made with it reuses; only its first request on a
+    worker writes to the backend. The lease is renewed every third of
+    ``lease_seconds`` in the background while the token has open requests,
+    and closed once it has had none for that long. ``max_streams`` and the
+    egress bucket are this worker's share of the host budget.
+
+    Admitted streams are paced against one token bucket of
+    ``egress_bytes_per_second``. Every stream reserves bandwidth in equal
+    slices, in order, so concurrent viewers get equal shares.
+    A limit of 0 disables that check.
+    """
+
+    def __init__(
+        self,
+        backend,
+        per_user: int,
+        per_token: int,
+        max_streams: int,
+        egress_bytes_per_second: int,
+        egress_burst_bytes: int,
+        max_backlog: float,
+        retry_after: int,
+        lease_seconds: float = 60.0,
+    ):
+        self.backend = backend
+        self.per_user = per_user
+        self.per_token = per_token
+        self.max_streams = max_streams
+        self.max_backlog = max_backlog
+        self.retry_after = retry_after
+        self.lease_seconds = lease_seconds
+        self.bucket = (
+            TokenBucket(egress_bytes_per_second, egress_burst_bytes)
+            if egress_bytes_per_second > 0
+            else None
+        )
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._sessions: dict[str, _Session] = {}
+        self._renewer_pid: int | None = None
+        self._counters = {
+            "admitted": 0,
+            "rejected_user": 0,
+            "rejected_token": 0,
+            "rejected_worker": 0,
+            "rejected_egress": 0,
+            "lease_errors": 0,
+            "paced_seconds": 0.0,
+        }
+
+    def admit(self, user_key: str | None, token_key: str):
+        """Return ``(ticket, 0)``, or ``(None, retry_after_seconds)``."""
+        backlog = self.bucket.backlog() if self.bucket is not None else 0.0
+        with self._lock:
+            if self.max_backlog > 0 and backlog > self.max_backlog:
+                reason, retry_after = "egress", math.ceil(backlog)
+            elif self.max_streams > 0 and self._active >= self.max_streams:
+                reason, retry_after = "worker", self.retry_after
+            else:
+                reason = None
+                self._active += 1
+            if reason is not None:
+                self._counters[f"rejected_{reason}"] += 1
+                return None, max(1, retry_after)
+
+        key = "token:" + hashlib.sha256(token_key.encode()).hexdigest()[:32]
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            # The token's first request here; later ones reuse its lease.
+            holders = []
+            if user_key is not None and self.per_user > 0:
+                holders.append(f"user:{user_key}")
+            holder = self._open_lease(key, holders)
+            if holder is not None:
+                return self._refuse(holder.split(":", 1)[0])
+            session = _Session(holders)
+
+        with self._lock:
+            session = self._sessions.setdefault(key, session)
+            if self.per_token > 0 and session.requests >= self.per_token:
+                reason = "token"
+            else:
+                reason = None
+                session.requests += 1
+                session.idle_since = None
+                self._counters["admitted"] += 1
+        if reason is not None:
+            return self._refuse(reason)
+        return StreamTicket(self, key), 0
+
+    def _refuse(self, reason: str):
+        with self._lock:
+            self._active -= 1
+            self._counters[f"rejected_{reason}"] += 1
+        return None, max(1, self.retry_after)
+
+    def _open_lease(self, key: str, holders: list[str]) -> str | None:
+        """Take or join the shared lease ``key``; returns a holder at its limit.
+
+        If the backend fails, the stream is admitted without a lease: a
+        shared-state outage should not stop playback.
+        """
+        self._ensure_renewer()
+        if not holders:
+            return None
+        limits = {holder: self.per_user for holder in holders}
+        try:
+            return self.backend.open_stream(
+                key, limits, time.time() + self.lease_seconds
+            )
+        except Exception:
+            logger.exception("Could not open a stream lease")
+            with self._lock:
+                self._counters["lease_errors"] += 1
+            return None
+
+    def _release(self, key: str):
+        with self._lock:
+            self._active -= 1
+            session = self._sessions.get(key)
+            if session is None:
+                return
+            session.requests -= 1
+            if session.requests == 0:
+                if session.leased:
+                    # Kept for a seek; the renewer closes it if none comes.
+                    session.idle_since = time.monotonic()
+                else:
+                    del self._sessions[key]
+
+    def _ensure_renewer(self):
+        pid = os.getpid()
+        if self._renewer_pid == pid:
+            return
+        with self._lock:
+            if self._renewer_pid == pid:
+                return
+            # Leases copied from a parent process are not ours to renew.
+            self._sessions.clear()
+            self._renewer_pid = pid
+        threading.Thread(
+            target=self._renew_leases, name="stream-lease-renewer", daemon=True
+        ).start()
+
+    def _renew_leases(self):
+        interval = self.lease_seconds / 3
+        while True:
+            time.sleep(interval)
+            self._renew_once(time.monotonic() - interval)
+
+    def _renew_once(self, idle_before: float):
+        """Renew leases in use; close those idle since before ``idle_before``."""
+        renew, close = {}, []
+        with self._lock:
+            for key, session in list(self._sessions.items()):
+                if session.idle_since is not None and session.idle_since < idle_before:
+                    del self._sessions[key]
+                    close.append(key)
+                elif session.leased:
+                    renew[key] = session.holders
+        if renew:
+            try:
+                # Upserts, so a lease another worker closed comes back.
+                self.backend.renew_streams(renew, time.time() + self.lease_seconds)
+            except Exception:
+                logger.exception("Could not renew %d stream leases", len(renew))
+        for key in close:
+            try:
+                self.backend.close_stream(key)
+            except Exception:
+                # The lease lapses on its own once it is no longer renewed.
+                logger.exception("Could not close stream lease %s", key)
+
+    def add_paced(self, seconds: float):
+        with self._lock:
+            self._counters["paced_seconds"] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "active": self._active,
+                "sessions": len(self._sessions),
+                "max_streams": self.max_streams,
+                "egress_backlog_seconds": (
+                    self.bucket.backlog() if self.bucket is not None else 0.0
+                ),
+            }
+
+
+def init_stream_admission(app):
+    """Create the per-process stream admission controller.
+
+    Needs ``init_shared_state``. The host-wide stream and egress budgets are
+    split evenly across ``SERVER_WORKERS`` processes.
+    """
+    global stream_admission
+
+    workers = max(1, app.config["SERVER_WORKERS"])
+    stream_admission = StreamAdmission(
+        backend=get_state_backend(),
+        per_user=app.config["STREAM_MAX_PER_USER"],
+        per_token=app.config["STREAM_MAX_PER_TOKEN"],
+        max_streams=math.ceil(app.config["STREAM_MAX_CONCURRENT"] / workers),
+        egress_bytes_per_second=app.config["STREAM_EGRESS_BYTES_PER_SECOND"]
+        // workers,
+        egress_burst_bytes=app.config["STREAM_EGRESS_BURST_BYTES"] // workers,
+        max_backlog=app.config["STREAM_EGRESS_MAX_BACKLOG_SECONDS"],
+        retry_after=app.config["STREAM_BUSY_RETRY_SECONDS"],
+        lease_seconds=app.config["STREAM_LEASE_SECONDS"],
+    )
+
+
+def get_stream_admission() -> StreamAdmission:
+    if stream_admission is None:
+        raise RuntimeError(
+            "Stream admission not initialized. Call init_stream_admission(app)."
+        )
+    return stream_admission
+
+
+def get_stream_admission_stats() -> dict:
+    return stream_admission.stats() if stream_admission is not None else {}
@@ -0,0 +1,357 @@
+import logging
+import re
+import threading
+import time
+
+from extensions.upstream import iter_upstream_body, open_upstream, release_upstream
+from utils.buffers import ChunkSizer, iter_sized
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+_LEADER_CHUNK_BYTES = 64 * 1024
+
+_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_flights: dict[tuple, "_Flight"] = {}
+_settings = {"enabled": False, "buffer_bytes": 0, "stall_seconds": 0.0}
+_counters = {"leaders": 0, "followers": 0, "detached": 0, "aborted": 0}
+
+
+class FallbackError(Exception):
+    """The origin answered a detached reader's resume request without a 206."""
+
+
+class _DirectReader:
+    """Uncoalesced upstream response with the same surface as ``FlightReader``."""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def iter_content(self, chunk_size: int):
+        return self._resp.iter_content(chunk_size=chunk_size)
+
+    def iter_body(self, sizer: ChunkSizer):
+        return iter_upstream_body(self._resp, sizer)
+
+    def close(self):
+        release_upstream(self._resp)
+
+
+class _Flight:
+    """One upstream fetch whose body is fanned out to every attached reader.
+
+    Received chunks are kept only until the slowest reader has consumed
+    them, and the leader stops reading from the origin while the buffered
+    window is over ``buffer_bytes``. A reader that keeps the window full
+    while another reader waits for data is behind; if it stays behind (does
+    not catch up to half the window) for ``stall_seconds``, it is detached
+    and continues on its own upstream connection. A slow reader that still
+    makes progress therefore slows the others for ``stall_seconds`` at most.
+    """
+
+    def __init__(self, key: tuple, url: str, headers: dict):
+        self.key = key
+        self.url = url
+        self.request_headers = headers
+        self.cond = threading.Condition()
+        self.status_code = None
+        self.headers = None
+        self.error: Exception | None = None
+        self.chunks: list[tuple[int, bytes]] = []
+        self.head = 0
+        self.done = False
+        self.trimmed = False
+        self.readers: set["FlightReader"] = set()
+
+    # Leader side -------------------------------------------------------
+
+    def run(self):
+        try:
+            resp = open_upstream(self.url, headers=self.request_headers)
+        except Exception as exc:
+            with self.cond:
+                self.error = exc
+                self.done = True
+                self.cond.notify_all()
+            self._retire()
+            return
+
+        try:
+            with self.cond:
+                self.status_code = resp.status_code
+                self.headers = resp.headers
+                self.cond.notify_all()
+            for chunk in resp.iter_content(chunk_size=_LEADER_CHUNK_BYTES):
+                admitted = self._admit(len(chunk))
+                if self.trimmed:
+                    self._retire()
+                if not admitted:
+                    with _stats_lock:
+                        _counters["aborted"] += 1
+                    return
+                with self.cond:
+                    self.chunks.append((self.head, chunk))
+                    self.head += len(chunk)
+                    self.cond.notify_all()
+        except Exception as exc:
+            logger.warning("Coalesced upstream fetch failed: %s", exc)
+            with self.cond:
+                self.error = exc
+        finally:
+            release_upstream(resp)
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+            self._retire()
+
+    def _admit(self, incoming: int) -> bool:
+        """Wait until ``incoming`` bytes fit in the window; False if nobody is left."""
+        budget = _settings["buffer_bytes"]
+        stall_seconds = _settings["stall_seconds"]
+        with self.cond:
+            while True:
+                if not self.readers:
+                    return False
+                self._trim()
+                low = min(r.pos for r in self.readers)
+                if self.head - low + incoming <= budget or self.head == low:
+                    return True
+
+                now = time.monotonic()
+                starving = any(r.pos == self.head for r in self.readers)
+                stalled = []
+                for reader in self.readers:
+                    lag = self.head - reader.pos
+                    if lag <= budget // 2:
+                        reader.behind_since = None
+                    elif starving and lag + incoming > budget:
+                        if reader.behind_since is None:
+                            reader.behind_since = now
+                        elif now - reader.behind_since >= stall_seconds:
+                            stalled.append(reader)
+                if stalled:
+                    for reader in stalled:
+                        reader.detached = True
+                        self.readers.discard(reader)
+                    with _stats_lock:
+                        _counters["detached"] += len(stalled)
+                    self.cond.notify_all()
+                    continue
+
+                # Readers notify on every read; wake up by the next deadline
+                # even if none of them does.
+                deadlines = [
+                    r.behind_since + stall_seconds
+                    for r in self.readers
+                    if r.behind_since is not None
+                ]
+                timeout = min(deadlines) - now if deadlines else stall_seconds
+                self.cond.wait(timeout=max(timeout, 0.001))
+
+    def _trim(self):
+        low = min((r.pos for r in self.readers), default=self.head)
+        while self.chunks and self.chunks[0][0] + len(self.chunks[0][1]) <= low:
+            self.chunks.pop(0)
+            # Late joiners would miss the dropped bytes; close the flight to them.
+            self.trimmed = True
+
+    def _retire(self):
+        with _lock:
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+
+    def buffered_bytes(self) -> int:
+        with self.cond:
+            return sum(len(chunk) for _, chunk in self.chunks)
+
+
+class FlightReader:
+    """A client's view of a shared upstream fetch."""
+
+    def __init__(self, flight: _Flight):
+        self._flight = flight
+        self.pos = 0
+        self.detached = False
+        # Set by the leader while this reader holds back the others.
+        self.behind_since: float | None = None
+        self._fallback = None
+
+    @property
+    def status_code(self) -> int:
+        return self._flight.status_code
+
+    @property
+    def headers(self):
+        return self._flight.headers
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def _wait_for_headers(self):
+        flight = self._flight
+        with flight.cond:
+            while flight.status_code is None and flight.error is None:
+                flight.cond.wait()
+            if flight.status_code is None:
+                self.close()
+                raise flight.error
+
+    def _next(self, chunk_size: int):
+        flight = self._flight
+        with flight.cond:
+            while True:
+                if self.detached:
+                    return None
+                if self.pos < flight.head:
+                    for offset, chunk in flight.chunks:
+                        if offset <= self.pos < offset + len(chunk):
+                            start = self.pos - offset
+                            if start == 0 and len(chunk) <= chunk_size:
+                                data = chunk
+                            else:
+                                data = chunk[start : start + chunk_size]
+                            self.pos += len(data)
+                            flight.cond.notify_all()
+                            return data
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return b""
+                flight.cond.wait()
+
+    def iter_content(self, chunk_size: int):
+        while True:
+            data = self._next(chunk_size)
+            if data is None:
+                yield from self._continue_alone(chunk_size)
+                return
+            if not data:
+                return
+            yield data
+
+    def iter_body(self, sizer: ChunkSizer):
+        """Like ``iter_content``, with chunk sizes chosen by ``sizer``.
+
+        Chunks that fit are handed out as the shared buffer objects, so
+        readers of one flight do not copy them.
+        """
+        detached = False
+
+        def read(size: int) -> bytes:
+            nonlocal detached
+            data = self._next(size)
+            if data is None:
+                detached = True
+                return b""
+            return data
+
+        yield from iter_sized(read, sizer)
+        if detached:
+            self._open_fallback()
+            for chunk in iter_upstream_body(self._fallback, sizer):
+                self.pos += len(chunk)
+                yield chunk
+
+    def _open_fallback(self):
+        """Reopen from ``pos`` on a private upstream connection after detaching.
+
+        Raises ``FallbackError`` unless the origin answers with a ``206``:
+        a full ``200`` body would be appended to the bytes already sent.
+        """
+        flight = self._flight
+        first, last = 0, ""
+        match = _CONTENT_RANGE_RE.match(flight.headers.get("Content-Range", ""))
+        if match:
+            first, last = int(match.group(1)), match.group(2)
+        headers = dict(flight.request_headers)
+        headers["Range"] = f"bytes={first + self.pos}-{last}"
+        resp = open_upstream(flight.url, headers=headers)
+        if resp.status_code != 206:
+            release_upstream(resp)
+            raise FallbackError(
+                f"Origin answered {resp.status_code} to {headers['Range']}"
+            )
+        self._fallback = resp
+
+    def _continue_alone(self, chunk_size: int):
+        self._open_fallback()
+        for chunk in self._fallback.iter_content(chunk_size=chunk_size):
+            self.pos += len(chunk)
+            yield chunk
+
+    def close(self):
+        flight = self._flight
+        with flight.cond:
+            flight.readers.discard(self)
+            flight.cond.notify_all()
+        if self._fallback is not None:
+            release_upstream(self._fallback)
+            self._fallback = None
+
+
+def init_coalescer(app):
+    """Configure single-flight coalescing of identical upstream fetches."""
+    _settings["enabled"] = app.config["COALESCE_ENABLED"]
+    _settings["buffer_bytes"] = app.config["COALESCE_BUFFER_BYTES"]
+    _settings["stall_seconds"] = app.config["COALESCE_STALL_SECONDS"]
+
+
+def open_coalesced(url: str, headers: dict | None = None):
+    """Open an upstream GET, joining an identical in-flight fetch if there is one.
+
+    The first caller for a given (URL, request headers) pair becomes the
+    leader and starts the fetch on a background thread; concurrent callers
+    read the same bytes from its buffer. The returned reader exposes
+    ``status_code``, ``headers``, ``ok``, ``iter_content`` and ``close``;
+    callers must always ``close`` it.
+    """
+    headers = dict(headers or {})
+    if not _settings["enabled"]:
+        return _DirectReader(open_upstream(url, headers=headers))
+
+    key = (url, tuple(sorted(headers.items())))
+    reader = None
+    with _lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            with flight.cond:
+                if not flight.trimmed and not flight.done:
+                    reader = FlightReader(flight)
+                    flight.readers.add(reader)
+        leader = reader is None
+        if leader:
+            flight = _Flight(key, url, headers)
+            reader = FlightReader(flight)
+            flight.readers.add(reader)
+            _flights[key] = flight
+
+    with _stats_lock:
+        _counters["leaders" if leader else "followers"] += 1
+
+    if leader:
+        threading.Thread(
+            target=flight.run, name="upstream-flight", daemon=True
+        ).start()
+    reader._wait_for_headers()
+    return reader
+
+
+def get_coalesce_stats() -> dict:
+    with _lock:
+        flights = list(_flights.values())
+    with _stats_lock:
+        counters = dict(_counters)
+    return {
+        **counters,
+        "in_flight": len(flights),
+        "buffered_bytes": sum(f.buffered_bytes() for f in flights),
+    }
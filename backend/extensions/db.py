@@ -1,26 +1,307 @@
+import logging
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from flask import current_app
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+from extensions.metrics import observe_pool_checkout
+
+logger = logging.getLogger(__name__)
+
+# Workload classes, each with its own client (and so its own connection
+# pools) configured by ``MONGODB_<CLASS>_OPTIONS``:
+#   default    users, sessions, rate limits, revocations; primary reads
+#   stream     lookups on the path to starting playback (video by id)
+#   catalog    catalog listings and the cache watcher; may read secondaries
+#   analytics  watch events and aggregates; bulk writes at ``w=1``
+WORKLOADS = ("default", "stream", "catalog", "analytics")
+
+# Set by init_db; clients are created per process, per workload, by get_db.
+_settings: dict | None = None
+_clients: dict[str, MongoClient] = {}
+_handles: dict = {}
+_monitors: dict[str, "PoolMonitor"] = {}
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool counters for one workload's client.
+
+    ``max_pool_size`` applies per server, so ``saturation`` is the busiest
+    server's checked-out connections over it; at 1.0 new operations wait
+    (up to ``waitQueueTimeoutMS``) for a connection.
+    """
+
+    def __init__(self, workload: str):
+        self.workload = workload
+        self.max_pool_size = 0
+        self._lock = threading.Lock()
+        self._checked_out: dict = {}
+        self._waiting = 0
+        self._open = 0
+        self._counters = {
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0,
+        }
+        self._wait_max = 0.0
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._waiting += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self._waiting -= 1
+            self._counters["checkouts"] += 1
+            self._checked_out[event.address] = (
+                self._checked_out.get(event.address, 0) + 1
+            )
+            self._wait_max = max(self._wait_max, event.duration or 0.0)
+        observe_pool_checkout(self.workload, event.duration or 0.0)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._waiting -= 1
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self._counters["checkout_timeouts"] += 1
+            else:
+                self._counters["checkout_failures"] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._checked_out[event.address] -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._open -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._counters["pool_clears"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            busiest = max(self._checked_out.values(), default=0)
+            return {
+                **self._counters,
+                "max_pool_size": self.max_pool_size,
+                "open": self._open,
+                "checked_out": sum(self._checked_out.values()),
+                "waiting": self._waiting,
+                "saturation": (
+                    busiest / self.max_pool_size if self.max_pool_size else 0.0
+                ),
+                "checkout_wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
 
+def client_uri(uri: str, options: str) -> str:
+    """``uri`` with the URI options in ``options`` added or overriding.
 
-mongo_client: MongoClient | None = None
-db = None
+    ``options`` uses the connection string query syntax, e.g.
+    ``maxPoolSize=20&readPreference=secondaryPreferred``.
+    """
+    parts = urlsplit(uri)
+    merged = {}
+    for key, value in parse_qsl(parts.query, keep_blank_values=True) + parse_qsl(
+        options, keep_blank_values=True
+    ):
+        # URI option names are case-insensitive.
+        merged[key.lower()] = (key, value)
+    return urlunsplit(
+        parts._replace(path=parts.path or "/", query=urlencode(list(merged.values())))
+    )
+
+
+# Model classes that declare ``indexes`` / ``query_shapes``; see register_model.
+_models: list[type] = []
+
+
+def register_model(cls):
+    """Class decorator adding a model to the index registry.
+
+    A model declares ``collection_name``, ``indexes`` (a list of
+    ``pymongo.IndexModel``) and ``query_shapes``: one dict per query it
+    issues, with ``name``, ``filter`` and optional ``sort`` / ``limit`` using
+    representative values. ``init_db`` creates the indexes; ``explain_query_shapes``
+    checks the shapes against them.
+    """
+    if cls not in _models:
+        _models.append(cls)
+    return cls
 
 
 def init_db(app):
-    """Initialize a global MongoDB client and database handle."""
-    global mongo_client, db
+    """Configure the MongoDB clients; nothing connects until first use.
+
+    Clients are created lazily by ``get_db``, once per process and
+    workload: ``MongoClient`` is not fork-safe, so a worker forked from a
+    preloaded app (see ``server.py``) opens its own pools instead of sharing
+    the parent's sockets and monitor threads. With
+    ``MONGODB_ENSURE_INDEXES``, each process creates the registered indexes
+    on a background thread after its first connection, so neither startup
+    nor the first request waits for them (or for an unreachable server).
+    """
+    global _settings
 
+    close_db()
     uri = app.config["MONGODB_URI"]
-    db_name = app.config["MONGODB_DB_NAME"]
+    _settings = {
+        "db_name": app.config["MONGODB_DB_NAME"],
+        "ensure_indexes": app.config["MONGODB_ENSURE_INDEXES"],
+        "uris": {
+            workload: client_uri(
+                uri, app.config[f"MONGODB_{workload.upper()}_OPTIONS"]
+            )
+            for workload in WORKLOADS
+        },
+    }
 
-    mongo_client = MongoClient(uri)
-    db = mongo_client[db_name]
 
+def get_db(workload: str = "default"):
+    """Get this process's database handle for ``workload``.
 
-def get_db():
-    """Get the active database handle."""
-    if db is None:
+    The workload's client connects on first use.
+    """
+    if _client_pid == os.getpid():
+        handle = _handles.get(workload)
+        if handle is not None:
+            return handle
+    if _settings is None:
         # This should not happen if init_db is called from app factory
         raise RuntimeError("Database not initialized. Call init_db(app) first.")
-    return db
+    if workload not in WORKLOADS:
+        raise ValueError(f"Unknown MongoDB workload {workload!r}")
+    return _connect(workload)
+
+
+def _connect(workload: str):
+    global _client_pid
+
+    pid = os.getpid()
+    first_in_process = False
+    with _client_lock:
+        if _client_pid != pid:
+            # Clients inherited across fork are dropped, never used or closed.
+            _clients.clear()
+            _handles.clear()
+            _monitors.clear()
+            _client_pid = pid
+            first_in_process = True
+        handle = _handles.get(workload)
+        if handle is None:
+            monitor = PoolMonitor(workload)
+            client = MongoClient(
+                _settings["uris"][workload], event_listeners=[monitor]
+            )
+            monitor.max_pool_size = client.options.pool_options.max_pool_size
+            handle = client[_settings["db_name"]]
+            _clients[workload] = client
+            _monitors[workload] = monitor
+            _handles[workload] = handle
+    if first_in_process and _settings["ensure_indexes"]:
+        threading.Thread(
+            target=_ensure_indexes_quietly, name="mongodb-indexes", daemon=True
+        ).start()
+    return handle
+
+
+def _ensure_indexes_quietly():
+    try:
+        ensure_indexes()
+    except PyMongoError:
+        # Do not take the API down because index builds failed; the
+        # check script reports missing indexes.
+        logger.exception("Could not ensure MongoDB indexes")
+
+
+def close_db():
+    """Close this process's clients; the next ``get_db`` opens new ones.
+
+    Call before forking workers so that none of them inherit open sockets.
+    """
+    global _client_pid
+
+    with _client_lock:
+        if _client_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+        _handles.clear()
+        _monitors.clear()
+        _client_pid = None
+
+
+def get_pool_stats() -> dict:
+    """Pool counters per workload, for the clients this process has opened."""
+    if _client_pid != os.getpid():
+        return {}
+    with _client_lock:
+        monitors = dict(_monitors)
+    return {workload: monitor.stats() for workload, monitor in monitors.items()}
+
+
+def ensure_indexes():
+    """Create every registered index. Safe to run repeatedly."""
+    for model in _models:
+        if model.indexes:
+            get_db()[model.collection_name].create_indexes(model.indexes)
+
+
+def _plan_stages(plan) -> set[str]:
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _plan_stages(item)
+    return stages
+
 
+def explain_query_shapes() -> list[dict]:
+    """Explain every registered query shape and report its plan stages."""
+    results = []
+    for model in _models:
+        collection = get_db()[model.collection_name]
+        for shape in model.query_shapes:
+            cursor = collection.find(shape["filter"])
+            if shape.get("sort"):
+                cursor = cursor.sort(shape["sort"])
+            if shape.get("limit"):
+                cursor = cursor.limit(shape["limit"])
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            stages = _plan_stages(plan)
+            results.append(
+                {
+                    "collection": model.collection_name,
+                    "query": shape["name"],
+                    "stages": sorted(stages),
+                    "collscan": "COLLSCAN" in stages,
+                }
+            )
+    return results
@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+_lock = threading.Lock()
+_executor: ProcessPoolExecutor | None = None
+_executor_pid: int | None = None
+_slots: threading.BoundedSemaphore | None = None
+_settings: dict = {}
+_counters = {"hashed": 0, "checked": 0, "rejected": 0, "timeouts": 0}
+
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing pool is saturated and the request should back off."""
+
+
+def init_password_hasher(app):
+    """Configure the dedicated process pool used for password hashing.
+
+    The pool is created lazily per process, so forked API workers each get
+    their own instead of inheriting a broken one.
+    """
+    global _slots
+
+    _settings.update(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"],
+    )
+    # Running plus queued hash jobs; past this we reject instead of queuing.
+    _slots = threading.BoundedSemaphore(app.config["PASSWORD_HASH_MAX_PENDING"])
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+    with _lock:
+        if _executor is None or _executor_pid != pid:
+            # spawn, not fork: the API process runs background threads and
+            # forking it could copy held locks into the hashing workers.
+            _executor = ProcessPoolExecutor(
+                max_workers=_settings["workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _executor_pid = pid
+    return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn, *args):
+    if _slots is None:
+        raise RuntimeError(
+            "Password hasher not initialized. Call init_password_hasher(app) first."
+        )
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _counters["rejected"] += 1
+        raise HashingBusy("Password hashing pool is saturated")
+    executor = future = None
+    try:
+        executor = _get_executor()
+        future = executor.submit(fn, *args)
+        try:
+            return future.result(timeout=_settings["timeout"])
+        except FutureTimeoutError:
+            # A running job cannot be cancelled. Its slot stays taken until
+            # it finishes (see finally), so timeouts cannot pile up work.
+            future.cancel()
+            with _lock:
+                _counters["timeouts"] += 1
+            raise HashingBusy("Password hashing timed out")
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); start a fresh pool next time.
+        _discard_executor(executor)
+        raise HashingBusy("Password hashing pool restarted")
+    finally:
+        if future is None:
+            slots.release()
+        else:
+            # Runs at once if the job is done or cancelled.
+            future.add_done_callback(lambda _: slots.release())
+
+
+def hash_password(password: str) -> str:
+    """Hash with the configured method on the hashing pool."""
+    result = _run(generate_password_hash, password, _settings["method"])
+    with _lock:
+        _counters["hashed"] += 1
+    return result
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    """Verify a password against a stored hash on the hashing pool."""
+    result = _run(check_password_hash, password_hash, password)
+    with _lock:
+        _counters["checked"] += 1
+    return result
+
+
+def _canonical_method(method: str) -> str:
+    """``method`` with werkzeug's defaults filled in for omitted parameters.
+
+    Stored hashes always record every parameter (``pbkdf2:sha256:600000``),
+    while the configured method may leave them out (``pbkdf2:sha256``).
+    """
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{int(iterations)}"
+    if name == "scrypt":
+        n, r, p = args if len(args) == 3 else (2**15, 8, 1)
+        return f"scrypt:{int(n)}:{int(r)}:{int(p)}"
+    return method
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """True if the stored hash was made with a different method or cost."""
+    stored = password_hash.split("$", 1)[0]
+    try:
+        return _canonical_method(stored) != _canonical_method(_settings["method"])
+    except ValueError:
+        # Unknown or malformed parameters: rehash with the configured method.
+        return True
+
+
+def get_hashing_stats() -> dict:
+    with _lock:
+        return {**_counters, "method": _settings.get("method")}
@@ -0,0 +1,370 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from extensions.resolver import ResolutionError
+
+logger = logging.getLogger(__name__)
+
+hls_packager = None
+
+# Every file the packager writes; anything else is rejected before touching disk.
+ASSET_RE = re.compile(r"^(master\.m3u8|v\d{1,2}/index\.m3u8|v\d{1,2}/seg_\d{5}\.ts)$")
+_EXTINF_RE = re.compile(r"^#EXTINF:([\d.]+)")
+_RENDITION_RE = re.compile(r"^(\d+)p?:(\d+)k$")
+
+
+def _source_key(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+
+def parse_renditions(spec: str) -> list[tuple[int, int]]:
+    """Parse ``"720p:2800k,480p:1200k"`` into ``[(720, 2800), (480, 1200)]``."""
+    renditions = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        match = _RENDITION_RE.match(part)
+        if not match:
+            raise ValueError(f"Invalid HLS rendition: {part!r}")
+        renditions.append((int(match.group(1)), int(match.group(2))))
+    return renditions
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class HlsPackager:
+    """Packages upstream MP4s into HLS and caches the result on disk.
+
+    Each source becomes ``<root>/<source key>/`` holding ``master.m3u8`` and one
+    ``v<n>/`` directory per rendition with ``index.m3u8`` and fixed-duration
+    ``seg_NNNNN.ts`` segments. Packaging runs ffmpeg in the background; a
+    build goes to a temporary directory and is renamed into place when
+    complete, so a visible package is always whole. A lock file keeps
+    workers on the same host from packaging the same source twice.
+
+    Sources are named by a stable key (the video's upstream key), not by
+    URL. The URL to package from is only resolved by the build worker, so
+    neither playback nor a package check waits on URL resolution.
+
+    With no renditions configured the source is segmented without
+    re-encoding (one variant). Otherwise each rendition is transcoded with
+    keyframes on segment boundaries so players can switch between them.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        ffmpeg: str,
+        segment_seconds: int,
+        renditions: list[tuple[int, int]],
+        workers: int,
+        timeout: float,
+        max_bytes: int,
+        retry_seconds: float,
+    ):
+        self.root = root
+        self.ffmpeg = ffmpeg
+        self.segment_seconds = segment_seconds
+        self.renditions = renditions
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+        self._failed: dict[str, float] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hls-packager"
+        )
+        self._counters = {"packaged": 0, "failed": 0, "not_ready": 0, "served": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _package_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.lock")
+
+    # Request side ------------------------------------------------------
+
+    def is_ready(self, source: str) -> bool:
+        return os.path.exists(
+            os.path.join(self._package_dir(_source_key(source)), "master.m3u8")
+        )
+
+    def ensure(self, source: str, resolve_url) -> str:
+        """Return ``"ready"``, ``"pending"`` or ``"failed"``, scheduling a build.
+
+        ``resolve_url`` is called with no arguments on the build worker and
+        returns the URL to package from.
+        """
+        if self.is_ready(source):
+            return "ready"
+        key = _source_key(source)
+        with self._lock:
+            failed_at = self._failed.get(key, float("-inf"))
+            if time.monotonic() - failed_at < self.retry_seconds:
+                return "failed"
+            self._counters["not_ready"] += 1
+            if key in self._pending:
+                return "pending"
+            self._pending.add(key)
+        self._executor.submit(self._run, source, key, resolve_url)
+        return "pending"
+
+    def asset_path(self, source: str, asset: str) -> str | None:
+        """Absolute path of a packaged file, or ``None`` if it does not exist."""
+        if not ASSET_RE.match(asset):
+            return None
+        path = os.path.join(self._package_dir(_source_key(source)), asset)
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            self._counters["served"] += 1
+        return path
+
+    def playlist(self, source: str, asset: str, token: str) -> str | None:
+        """A packaged playlist with ``token`` added to every URI in it."""
+        path = self.asset_path(source, asset)
+        if path is None or not asset.endswith(".m3u8"):
+            return None
+        if asset == "master.m3u8":
+            # Playback start marks the package as recently used for pruning.
+            try:
+                os.utime(self._package_dir(_source_key(source)))
+            except OSError:
+                pass
+        suffix = f"?token={quote(token, safe='')}"
+        with open(path) as fh:
+            lines = [
+                line if not line.strip() or line.startswith("#") else line + suffix
+                for line in fh.read().splitlines()
+            ]
+        return "\n".join(lines) + "\n"
+
+    # Packaging ---------------------------------------------------------
+
+    def _take_lock(self, key: str) -> bool:
+        path = self._lock_path(key)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(path) > self.timeout
+            except OSError:
+                stale = True
+            if not stale:
+                return False
+            # The previous owner died mid-build; take over.
+            try:
+                os.unlink(path)
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+        with os.fdopen(fd, "w") as fh:
+            fh.write(str(os.getpid()))
+        return True
+
+    def _ffmpeg_args(self, url: str, out_dir: str, rendition) -> list[str]:
+        args = [
+            self.ffmpeg,
+            "-nostdin",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            url,
+            "-map",
+            "0:v:0",
+            "-map",
+            "0:a:0?",
+        ]
+        if rendition is None:
+            args += ["-c", "copy"]
+        else:
+            height, kbps = rendition
+            args += [
+                "-vf",
+                f"scale=-2:{height}",
+                "-c:v",
+                "libx264",
+                "-preset",
+                "veryfast",
+                "-b:v",
+                f"{kbps}k",
+                "-maxrate",
+                f"{kbps}k",
+                "-bufsize",
+                f"{2 * kbps}k",
+                "-force_key_frames",
+                f"expr:gte(t,n_forced*{self.segment_seconds})",
+                "-sc_threshold",
+                "0",
+                "-c:a",
+                "aac",
+                "-b:a",
+                "128k",
+            ]
+        args += [
+            "-f",
+            "hls",
+            "-hls_time",
+            str(self.segment_seconds),
+            "-hls_playlist_type",
+            "vod",
+            "-hls_flags",
+            "independent_segments",
+            "-hls_segment_filename",
+            os.path.join(out_dir, "seg_%05d.ts"),
+            os.path.join(out_dir, "index.m3u8"),
+        ]
+        return args
+
+    @staticmethod
+    def _variant_bandwidth(variant_dir: str) -> tuple[int, int]:
+        """Peak and average bits per second over a variant's segments."""
+        peak = total_bits = total_seconds = 0
+        duration = None
+        with open(os.path.join(variant_dir, "index.m3u8")) as fh:
+            for line in fh:
+                line = line.strip()
+                match = _EXTINF_RE.match(line)
+                if match:
+                    duration = float(match.group(1))
+                elif line and not line.startswith("#") and duration:
+                    bits = os.path.getsize(os.path.join(variant_dir, line)) * 8
+                    peak = max(peak, int(bits / duration))
+                    total_bits += bits
+                    total_seconds += duration
+                    duration = None
+        average = int(total_bits / total_seconds) if total_seconds else 0
+        return peak, average
+
+    def _build(self, url: str, build_dir: str):
+        variants = self.renditions or [None]
+        entries = []
+        for index, rendition in enumerate(variants):
+            variant_dir = os.path.join(build_dir, f"v{index}")
+            os.makedirs(variant_dir)
+            subprocess.run(
+                self._ffmpeg_args(url, variant_dir, rendition),
+                check=True,
+                timeout=self.timeout,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            peak, average = self._variant_bandwidth(variant_dir)
+            attrs = f"BANDWIDTH={peak},AVERAGE-BANDWIDTH={average}"
+            entries.append(f"#EXT-X-STREAM-INF:{attrs}\nv{index}/index.m3u8")
+
+        master = "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-INDEPENDENT-SEGMENTS\n"
+        master += "\n".join(entries) + "\n"
+        with open(os.path.join(build_dir, "master.m3u8"), "w") as fh:
+            fh.write(master)
+
+    def _run(self, source: str, key: str, resolve_url):
+        build_dir = os.path.join(self.root, f"{key}.tmp.{os.getpid()}")
+        locked = False
+        try:
+            locked = self._take_lock(key)
+            if not locked or self.is_ready(source):
+                # Another worker is on it (or just finished).
+                return
+            shutil.rmtree(build_dir, ignore_errors=True)
+            self._build(resolve_url(), build_dir)
+            os.rename(build_dir, self._package_dir(key))
+            with self._lock:
+                self._counters["packaged"] += 1
+                self._failed.pop(key, None)
+            self._prune()
+        except (OSError, subprocess.SubprocessError, ResolutionError) as exc:
+            stderr = getattr(exc, "stderr", None) or b""
+            logger.error(
+                "HLS packaging failed for %s: %s %s",
+                key,
+                exc,
+                stderr.decode("utf-8", "replace")[-500:],
+            )
+            with self._lock:
+                self._counters["failed"] += 1
+                self._failed[key] = time.monotonic()
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if locked:
+                try:
+                    os.unlink(self._lock_path(key))
+                except OSError:
+                    pass
+            with self._lock:
+                self._pending.discard(key)
+
+    def _prune(self):
+        """Remove the least recently played packages beyond ``max_bytes``."""
+        packages = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and "." not in entry.name:
+                packages.append(
+                    (entry.stat().st_mtime, _dir_size(entry.path), entry.path)
+                )
+        used = sum(size for _, size, _ in packages)
+        for _, size, path in sorted(packages):
+            if used <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            used -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "in_progress": len(self._pending)}
+
+
+def init_hls_packager(app):
+    """Create the per-process HLS packager if enabled and ffmpeg is present."""
+    global hls_packager
+
+    hls_packager = None
+    if not app.config["HLS_ENABLED"]:
+        return
+    ffmpeg = shutil.which(app.config["HLS_FFMPEG"])
+    if ffmpeg is None:
+        logger.warning(
+            "HLS packaging disabled: %r not found", app.config["HLS_FFMPEG"]
+        )
+        return
+    hls_packager = HlsPackager(
+        root=app.config["HLS_CACHE_DIR"],
+        ffmpeg=ffmpeg,
+        segment_seconds=app.config["HLS_SEGMENT_SECONDS"],
+        renditions=parse_renditions(app.config["HLS_RENDITIONS"]),
+        workers=app.config["HLS_PACKAGE_WORKERS"],
+        timeout=app.config["HLS_PACKAGE_TIMEOUT"],
+        max_bytes=app.config["HLS_CACHE_MAX_BYTES"],
+        retry_seconds=app.config["HLS_RETRY_SECONDS"],
+    )
+
+
+def get_hls_packager() -> HlsPackager | None:
+    """Return the packager, or ``None`` when HLS is disabled or unavailable."""
+    return hls_packager
+
+
+def get_hls_stats() -> dict:
+    if hls_packager is None:
+        return {"enabled": False}
+    return {"enabled": True, **hls_packager.stats()}
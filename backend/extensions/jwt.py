@@ -1,9 +1,26 @@
+from flask import jsonify
 from flask_jwt_extended import JWTManager
 
+from extensions.sessions import get_sessions
+
 jwt = JWTManager()
 
 
+@jwt.token_in_blocklist_loader
+def _is_token_revoked(jwt_header, jwt_payload) -> bool:
+    return get_sessions().is_revoked(jwt_payload)
+
+
+@jwt.user_lookup_loader
+def _lookup_user(jwt_header, jwt_payload) -> dict | None:
+    return get_sessions().identity(jwt_payload)
+
+
+@jwt.user_lookup_error_loader
+def _user_not_found(jwt_header, jwt_payload):
+    return jsonify({"message": "User not found"}), 401
+
+
 def init_jwt(app):
     """Initialize JWT manager with the Flask app."""
     jwt.init_app(app)
-
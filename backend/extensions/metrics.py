@@ -0,0 +1,230 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+from middleware.internal import internal_only
+from utils.metrics import CONTENT_TYPE, counter, histogram, render_metrics
+from utils.profiler import SamplingProfiler
+from utils.stats import collect_stats
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = histogram(
+    "http_request_duration_seconds",
+    "Time from request start until the handler returned response headers.",
+    ("endpoint", "method", "status"),
+)
+STREAM_STAGE_DURATION = histogram(
+    "stream_stage_duration_seconds",
+    "Time spent in each stage of the stream proxy.",
+    ("stage",),
+)
+STREAM_BYTES = counter(
+    "stream_bytes_total",
+    "Bytes sent to clients by the stream proxy, by where they came from.",
+    ("source",),
+)
+MONGO_COMMAND_DURATION = histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command round-trip time, from pymongo command monitoring.",
+    ("command",),
+)
+MONGO_COMMAND_FAILURES = counter(
+    "mongodb_command_failures_total",
+    "MongoDB commands that returned an error.",
+    ("command",),
+)
+MONGO_POOL_CHECKOUT_WAIT = histogram(
+    "mongodb_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled MongoDB connection, by workload.",
+    ("workload",),
+)
+
+_settings = {"enabled": False}
+_listener_registered = False
+_listener_lock = threading.Lock()
+
+
+class _CommandTimer(monitoring.CommandListener):
+    """Feeds pymongo's per-command durations into the metrics registry."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if _settings["enabled"]:
+            MONGO_COMMAND_DURATION.observe(
+                event.duration_micros / 1e6, command=event.command_name
+            )
+
+    def failed(self, event):
+        if _settings["enabled"]:
+            MONGO_COMMAND_DURATION.observe(
+                event.duration_micros / 1e6, command=event.command_name
+            )
+            MONGO_COMMAND_FAILURES.inc(command=event.command_name)
+
+
+def init_metrics(app):
+    """Time every request and expose the registry on ``/api/metrics``.
+
+    The endpoint is ``internal_only``; every sample carries a ``worker``
+    label with the process ID.
+
+    Must run before ``init_db``: pymongo only applies globally registered
+    listeners to clients created afterwards.
+    """
+    global _listener_registered
+
+    _settings.update(
+        enabled=app.config["METRICS_ENABLED"],
+        profile_key=app.config["METRICS_PROFILE_KEY"],
+        profile_sample_rate=app.config["METRICS_PROFILE_SAMPLE_RATE"],
+        profile_interval=app.config["METRICS_PROFILE_INTERVAL_MS"] / 1000,
+        profile_dir=app.config["METRICS_PROFILE_DIR"],
+    )
+    if not _settings["enabled"]:
+        return
+
+    with _listener_lock:
+        if not _listener_registered:
+            monitoring.register(_CommandTimer())
+            _listener_registered = True
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    @app.get("/api/metrics")
+    @internal_only
+    def metrics():
+        # Workers share the listening socket, so a scrape reaches whichever
+        # one accepts it; the label keeps their series apart.
+        body = render_metrics(
+            _stats_gauges(), const_labels={"worker": str(os.getpid())}
+        )
+        return Response(body, content_type=CONTENT_TYPE)
+
+
+def observe_stage(stage: str, seconds: float):
+    if _settings["enabled"]:
+        STREAM_STAGE_DURATION.observe(seconds, stage=stage)
+
+
+def observe_pool_checkout(workload: str, seconds: float):
+    if _settings["enabled"]:
+        MONGO_POOL_CHECKOUT_WAIT.observe(seconds, workload=workload)
+
+
+def count_stream_bytes(source: str, amount: int):
+    if _settings["enabled"]:
+        STREAM_BYTES.inc(amount, source=source)
+
+
+def meter_stream(chunks, source: str, started_at: float):
+    """Pass ``chunks`` through, recording time to first byte and bytes sent.
+
+    ``started_at`` is the request's ``perf_counter`` start time. Closing this
+    generator closes ``chunks``.
+    """
+    if not _settings["enabled"]:
+        yield from chunks
+        return
+    sent = 0
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                observe_stage("first_byte", time.perf_counter() - started_at)
+                first = False
+            sent += len(chunk)
+            yield chunk
+    finally:
+        count_stream_bytes(source, sent)
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def request_started_at() -> float:
+    """``perf_counter`` timestamp of the current request's start."""
+    return g.get("metrics_started_at") or time.perf_counter()
+
+
+def _should_profile() -> bool:
+    key = _settings["profile_key"]
+    if key and request.headers.get("X-Profile") == key:
+        return True
+    rate = _settings["profile_sample_rate"]
+    return rate > 0 and random.random() < rate
+
+
+def _before_request():
+    g.metrics_started_at = time.perf_counter()
+    if _should_profile():
+        g.profiler = SamplingProfiler(
+            threading.get_ident(), interval=_settings["profile_interval"]
+        ).start()
+        g.profile_id = (
+            f"{int(time.time() * 1000)}-{os.getpid()}-{random.getrandbits(32):08x}"
+        )
+
+
+def _after_request(response):
+    started = g.get("metrics_started_at")
+    if started is not None:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or "unmatched",
+            method=request.method,
+            status=response.status_code,
+        )
+    if "profile_id" in g:
+        response.headers["X-Profile-Id"] = g.profile_id
+    return response
+
+
+def _teardown_request(exc):
+    # Runs after a streamed body has been sent, so profiles cover it too.
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    folded = profiler.stop()
+    path = os.path.join(
+        _settings["profile_dir"], f"{g.profile_id}-{request.endpoint}.folded"
+    )
+    try:
+        os.makedirs(_settings["profile_dir"], exist_ok=True)
+        with open(path, "w") as fh:
+            fh.write(folded)
+    except OSError:
+        logger.exception("Could not write request profile")
+
+
+def _stats_gauges() -> dict:
+    """Numeric values from ``/api/health/stats`` as one labelled gauge."""
+    samples = []
+
+    def walk(component: str, prefix: str, value):
+        if isinstance(value, bool):
+            samples.append(((component, prefix), int(value)))
+        elif isinstance(value, (int, float)):
+            samples.append(((component, prefix), value))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                walk(component, f"{prefix}.{key}" if prefix else str(key), item)
+
+    for component, values in collect_stats().items():
+        walk(component, "", values)
+    return {
+        "app_component_stat": {
+            "help": "Counters reported by /api/health/stats.",
+            "labelnames": ("component", "stat"),
+            "samples": samples,
+        }
+    }
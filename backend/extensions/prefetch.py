@@ -0,0 +1,248 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extensions.resolver import get_upstream_resolver
+from extensions.segment_cache import get_segment_cache
+from utils.mp4 import find_top_level_box
+
+logger = logging.getLogger(__name__)
+
+stream_prefetcher = None
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class _Job:
+    __slots__ = ("key", "deadline", "cancelled")
+
+    def __init__(self, key, deadline: float):
+        self.key = key
+        self.deadline = deadline
+        self.cancelled = False
+
+    def should_stop(self) -> bool:
+        """True once superseded or past the token's expiry."""
+        return self.cancelled or time.time() >= self.deadline
+
+
+class StreamPrefetcher:
+    """Warms the segment cache ahead of the client's stream requests.
+
+    ``warm`` runs when a playback token is issued: it fetches the opening
+    ``opening_bytes`` of the video and, for MP4s whose ``moov`` atom is
+    stored after the media data, the ``moov`` (up to ``moov_max_bytes``),
+    so the player's first requests are served from disk.
+
+    ``read_ahead`` runs after a bounded Range has been served and fetches
+    the next ``read_ahead_bytes``. Each token has at most one read-ahead;
+    a newer one (e.g. after a seek) cancels the older. Every job stops when
+    its token expires, and at most ``max_pending`` jobs are queued per
+    worker; more are dropped rather than delaying the streams.
+    """
+
+    def __init__(
+        self,
+        cache,
+        opening_bytes: int,
+        moov_max_bytes: int,
+        read_ahead_bytes: int,
+        workers: int,
+        max_pending: int,
+    ):
+        self.cache = cache
+        self.opening_bytes = opening_bytes
+        self.moov_max_bytes = moov_max_bytes
+        self.read_ahead_bytes = read_ahead_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._jobs: dict = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+        self._counters = {
+            "warmed": 0,
+            "read_aheads": 0,
+            "superseded": 0,
+            "expired": 0,
+            "dropped": 0,
+            "failures": 0,
+            "bytes_fetched": 0,
+        }
+
+    # Triggers ----------------------------------------------------------
+
+    def warm(self, source: str, expires_at: float):
+        """Fetch the opening range (and ``moov``) of ``source`` in the background."""
+        if self.opening_bytes <= 0:
+            return
+        self._submit(("warm", source), expires_at, self._warm, source)
+
+    def read_ahead(self, token: str, url: str, source: str, headers, expires_at):
+        """Fetch the range after the one described by ``headers``.
+
+        ``headers`` are the served response's; only a ``206`` that stops
+        short of the end of the file (a ``Content-Range`` of ``a-b/size``
+        with ``b < size - 1``) has a next range.
+        """
+        if self.read_ahead_bytes <= 0:
+            return
+        match = _CONTENT_RANGE_RE.match(headers.get("Content-Range", ""))
+        if not match:
+            return
+        end, size = int(match.group(2)), int(match.group(3))
+        if end >= size - 1:
+            return
+        start = end + 1
+        stop = min(start + self.read_ahead_bytes, size) - 1
+        self._submit(
+            ("ahead", token), expires_at, self._fill, url, source, start, stop
+        )
+
+    def after_body(self, chunks, token, url, source, headers, expires_at):
+        """Pass ``chunks`` through, then ``read_ahead`` if all were sent.
+
+        A client that disconnects mid-range is not read ahead for. Closing
+        this generator closes ``chunks``.
+        """
+        try:
+            yield from chunks
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        self.read_ahead(token, url, source, headers, expires_at)
+
+    # Jobs --------------------------------------------------------------
+
+    def _ensure_workers(self):
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                # Forked from a parent that had started them; start our own.
+                self._jobs.clear()
+                self._pending = 0
+                self._pid = pid
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="stream-prefetch"
+                )
+
+    def _submit(self, key, expires_at: float, fn, *args):
+        self._ensure_workers()
+        job = _Job(key, expires_at)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters["dropped"] += 1
+                return
+            previous = self._jobs.get(key)
+            if previous is not None:
+                if key[0] == "warm":
+                    return
+                previous.cancelled = True
+                self._counters["superseded"] += 1
+            self._jobs[key] = job
+            self._pending += 1
+        self._executor.submit(self._run, job, fn, args)
+
+    def _run(self, job: _Job, fn, args):
+        try:
+            if job.cancelled:
+                return
+            if time.time() >= job.deadline:
+                self._count("expired")
+                return
+            self._count("bytes_fetched", fn(job, *args))
+        except Exception:
+            logger.exception("Stream prefetch failed for %s", job.key[1])
+            self._count("failures")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _warm(self, job: _Job, source: str) -> int:
+        url = get_upstream_resolver().resolve(source)[0]
+        size = self.cache.size_of(url, source=source)
+        if size is None:
+            size = self.cache.probe(url, source=source)
+            if size is None:
+                return 0
+        fetched = self.cache.fill(
+            url, 0, self.opening_bytes - 1, source=source, should_stop=job.should_stop
+        )
+        self._count("warmed")
+
+        if self.moov_max_bytes > 0 and size > self.opening_bytes:
+
+            def read_at(offset: int, n: int) -> bytes:
+                if job.should_stop():
+                    return b""
+                return self.cache.read(
+                    url, offset, min(offset + n, size) - 1, source=source
+                )
+
+            moov = find_top_level_box(read_at, size, b"moov")
+            if moov is not None and moov[1] <= self.moov_max_bytes:
+                offset, length = moov
+                fetched += self.cache.fill(
+                    url,
+                    offset,
+                    offset + length - 1,
+                    source=source,
+                    should_stop=job.should_stop,
+                )
+        return fetched
+
+    def _fill(self, job: _Job, url: str, source: str, start: int, end: int) -> int:
+        self._count("read_aheads")
+        return self.cache.fill(
+            url, start, end, source=source, should_stop=job.should_stop
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "pending": self._pending}
+
+
+def init_stream_prefetcher(app):
+    """Create the per-process prefetcher; needs the segment cache.
+
+    Call after ``init_segment_cache``. Worker threads start on first use.
+    """
+    global stream_prefetcher
+
+    cache = get_segment_cache()
+    if not app.config["STREAM_PREFETCH_ENABLED"] or cache is None:
+        stream_prefetcher = None
+        return
+    stream_prefetcher = StreamPrefetcher(
+        cache,
+        opening_bytes=app.config["STREAM_PREFETCH_OPENING_BYTES"],
+        moov_max_bytes=app.config["STREAM_PREFETCH_MOOV_MAX_BYTES"],
+        read_ahead_bytes=app.config["STREAM_READ_AHEAD_BYTES"],
+        workers=app.config["STREAM_PREFETCH_WORKERS"],
+        max_pending=app.config["STREAM_PREFETCH_MAX_PENDING"],
+    )
+
+
+def get_stream_prefetcher() -> StreamPrefetcher | None:
+    """Return the prefetcher, or ``None`` when prefetching is disabled."""
+    return stream_prefetcher
+
+
+def get_stream_prefetch_stats() -> dict:
+    if stream_prefetcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **stream_prefetcher.stats()}
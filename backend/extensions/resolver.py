@@ -0,0 +1,349 @@
+import importlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import quote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+resolver = None
+
+
+class ResolutionError(Exception):
+    """No usable upstream URL could be produced for a source."""
+
+
+class ResolverBackend:
+    """Maps an upstream key (a video's ``youtube_id``) to fetchable URLs.
+
+    ``resolve`` returns ``(urls, expires_at)``: the origins the source can be
+    fetched from, preferred first, and the Unix time after which those URLs
+    stop working (``math.inf`` if they never do). It may be slow, may be
+    rate-limited and may raise; ``UpstreamResolver`` calls it as rarely as
+    it can and, whenever possible, off the request path.
+
+    Plug in a backend by setting ``UPSTREAM_RESOLVER_BACKEND`` to
+    ``"package.module:ClassName"``. The class is built with
+    ``from_config(app.config)``.
+    """
+
+    @classmethod
+    def from_config(cls, config) -> "ResolverBackend":
+        return cls()
+
+    def resolve(self, key: str) -> tuple[list[str], float]:
+        raise NotImplementedError
+
+
+class TemplateResolverBackend(ResolverBackend):
+    """Builds URLs from ``UPSTREAM_URL_TEMPLATES``; ``{key}`` is substituted.
+
+    Each comma-separated template is one origin. URLs are valid for
+    ``UPSTREAM_URL_TTL_SECONDS`` (0 = forever).
+    """
+
+    def __init__(self, templates: list[str], ttl: float):
+        if not templates:
+            raise ValueError("UPSTREAM_URL_TEMPLATES is empty")
+        self.templates = templates
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls, config) -> "TemplateResolverBackend":
+        templates = [
+            t.strip() for t in config["UPSTREAM_URL_TEMPLATES"].split(",") if t.strip()
+        ]
+        return cls(templates, config["UPSTREAM_URL_TTL_SECONDS"])
+
+    def resolve(self, key: str) -> tuple[list[str], float]:
+        urls = [t.replace("{key}", quote(key, safe="")) for t in self.templates]
+        expires_at = time.time() + self.ttl if self.ttl > 0 else math.inf
+        return urls, expires_at
+
+
+RESOLVER_BACKENDS = {"template": TemplateResolverBackend}
+
+
+def load_resolver_backend(name: str, config) -> ResolverBackend:
+    """Build a backend from a registered name or a ``module:Class`` path."""
+    cls = RESOLVER_BACKENDS.get(name)
+    if cls is None:
+        module_name, sep, class_name = name.partition(":")
+        if not sep:
+            raise ValueError(f"Unknown UPSTREAM_RESOLVER_BACKEND: {name!r}")
+        cls = getattr(importlib.import_module(module_name), class_name)
+    return cls.from_config(config)
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class _Entry:
+    __slots__ = ("urls", "expires_at", "used_at")
+
+    def __init__(self, urls: list[str], expires_at: float, used_at: float):
+        self.urls = urls
+        self.expires_at = expires_at
+        self.used_at = used_at
+
+
+class UpstreamResolver:
+    """Per-process cache of resolved upstream URLs in front of a backend.
+
+    An entry is served until ``margin`` seconds before its URLs expire, so a
+    stream never starts on a URL about to go stale. Entries used within the
+    last ``hot_seconds`` are re-resolved in the background once they are
+    within ``refresh_ahead`` seconds of that point, so hot videos never
+    resolve on the request path. Cold entries are left to lapse.
+
+    Every resolution runs on a small thread pool and concurrent callers for
+    the same key share one backend call. When a refresh fails the previous
+    URLs keep being served until they expire.
+
+    ``resolve`` orders origins by health: an origin reported with
+    ``report_failure`` moves to the back of the list for ``cooldown``
+    seconds, so the next stream fails over to a mirror first.
+    """
+
+    def __init__(
+        self,
+        backend: ResolverBackend,
+        margin: float,
+        refresh_ahead: float,
+        hot_seconds: float,
+        max_entries: int,
+        workers: int,
+        timeout: float,
+        cooldown: float,
+    ):
+        self.backend = backend
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self.hot_seconds = hot_seconds
+        self.max_entries = max_entries
+        self.workers = workers
+        self.timeout = timeout
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._inflight: dict = {}
+        self._origin_failed: dict[str, float] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._refresher: threading.Thread | None = None
+        self._pid: int | None = None
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "joined": 0,
+            "refreshes": 0,
+            "prefetches": 0,
+            "failures": 0,
+            "origin_failures": 0,
+        }
+
+    # Request side ------------------------------------------------------
+
+    def resolve(self, key: str) -> list[str]:
+        """Candidate URLs for ``key``, healthy origins first.
+
+        Served from cache when possible; otherwise waits up to ``timeout``
+        for a (shared) backend call. Raises ``ResolutionError`` when there is
+        nothing usable.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at - self.margin:
+                entry.used_at = now
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return self._by_health(entry.urls)
+            self._counters["misses"] += 1
+
+        future = self._submit(key)
+        try:
+            entry = future.result(timeout=self.timeout)
+        except Exception as exc:
+            # Inside the safety margin is still better than no stream at all.
+            if entry is None or time.time() >= entry.expires_at:
+                if isinstance(exc, FutureTimeout):
+                    raise ResolutionError(f"Resolving {key!r} timed out") from None
+                raise ResolutionError(f"Resolving {key!r} failed: {exc}") from exc
+        with self._lock:
+            entry.used_at = time.time()
+            return self._by_health(entry.urls)
+
+    def prefetch(self, key: str):
+        """Start resolving ``key`` in the background unless it is cached.
+
+        Also marks the entry as in use, e.g. when a playback token is issued
+        shortly before the stream request.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.used_at = now
+                if now < entry.expires_at - self.margin - self.refresh_ahead:
+                    return
+            self._counters["prefetches"] += 1
+        self._submit(key)
+
+    def report_failure(self, url: str):
+        """Push ``url``'s origin to the back of the list for ``cooldown`` seconds."""
+        with self._lock:
+            self._origin_failed[_origin(url)] = time.monotonic()
+            self._counters["origin_failures"] += 1
+
+    def _by_health(self, urls: list[str]) -> list[str]:
+        if not self._origin_failed:
+            return list(urls)
+        cutoff = time.monotonic() - self.cooldown
+        for origin in [o for o, t in self._origin_failed.items() if t < cutoff]:
+            del self._origin_failed[origin]
+        # sorted() is stable, so the backend's preference order is kept.
+        return sorted(urls, key=lambda url: _origin(url) in self._origin_failed)
+
+    # Resolution --------------------------------------------------------
+
+    def _ensure_workers(self):
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                # Forked from a parent that had started them; start our own.
+                self._inflight.clear()
+                self._pid = pid
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="upstream-resolver"
+                )
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="upstream-refresher", daemon=True
+                )
+                self._refresher.start()
+
+    def _submit(self, key: str):
+        self._ensure_workers()
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters["joined"] += 1
+                return future
+            future = self._inflight[key] = self._executor.submit(self._run, key)
+            return future
+
+    def _run(self, key: str) -> _Entry:
+        try:
+            urls, expires_at = self.backend.resolve(key)
+            if not urls:
+                raise ResolutionError(f"Backend returned no URLs for {key!r}")
+        except Exception:
+            logger.exception("Upstream resolution failed for %s", key)
+            with self._lock:
+                self._counters["failures"] += 1
+                entry = self._entries.get(key)
+                if entry is not None and time.time() >= entry.expires_at:
+                    del self._entries[key]
+                self._inflight.pop(key, None)
+            raise
+
+        # Store before leaving _inflight, so no caller sees neither.
+        with self._lock:
+            try:
+                previous = self._entries.get(key)
+                entry = _Entry(
+                    list(urls),
+                    expires_at,
+                    previous.used_at if previous else time.time(),
+                )
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            finally:
+                self._inflight.pop(key, None)
+        return entry
+
+    def _refresh_loop(self):
+        interval = max(1.0, min(self.refresh_ahead / 2, 30.0))
+        while True:
+            time.sleep(interval)
+            try:
+                self._refresh_due()
+            except RuntimeError:
+                # The executor was shut down at interpreter exit.
+                return
+            except Exception:
+                logger.exception("Upstream URL refresh pass failed")
+
+    def _refresh_due(self):
+        now = time.time()
+        due = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                usable_until = entry.expires_at - self.margin
+                if now - entry.used_at > self.hot_seconds:
+                    if now >= usable_until:
+                        del self._entries[key]
+                elif now >= usable_until - self.refresh_ahead:
+                    due.append(key)
+            self._counters["refreshes"] += len(due)
+        for key in due:
+            self._submit(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "in_flight": len(self._inflight),
+                "origins_cooling_down": len(self._origin_failed),
+            }
+
+
+def init_upstream_resolver(app):
+    """Create the per-process resolver over the configured backend.
+
+    Worker threads start on first use, so a resolver built before a fork
+    does not share them with the children.
+    """
+    global resolver
+
+    resolver = UpstreamResolver(
+        backend=load_resolver_backend(
+            app.config["UPSTREAM_RESOLVER_BACKEND"], app.config
+        ),
+        margin=app.config["UPSTREAM_RESOLVE_MARGIN_SECONDS"],
+        refresh_ahead=app.config["UPSTREAM_REFRESH_AHEAD_SECONDS"],
+        hot_seconds=app.config["UPSTREAM_RESOLVER_HOT_SECONDS"],
+        max_entries=app.config["UPSTREAM_RESOLVER_MAX_ENTRIES"],
+        workers=app.config["UPSTREAM_RESOLVER_WORKERS"],
+        timeout=app.config["UPSTREAM_RESOLVE_TIMEOUT"],
+        cooldown=app.config["UPSTREAM_ORIGIN_COOLDOWN_SECONDS"],
+    )
+
+
+def get_upstream_resolver() -> UpstreamResolver:
+    if resolver is None:
+        raise RuntimeError(
+            "Upstream resolver not initialized. Call init_upstream_resolver(app)."
+        )
+    return resolver
+
+
+def get_resolver_stats() -> dict:
+    return resolver.stats() if resolver is not None else {}
+
+
+def resolve_upstream_url(key: str) -> str:
+    """The preferred URL for ``key``; raises ``ResolutionError``."""
+    return get_upstream_resolver().resolve(key)[0]
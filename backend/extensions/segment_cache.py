@@ -0,0 +1,691 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from extensions.coalesce import open_coalesced
+from utils.buffers import ChunkSizer, iter_sized
+from utils.http_cache import if_range_matches, is_not_modified
+
+logger = logging.getLogger(__name__)
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+segment_cache = None
+
+_DEFAULT_CHUNK_BYTES = 256 * 1024
+
+
+class UpstreamFetchError(IOError):
+    """Raised mid-stream when the origin returns something we cannot cache."""
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def _iter_slices(buf, lo: int, hi: int, sizer: ChunkSizer):
+    """Yield ``buf[lo:hi]`` as ``bytes`` pieces of ``sizer``'s chunk size."""
+    pos = lo
+
+    def read(size: int) -> bytes:
+        nonlocal pos
+        piece = buf[pos : min(pos + size, hi)]
+        pos += len(piece)
+        return piece
+
+    return iter_sized(read, sizer)
+
+
+def parse_range(range_header: str | None, size: int):
+    """Resolve a single ``bytes=`` range against a known size.
+
+    Returns ``(start, end)`` inclusive, ``None`` when there is no range header,
+    or ``False`` when the range cannot be satisfied. Multi-range requests raise
+    ``ValueError`` so callers can fall back to passthrough.
+    """
+    if not range_header:
+        return None
+    match = _RANGE_RE.match(range_header.strip())
+    if not match:
+        raise ValueError("Unsupported Range header")
+    first, last = match.groups()
+    if first == "" and last == "":
+        raise ValueError("Unsupported Range header")
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+class SegmentCache:
+    """On-disk cache of upstream video bytes split into aligned blocks.
+
+    Blocks are stored as ``<root>/<url key>/<index>.blk`` next to a
+    ``meta.json`` holding the total size and forwarded content headers. The
+    in-memory index is an LRU over block files, bounded by ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        block_size: int,
+        max_bytes: int,
+        fill_workers: int = 2,
+        max_run_blocks: int = 16,
+        max_pending_writes: int = 64,
+        meta_ttl: float = 5.0,
+    ):
+        self.root = root
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.max_run_blocks = max_run_blocks
+        self.meta_ttl = meta_ttl
+
+        self._lock = threading.Lock()
+        self._blocks: OrderedDict[tuple[str, int], int] = OrderedDict()
+        self._used = 0
+        # key -> (meta, meta.json mtime_ns, monotonic time last checked)
+        self._meta: dict[str, tuple[dict, int, float]] = {}
+        self._filling: set[tuple[str, int]] = set()
+        self._write_slots = threading.BoundedSemaphore(max_pending_writes)
+        self._executor = ThreadPoolExecutor(
+            max_workers=fill_workers, thread_name_prefix="segment-cache"
+        )
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_from_cache": 0,
+            "bytes_from_upstream": 0,
+            "evictions": 0,
+            "not_modified": 0,
+        }
+
+        os.makedirs(root, exist_ok=True)
+        self._index_pid: int | None = None
+
+    # Index bookkeeping -------------------------------------------------
+
+    def _ensure_index(self):
+        """Start loading the on-disk index, once per process.
+
+        Stat-ing every block of a large cache would hold up startup, so the
+        scan runs on a background thread on first use. Until it finishes,
+        blocks it has not reached are found on disk by ``_has_block``.
+        """
+        pid = os.getpid()
+        if self._index_pid == pid:
+            return
+        with self._lock:
+            if self._index_pid == pid:
+                return
+            self._index_pid = pid
+        threading.Thread(
+            target=self._load_index, name="segment-cache-index", daemon=True
+        ).start()
+
+    def _load_index(self):
+        found = []
+        for key in os.listdir(self.root):
+            key_dir = os.path.join(self.root, key)
+            if not os.path.isdir(key_dir):
+                continue
+            for name in os.listdir(key_dir):
+                if not name.endswith(".blk"):
+                    continue
+                path = os.path.join(key_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, key, int(name[:-4]), st.st_size))
+        with self._lock:
+            # Oldest first in the LRU, behind blocks used since startup.
+            for _, key, idx, size in sorted(found, reverse=True):
+                if (key, idx) in self._blocks:
+                    continue
+                self._blocks[(key, idx)] = size
+                self._blocks.move_to_end((key, idx), last=False)
+                self._used += size
+            self._evict()
+
+    def _block_path(self, key: str, idx: int) -> str:
+        return os.path.join(self.root, key, f"{idx}.blk")
+
+    def _has_block(self, key: str, idx: int) -> bool:
+        self._ensure_index()
+        with self._lock:
+            if (key, idx) in self._blocks:
+                return True
+        # Another worker sharing the directory may have written it.
+        try:
+            size = os.path.getsize(self._block_path(key, idx))
+        except OSError:
+            return False
+        with self._lock:
+            if (key, idx) not in self._blocks:
+                self._blocks[(key, idx)] = size
+                self._used += size
+        return True
+
+    def _drop_block(self, key: str, idx: int):
+        with self._lock:
+            self._used -= self._blocks.pop((key, idx), 0)
+        try:
+            os.unlink(self._block_path(key, idx))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._used > self.max_bytes and self._blocks:
+            (key, idx), size = self._blocks.popitem(last=False)
+            self._used -= size
+            self._counters["evictions"] += 1
+            try:
+                os.unlink(self._block_path(key, idx))
+            except OSError:
+                pass
+
+    def _forget(self, key: str):
+        with self._lock:
+            for block_key in [k for k in self._blocks if k[0] == key]:
+                self._used -= self._blocks.pop(block_key)
+            self._meta.pop(key, None)
+        key_dir = os.path.join(self.root, key)
+        for name in os.listdir(key_dir) if os.path.isdir(key_dir) else []:
+            try:
+                os.unlink(os.path.join(key_dir, name))
+            except OSError:
+                pass
+
+    def _store_block(self, key: str, idx: int, data: bytes):
+        self._ensure_index()
+        path = self._block_path(key, idx)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Failed to write cache block %s/%s", key, idx)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            previous = self._blocks.pop((key, idx), 0)
+            self._blocks[(key, idx)] = len(data)
+            self._used += len(data) - previous
+            self._evict()
+
+    def _store_block_async(self, key: str, idx: int, data: bytes):
+        # Never let a slow disk build an unbounded backlog in memory; the
+        # block is simply fetched again next time.
+        if not self._write_slots.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._store_block(key, idx, data)
+            finally:
+                self._write_slots.release()
+
+        self._executor.submit(run)
+
+    # Metadata ----------------------------------------------------------
+
+    def _get_meta(self, key: str) -> dict | None:
+        """The key's metadata, re-checked against disk every ``meta_ttl``.
+
+        Another worker sharing the directory rewrites ``meta.json`` when the
+        origin file changes, so a cached copy is trusted only briefly; after
+        that a ``stat`` shows whether it must be read again.
+        """
+        now = time.monotonic()
+        cached = self._meta.get(key)
+        if cached is not None and now - cached[2] < self.meta_ttl:
+            return cached[0]
+        path = os.path.join(self.root, key, "meta.json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if cached is not None and cached[1] == mtime:
+                meta = cached[0]
+            else:
+                with open(path) as fh:
+                    meta = json.load(fh)
+        except (OSError, ValueError):
+            self._meta.pop(key, None)
+            return None
+        self._meta[key] = (meta, mtime, now)
+        return meta
+
+    def _set_meta(self, key: str, meta: dict):
+        key_dir = os.path.join(self.root, key)
+        os.makedirs(key_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=key_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(meta, fh)
+        path = os.path.join(key_dir, "meta.json")
+        os.replace(tmp, path)
+        self._meta[key] = (meta, os.stat(path).st_mtime_ns, time.monotonic())
+
+    def observe(
+        self,
+        url: str,
+        status: int,
+        headers,
+        range_header: str | None,
+        source: str | None = None,
+    ):
+        """Learn size and content headers from a passthrough upstream response.
+
+        Also schedules a background fill of the blocks covering the requested
+        range so the next viewer can be served from disk. ``source`` names
+        the file independently of ``url`` (see ``plan``).
+        """
+        size = self._learn(_url_key(source or url), status, headers)
+        if size is None:
+            return
+        try:
+            resolved = parse_range(range_header, size) or (0, size - 1)
+        except ValueError:
+            return
+        self.schedule_fill(url, resolved[0], resolved[1], source=source)
+
+    def _learn(self, key: str, status: int, headers) -> int | None:
+        """Record size and content headers from an upstream response.
+
+        Returns the size, or ``None`` when the response does not reveal it.
+        A changed size or ETag drops the blocks cached so far.
+        """
+        size = None
+        content_range = headers.get("Content-Range")
+        if status == 206 and content_range:
+            match = _CONTENT_RANGE_RE.match(content_range)
+            if match:
+                size = int(match.group(3))
+        elif status == 200 and headers.get("Content-Length"):
+            size = int(headers["Content-Length"])
+        if size is None:
+            return None
+
+        meta = self._get_meta(key)
+        etag = headers.get("ETag")
+        if (
+            meta is None
+            or meta["size"] != size
+            or (etag and meta.get("etag") != etag)
+        ):
+            if meta is not None:
+                self._forget(key)
+            meta = {
+                "size": size,
+                "content_type": headers.get("Content-Type"),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            }
+            self._set_meta(key, meta)
+        return size
+
+    # Serving -----------------------------------------------------------
+
+    def plan(
+        self,
+        url: str,
+        range_header: str | None,
+        require_cached: bool = False,
+        request_headers=None,
+        source: str | None = None,
+        sizer: ChunkSizer | None = None,
+    ) -> dict | None:
+        """Build the response for a request if the file size is known.
+
+        Returns ``None`` when the caller should pass the request straight
+        through to the origin (unknown size or an unsupported Range form).
+        With ``require_cached`` the plan is only returned when every block is
+        already on disk, so the body never blocks on the origin.
+
+        ``request_headers`` (any mapping with case-insensitive or lower-case
+        keys) enables conditional handling against the cached upstream
+        validators: a matching ``If-None-Match`` / ``If-Modified-Since``
+        gives a 304, and a stale ``If-Range`` turns a Range into a full 200.
+
+        Blocks are keyed by ``source`` when given, otherwise by ``url``, so
+        a file whose signed URL rotates (or that moves to a mirror) keeps
+        its cache. Misses are fetched from ``url``. The body's chunk sizes
+        follow ``sizer`` (fixed 256 KiB chunks without one).
+        """
+        key = _url_key(source or url)
+        meta = self._get_meta(key)
+        if meta is None:
+            return None
+        size = meta["size"]
+
+        headers = {"Accept-Ranges": "bytes"}
+        for header, field in (
+            ("Content-Type", "content_type"),
+            ("ETag", "etag"),
+            ("Last-Modified", "last_modified"),
+        ):
+            if meta.get(field):
+                headers[header] = meta[field]
+
+        if request_headers is not None:
+            if is_not_modified(
+                request_headers, meta.get("etag"), meta.get("last_modified")
+            ):
+                with self._lock:
+                    self._counters["not_modified"] += 1
+                del headers["Accept-Ranges"]
+                headers.pop("Content-Type", None)
+                return {"status": 304, "headers": headers, "body": None}
+            if range_header and not if_range_matches(
+                request_headers.get("if-range"),
+                meta.get("etag"),
+                meta.get("last_modified"),
+            ):
+                range_header = None
+
+        try:
+            resolved = parse_range(range_header, size)
+        except ValueError:
+            return None
+
+        if resolved is False:
+            headers["Content-Range"] = f"bytes */{size}"
+            return {"status": 416, "headers": headers, "body": None}
+
+        if resolved is None:
+            start, end, status = 0, size - 1, 200
+        else:
+            (start, end), status = resolved, 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+
+        if require_cached and not all(
+            self._has_block(key, idx)
+            for idx in range(start // self.block_size, end // self.block_size + 1)
+        ):
+            return None
+
+        return {
+            "status": status,
+            "headers": headers,
+            "body": self.iter_range(url, start, end, source=source, sizer=sizer),
+        }
+
+    def iter_range(
+        self,
+        url: str,
+        start: int,
+        end: int,
+        source: str | None = None,
+        sizer: ChunkSizer | None = None,
+    ):
+        """Yield bytes ``start..end`` (inclusive), from disk where cached.
+
+        A block file shorter than its expected length (a partial write, or
+        one left by a different ``block_size``) counts as a miss: it is
+        dropped and the range is fetched from the origin again.
+        """
+        if sizer is None:
+            sizer = ChunkSizer(_DEFAULT_CHUNK_BYTES, _DEFAULT_CHUNK_BYTES, 0)
+        key = _url_key(source or url)
+        size = self._get_meta(key)["size"]
+        bs = self.block_size
+        pos = start
+        last_idx = end // bs
+
+        while pos <= end:
+            idx = pos // bs
+            block_start = idx * bs
+            block_len = min(bs, size - block_start)
+            sent = short = False
+            if self._has_block(key, idx):
+                try:
+                    with open(self._block_path(key, idx), "rb") as fh, mmap.mmap(
+                        fh.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as mm:
+                        if len(mm) < block_len:
+                            short = True
+                        else:
+                            lo = pos - block_start
+                            hi = min(end - block_start + 1, block_len)
+                            yield from _iter_slices(mm, lo, hi, sizer)
+                            self._touch(key, idx, hi - lo)
+                            pos = block_start + hi
+                            sent = True
+                except ValueError:
+                    # mmap refuses an empty file.
+                    short = True
+                except OSError:
+                    # Evicted between the index check and the open.
+                    pass
+            if sent:
+                continue
+            if short:
+                self._drop_block(key, idx)
+
+            run_end = idx
+            while (
+                run_end < last_idx
+                and run_end - idx + 1 < self.max_run_blocks
+                and not self._has_block(key, run_end + 1)
+            ):
+                run_end += 1
+            for piece in self._fetch_run(
+                url, key, size, idx, run_end, pos, end, sizer
+            ):
+                pos += len(piece)
+                yield piece
+
+    def _touch(self, key: str, idx: int, nbytes: int):
+        with self._lock:
+            if (key, idx) in self._blocks:
+                self._blocks.move_to_end((key, idx))
+            self._counters["hits"] += 1
+            self._counters["bytes_from_cache"] += nbytes
+
+    def _fetch_run(self, url, key, size, first, last, pos, end, sizer=None):
+        """Fetch blocks ``first..last`` from the origin, yielding the client's slice.
+
+        ``pos..end`` is that slice; an empty one (background fills) needs no
+        ``sizer``.
+        """
+        bs = self.block_size
+        fetch_start = first * bs
+        fetch_end = min((last + 1) * bs, size) - 1
+        # Aligned block ranges make concurrent misses for the same blocks
+        # collapse onto a single upstream fetch.
+        resp = open_coalesced(url, {"Range": f"bytes={fetch_start}-{fetch_end}"})
+        try:
+            if resp.status_code != 206:
+                raise UpstreamFetchError(
+                    f"Origin answered {resp.status_code} to a block range request"
+                )
+            match = _CONTENT_RANGE_RE.match(resp.headers.get("Content-Range", ""))
+            if match and int(match.group(3)) != size:
+                # The origin file changed underneath us; drop what we have.
+                self._forget(key)
+                raise UpstreamFetchError("Origin size changed since it was cached")
+            buf = bytearray()
+            idx = first
+            for chunk in resp.iter_content(chunk_size=bs):
+                buf += chunk
+                while idx <= last:
+                    block_start = idx * bs
+                    block_len = min(bs, size - block_start)
+                    if len(buf) < block_len:
+                        break
+                    with memoryview(buf) as view:
+                        data = bytes(view[:block_len])
+                    del buf[:block_len]
+                    self._store_block_async(key, idx, data)
+                    with self._lock:
+                        self._counters["misses"] += 1
+                        self._counters["bytes_from_upstream"] += block_len
+                    lo = max(pos, block_start) - block_start
+                    hi = min(end, block_start + block_len - 1) - block_start + 1
+                    if lo < hi:
+                        yield from _iter_slices(data, lo, hi, sizer)
+                    idx += 1
+            if idx <= last:
+                raise UpstreamFetchError("Origin closed the block range early")
+        finally:
+            resp.close()
+
+    # Prefetching --------------------------------------------------------
+
+    def size_of(self, url: str, source: str | None = None) -> int | None:
+        """The upstream file's size, if known."""
+        meta = self._get_meta(_url_key(source or url))
+        return meta["size"] if meta is not None else None
+
+    def probe(self, url: str, source: str | None = None) -> int | None:
+        """Learn the file's size and validators with a one-byte Range request."""
+        resp = open_coalesced(url, {"Range": "bytes=0-0"})
+        try:
+            if resp.ok:
+                self._learn(_url_key(source or url), resp.status_code, resp.headers)
+        finally:
+            resp.close()
+        return self.size_of(url, source=source)
+
+    def read(self, url: str, start: int, end: int, source: str | None = None):
+        """Bytes ``start..end`` (inclusive), fetching and caching missing blocks."""
+        return b"".join(self.iter_range(url, start, end, source=source))
+
+    def fill(
+        self,
+        url: str,
+        start: int,
+        end: int,
+        source: str | None = None,
+        should_stop=None,
+    ) -> int:
+        """Fetch the missing blocks for ``start..end`` on the calling thread.
+
+        Blocks are fetched in runs of at most ``max_run_blocks``;
+        ``should_stop`` is checked before each run. Blocks another fill is
+        already fetching are skipped. Returns the number of bytes fetched.
+        """
+        key = _url_key(source or url)
+        meta = self._get_meta(key)
+        if meta is None:
+            return 0
+        size = meta["size"]
+        bs = self.block_size
+        idx, last = start // bs, min(end, size - 1) // bs
+        fetched = 0
+        while idx <= last:
+            if should_stop is not None and should_stop():
+                break
+            if self._has_block(key, idx):
+                idx += 1
+                continue
+            run_end = idx
+            while (
+                run_end < last
+                and run_end - idx + 1 < self.max_run_blocks
+                and not self._has_block(key, run_end + 1)
+            ):
+                run_end += 1
+            with self._lock:
+                busy = (key, idx) in self._filling
+                if not busy:
+                    self._filling.add((key, idx))
+            if not busy:
+                try:
+                    for _ in self._fetch_run(url, key, size, idx, run_end, 0, -1):
+                        pass
+                finally:
+                    with self._lock:
+                        self._filling.discard((key, idx))
+                fetched += min((run_end + 1) * bs, size) - idx * bs
+            idx = run_end + 1
+        return fetched
+
+    # Background fill ---------------------------------------------------
+
+    def schedule_fill(self, url: str, start: int, end: int, source: str | None = None):
+        """Fetch missing blocks for ``start..end`` off the request thread."""
+        key = _url_key(source or url)
+        meta = self._get_meta(key)
+        if meta is None:
+            return
+        first = start // self.block_size
+        last = min(end // self.block_size, first + self.max_run_blocks - 1)
+        missing = [i for i in range(first, last + 1) if not self._has_block(key, i)]
+        if not missing:
+            return
+        with self._lock:
+            if (key, missing[0]) in self._filling:
+                return
+            self._filling.add((key, missing[0]))
+
+        def run():
+            try:
+                for _ in self._fetch_run(
+                    url, key, meta["size"], missing[0], missing[-1], 0, -1
+                ):
+                    pass
+            except Exception:
+                logger.exception("Background fill failed for %s", key)
+            finally:
+                with self._lock:
+                    self._filling.discard((key, missing[0]))
+
+        self._executor.submit(run)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "blocks": len(self._blocks),
+                "used_bytes": self._used,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def init_segment_cache(app):
+    """Create the per-process segment cache if enabled in config."""
+    global segment_cache
+
+    if not app.config["SEGMENT_CACHE_ENABLED"]:
+        segment_cache = None
+        return
+    segment_cache = SegmentCache(
+        root=app.config["SEGMENT_CACHE_DIR"],
+        block_size=app.config["SEGMENT_CACHE_BLOCK_BYTES"],
+        max_bytes=app.config["SEGMENT_CACHE_MAX_BYTES"],
+        fill_workers=app.config["SEGMENT_CACHE_FILL_WORKERS"],
+        max_run_blocks=app.config["SEGMENT_CACHE_MAX_RUN_BLOCKS"],
+        meta_ttl=app.config["SEGMENT_CACHE_META_TTL_SECONDS"],
+    )
+
+
+def get_segment_cache() -> SegmentCache | None:
+    """Return the segment cache, or ``None`` when caching is disabled."""
+    return segment_cache
+
+
+def get_segment_cache_stats() -> dict:
+    if segment_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **segment_cache.stats()}
@@ -0,0 +1,165 @@
+import threading
+import time
+import uuid
+
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token
+
+from extensions.shared_state import get_revocation_list, get_state_backend
+from models.user import User
+from utils.cache import TTLCache
+
+sessions = None
+
+
+class SessionError(Exception):
+    """A refresh token that must not be honoured; the message is client-safe."""
+
+
+def profile_claims(public_user: dict) -> dict:
+    """The ``User.to_public_dict`` fields carried in tokens (minus ``id``)."""
+    return {k: v for k, v in public_user.items() if k != "id"}
+
+
+class SessionStore:
+    """Login sessions with rotating refresh tokens.
+
+    Login starts a session (``sid``). Each session has exactly one live
+    refresh token: ``/refresh`` swaps it for a new pair, and the old one
+    stops working. Presenting a refresh token the session has already moved
+    past means it was copied, so the whole session is ended and its ``sid``
+    revoked; every access token carries the ``sid``, so they stop working
+    too.
+
+    Tokens carry the user's public profile as a ``profile`` claim.
+    ``identity`` resolves the current user from those claims and caches the
+    result by ``jti`` until the token expires, so protected routes need no
+    database round trip. Older tokens without the claim are resolved from
+    MongoDB once per token.
+    """
+
+    def __init__(self, backend, revocations, identity_cache_size: int):
+        self.backend = backend
+        self.revocations = revocations
+        self._identities = TTLCache(identity_cache_size, ttl=0)
+        self._lock = threading.Lock()
+        self._counters = {"started": 0, "rotated": 0, "reuse_detected": 0, "ended": 0}
+
+    def _tokens(self, user_id: str, sid: str, profile: dict, jti: str) -> dict:
+        config = current_app.config
+        access_expires = config["JWT_ACCESS_TOKEN_EXPIRES"]
+        claims = {"sid": sid, "profile": profile}
+        return {
+            "access_token": create_access_token(
+                identity=user_id, expires_delta=access_expires, additional_claims=claims
+            ),
+            "refresh_token": create_refresh_token(
+                identity=user_id,
+                expires_delta=config["JWT_REFRESH_TOKEN_EXPIRES"],
+                additional_claims={**claims, "jti": jti},
+            ),
+            "expires_in": int(access_expires.total_seconds()),
+        }
+
+    def _refresh_expiry(self) -> float:
+        return time.time() + current_app.config[
+            "JWT_REFRESH_TOKEN_EXPIRES"
+        ].total_seconds()
+
+    def start(self, public_user: dict) -> dict:
+        """Open a session for a logged-in user; returns the token response."""
+        sid, jti = str(uuid.uuid4()), str(uuid.uuid4())
+        self.backend.start_session(sid, jti, self._refresh_expiry())
+        self._count("started")
+        return self._tokens(public_user["id"], sid, profile_claims(public_user), jti)
+
+    def rotate(self, decoded: dict) -> dict:
+        """Swap a verified refresh token's claims for a new token pair.
+
+        Raises ``SessionError`` for an ended or expired session, and for a
+        reused token (after ending its session).
+        """
+        sid = decoded.get("sid")
+        profile = decoded.get("profile")
+        if sid is None or profile is None:
+            # Issued before sessions existed: retire it and start one.
+            self.revocations.revoke(decoded["jti"], decoded["exp"])
+            user = User.find_by_id(decoded["sub"])
+            if user is None:
+                raise SessionError("Invalid token payload")
+            return self.start(user.to_public_dict())
+
+        jti = str(uuid.uuid4())
+        outcome = self.backend.rotate_session(
+            sid, decoded["jti"], jti, self._refresh_expiry()
+        )
+        if outcome == "reused":
+            self._count("reuse_detected")
+            self.end(sid)
+            raise SessionError("Refresh token reuse detected; session ended")
+        if outcome != "rotated":
+            raise SessionError("Session has ended")
+        self._count("rotated")
+        return self._tokens(decoded["sub"], sid, profile, jti)
+
+    def end(self, sid: str):
+        """End a session; its refresh and access tokens stop working."""
+        self.backend.end_session(sid)
+        self.revocations.revoke(sid, self._refresh_expiry())
+        self._count("ended")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def is_revoked(self, jwt_data: dict) -> bool:
+        sid = jwt_data.get("sid")
+        return self.revocations.is_revoked(jwt_data["jti"]) or (
+            sid is not None and self.revocations.is_revoked(sid)
+        )
+
+    def identity(self, jwt_data: dict) -> dict | None:
+        """The public profile for a verified token, or ``None`` if unknown."""
+        jti = jwt_data["jti"]
+        identity = self._identities.get(jti)
+        if identity is not None:
+            return identity
+        profile = jwt_data.get("profile")
+        if profile is not None:
+            identity = {"id": jwt_data["sub"], **profile}
+        else:
+            user = User.find_by_id(jwt_data["sub"])
+            if user is None:
+                return None
+            identity = user.to_public_dict()
+        self._identities.set(jti, identity, ttl=jwt_data["exp"] - time.time())
+        return identity
+
+    def forget(self, jti: str):
+        self._identities.pop(jti)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, "identities": self._identities.stats()}
+
+
+def init_sessions(app):
+    """Create the session store; call after ``init_shared_state``."""
+    global sessions
+
+    sessions = SessionStore(
+        get_state_backend(),
+        get_revocation_list(),
+        identity_cache_size=app.config["SESSION_IDENTITY_CACHE_SIZE"],
+    )
+
+
+def get_sessions() -> SessionStore:
+    if sessions is None:
+        raise RuntimeError("Sessions not initialized. Call init_sessions(app).")
+    return sessions
+
+
+def get_session_stats() -> dict:
+    return sessions.stats() if sessions is not None else {}
@@ -0,0 +1,641 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from extensions.db import get_db, register_model
+from utils.bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+rate_limiter = None
+revocations = None
+state_backend = None
+
+
+class MemoryStateBackend:
+    """In-process backend. Only correct for a single worker; used in tests/dev."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: dict[tuple[str, int], tuple[int, float]] = {}
+        self._revoked: dict[str, tuple[float, float]] = {}
+        self._sessions: dict[str, tuple[str, float, bool]] = {}
+        self._streams: dict[str, tuple[tuple[str, ...], float]] = {}
+
+    def add_counts(self, increments: dict[tuple[str, int], tuple[int, float]]):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, exp) in self._counts.items() if exp <= now]:
+                del self._counts[key]
+            for key, (amount, expire_at) in increments.items():
+                count, _ = self._counts.get(key, (0, expire_at))
+                self._counts[key] = (count + amount, expire_at)
+
+    def get_counts(self, keys: list[tuple[str, int]]) -> dict[tuple[str, int], int]:
+        with self._lock:
+            return {key: self._counts.get(key, (0, 0))[0] for key in keys}
+
+    def increment(self, key: tuple[str, int], amount: int, expire_at: float) -> int:
+        """Add ``amount`` to one counter and return its new value, atomically."""
+        with self._lock:
+            count = self._counts.get(key, (0, expire_at))[0] + amount
+            self._counts[key] = (count, expire_at)
+            return count
+
+    def revoke(self, jti: str, expires_at: float):
+        with self._lock:
+            self._revoked[jti] = (time.time(), expires_at)
+
+    def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            entry = self._revoked.get(jti)
+        return entry is not None and entry[1] > time.time()
+
+    def revoked_since(self, since: float) -> list[tuple[str, float]]:
+        now = time.time()
+        with self._lock:
+            return [
+                (jti, revoked_at)
+                for jti, (revoked_at, expires_at) in self._revoked.items()
+                if revoked_at >= since and expires_at > now
+            ]
+
+    def start_session(self, sid: str, jti: str, expires_at: float):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, exp, _) in self._sessions.items() if exp <= now]:
+                del self._sessions[key]
+            self._sessions[sid] = (jti, expires_at, False)
+
+    def rotate_session(
+        self, sid: str, old_jti: str, new_jti: str, expires_at: float
+    ) -> str:
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[2] or entry[1] <= time.time():
+                return "unknown"
+            if entry[0] != old_jti:
+                return "reused"
+            self._sessions[sid] = (new_jti, expires_at, False)
+            return "rotated"
+
+    def end_session(self, sid: str):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                self._sessions[sid] = (entry[0], entry[1], True)
+
+    def open_stream(
+        self, lease_id: str, limits: dict[str, int], expires_at: float
+    ) -> str | None:
+        """Record lease ``lease_id`` unless one of its holders is at its limit.
+
+        ``limits`` maps each holder (``user:<id>``) to the most leases it may
+        have open. Returns the first holder at its limit, or ``None`` once
+        the lease is recorded. A lease that is already open (the same
+        playback token on another worker) is joined. The lease lapses at
+        ``expires_at`` unless renewed.
+        """
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, exp) in self._streams.items() if exp <= now]:
+                del self._streams[key]
+            if lease_id in self._streams:
+                holders, exp = self._streams[lease_id]
+                self._streams[lease_id] = (holders, max(exp, expires_at))
+                return None
+            for holder, limit in limits.items():
+                open_streams = sum(
+                    holder in holders for holders, _ in self._streams.values()
+                )
+                if open_streams >= limit:
+                    return holder
+            self._streams[lease_id] = (tuple(limits), expires_at)
+            return None
+
+    def renew_streams(self, leases: dict[str, list[str]], expires_at: float):
+        """Extend ``leases`` (lease ID to holders), recreating any that lapsed."""
+        with self._lock:
+            for lease_id, holders in leases.items():
+                self._streams[lease_id] = (tuple(holders), expires_at)
+
+    def close_stream(self, lease_id: str):
+        with self._lock:
+            self._streams.pop(lease_id, None)
+
+
+@register_model
+class RateLimitCounter:
+    """Per-window rate-limit counters; expired windows are removed by TTL."""
+
+    collection_name = "rate_limit_counters"
+
+    indexes = [IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0)]
+    query_shapes = [{"name": "get_counts", "filter": {"_id": {"$in": ["key:0"]}}}]
+
+
+@register_model
+class RevokedToken:
+    """Revoked JWT IDs, kept until the token would have expired anyway."""
+
+    collection_name = "revoked_tokens"
+
+    indexes = [
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0),
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+    ]
+    query_shapes = [
+        {"name": "is_revoked", "filter": {"_id": "jti"}},
+        {
+            "name": "revoked_since",
+            "filter": {"revoked_at": {"$gte": datetime(2024, 1, 1)}},
+        },
+    ]
+
+
+@register_model
+class AuthSession:
+    """Refresh-token sessions: the one refresh ``jti`` each may still use."""
+
+    collection_name = "auth_sessions"
+
+    indexes = [IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0)]
+    query_shapes = [
+        {
+            "name": "rotate_session",
+            "filter": {
+                "_id": "sid",
+                "jti": "jti",
+                "ended": False,
+                "expire_at": {"$gt": datetime(2024, 1, 1)},
+            },
+        },
+    ]
+
+
+@register_model
+class StreamLease:
+    """Playback tokens in use across all workers, renewed while they stream.
+
+    ``_id`` is the hashed token, so all of a token's Range requests share
+    one lease. A worker that dies leaves its leases to expire by TTL.
+    """
+
+    collection_name = "stream_leases"
+
+    indexes = [
+        IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0),
+        IndexModel([("holders", ASCENDING), ("expire_at", ASCENDING)], name="holders"),
+    ]
+    query_shapes = [
+        {
+            "name": "open_stream_counts",
+            "filter": {
+                "holders": {"$in": ["user:id"]},
+                "expire_at": {"$gt": datetime(2024, 1, 1)},
+            },
+        },
+    ]
+
+
+def _utc(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+class MongoStateBackend:
+    """Backend shared by all workers, stored in MongoDB with TTL expiry."""
+
+    @staticmethod
+    def _counter_id(key: tuple[str, int]) -> str:
+        return f"{key[0]}:{key[1]}"
+
+    def add_counts(self, increments: dict[tuple[str, int], tuple[int, float]]):
+        if not increments:
+            return
+        get_db()[RateLimitCounter.collection_name].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": self._counter_id(key)},
+                    {"$inc": {"count": amount}, "$set": {"expire_at": _utc(expire_at)}},
+                    upsert=True,
+                )
+                for key, (amount, expire_at) in increments.items()
+            ],
+            ordered=False,
+        )
+
+    def increment(self, key: tuple[str, int], amount: int, expire_at: float) -> int:
+        doc = get_db()[RateLimitCounter.collection_name].find_one_and_update(
+            {"_id": self._counter_id(key)},
+            {"$inc": {"count": amount}, "$set": {"expire_at": _utc(expire_at)}},
+            projection={"count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["count"]
+
+    def get_counts(self, keys: list[tuple[str, int]]) -> dict[tuple[str, int], int]:
+        ids = {self._counter_id(key): key for key in keys}
+        counts = {key: 0 for key in keys}
+        for doc in get_db()[RateLimitCounter.collection_name].find(
+            {"_id": {"$in": list(ids)}}
+        ):
+            counts[ids[doc["_id"]]] = doc["count"]
+        return counts
+
+    def revoke(self, jti: str, expires_at: float):
+        get_db()[RevokedToken.collection_name].update_one(
+            {"_id": jti},
+            {
+                "$set": {
+                    "revoked_at": datetime.now(timezone.utc),
+                    "expire_at": _utc(expires_at),
+                }
+            },
+            upsert=True,
+        )
+
+    def is_revoked(self, jti: str) -> bool:
+        doc = get_db()[RevokedToken.collection_name].find_one({"_id": jti})
+        return doc is not None and doc["expire_at"].replace(
+            tzinfo=timezone.utc
+        ) > datetime.now(timezone.utc)
+
+    def start_session(self, sid: str, jti: str, expires_at: float):
+        get_db()[AuthSession.collection_name].insert_one(
+            {"_id": sid, "jti": jti, "ended": False, "expire_at": _utc(expires_at)}
+        )
+
+    def rotate_session(
+        self, sid: str, old_jti: str, new_jti: str, expires_at: float
+    ) -> str:
+        collection = get_db()[AuthSession.collection_name]
+        now = datetime.now(timezone.utc)
+        # Compare-and-set, so of two requests presenting the same token only
+        # one can rotate; the other is treated as reuse.
+        doc = collection.find_one_and_update(
+            {"_id": sid, "jti": old_jti, "ended": False, "expire_at": {"$gt": now}},
+            {"$set": {"jti": new_jti, "expire_at": _utc(expires_at)}},
+            projection={"_id": 1},
+        )
+        if doc is not None:
+            return "rotated"
+        doc = collection.find_one({"_id": sid})
+        if (
+            doc is None
+            or doc["ended"]
+            or doc["expire_at"].replace(tzinfo=timezone.utc) <= now
+        ):
+            return "unknown"
+        return "reused"
+
+    def end_session(self, sid: str):
+        get_db()[AuthSession.collection_name].update_one(
+            {"_id": sid}, {"$set": {"ended": True}}
+        )
+
+    def open_stream(
+        self, lease_id: str, limits: dict[str, int], expires_at: float
+    ) -> str | None:
+        collection = get_db()[StreamLease.collection_name]
+        holders = list(limits)
+        # Insert, then count: two streams racing for the last slot may both
+        # be refused, but never both admitted.
+        try:
+            collection.insert_one(
+                {"_id": lease_id, "holders": holders, "expire_at": _utc(expires_at)}
+            )
+        except DuplicateKeyError:
+            # Another worker serves this playback token already; join it.
+            collection.update_one(
+                {"_id": lease_id}, {"$max": {"expire_at": _utc(expires_at)}}
+            )
+            return None
+        counts = {
+            doc["_id"]: doc["count"]
+            for doc in collection.aggregate(
+                [
+                    {
+                        "$match": {
+                            "holders": {"$in": holders},
+                            "expire_at": {"$gt": datetime.now(timezone.utc)},
+                        }
+                    },
+                    {"$unwind": "$holders"},
+                    {"$match": {"holders": {"$in": holders}}},
+                    {"$group": {"_id": "$holders", "count": {"$sum": 1}}},
+                ]
+            )
+        }
+        for holder, limit in limits.items():
+            if counts.get(holder, 0) > limit:
+                collection.delete_one({"_id": lease_id})
+                return holder
+        return None
+
+    def renew_streams(self, leases: dict[str, list[str]], expires_at: float):
+        get_db()[StreamLease.collection_name].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": lease_id},
+                    {"$set": {"holders": holders, "expire_at": _utc(expires_at)}},
+                    upsert=True,
+                )
+                for lease_id, holders in leases.items()
+            ],
+            ordered=False,
+        )
+
+    def close_stream(self, lease_id: str):
+        get_db()[StreamLease.collection_name].delete_one({"_id": lease_id})
+
+    def revoked_since(self, since: float) -> list[tuple[str, float]]:
+        cursor = get_db()[RevokedToken.collection_name].find(
+            {"revoked_at": {"$gte": _utc(since)}}, {"revoked_at": 1}
+        )
+        return [
+            (doc["_id"], doc["revoked_at"].replace(tzinfo=timezone.utc).timestamp())
+            for doc in cursor
+        ]
+
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate_limit(limit: str) -> tuple[int, int]:
+    """Parse ``"5 per minute"`` / ``"100/hour"`` into ``(amount, window_seconds)``."""
+    amount, _, unit = limit.replace("/", " per ").partition(" per ")
+    unit = unit.strip().lower().rstrip("s")
+    multiplier = 1
+    if " " in unit:
+        multiplier_text, unit = unit.split(None, 1)
+        multiplier = int(multiplier_text)
+    if unit not in _UNITS:
+        raise ValueError(f"Unsupported rate limit: {limit!r}")
+    return int(amount.strip()), multiplier * _UNITS[unit]
+
+
+class SlidingWindowLimiter:
+    """Sliding-window-counter rate limiter over a shared backend.
+
+    The estimate is ``previous_window * overlap + current_window``. With
+    ``sync_seconds`` 0 every hit is one atomic increment of the shared
+    counter, checked against the value it returns, so concurrent workers
+    cannot both take the last slot. Above 0, hits are counted locally and
+    written to the backend in batches every ``sync_seconds`` per key,
+    together with a re-read of the shared counts; that trades a little
+    accuracy across workers for fewer round trips.
+    """
+
+    def __init__(self, backend, sync_seconds: float):
+        self.backend = backend
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, int], tuple[int, float]] = {}
+        self._shared: dict[tuple[str, int], int] = {}
+        self._synced_at: dict[str, tuple[float, int]] = {}
+
+    def _prune(self, now: float):
+        """Drop state for keys (e.g. client IPs) that have gone quiet."""
+        stale = [
+            key
+            for key, (synced_at, window) in self._synced_at.items()
+            if now - synced_at > 2 * window
+        ]
+        for key in stale:
+            del self._synced_at[key]
+        stale = set(stale)
+        for k in [k for k in self._shared if k[0] in stale]:
+            del self._shared[k]
+
+    def _sync(self, key: str, window: int, window_starts: list[int]):
+        with self._lock:
+            flush = {k: v for k, v in self._pending.items() if k[0] == key}
+            for k in flush:
+                del self._pending[k]
+        self.backend.add_counts(flush)
+        counts = self.backend.get_counts([(key, start) for start in window_starts])
+        with self._lock:
+            now = time.monotonic()
+            if len(self._synced_at) > 4096:
+                self._prune(now)
+            self._shared.update(counts)
+            self._synced_at[key] = (now, window)
+            # Forget windows that can no longer affect an estimate.
+            oldest = min(window_starts)
+            for k in [k for k in self._shared if k[0] == key and k[1] < oldest]:
+                del self._shared[k]
+
+    def hit(self, key: str, amount: int, window: int) -> tuple[bool, int]:
+        """Record a hit if it fits the limit. Returns ``(allowed, retry_after)``."""
+        now = time.time()
+        current = int(now // window) * window
+        previous = current - window
+        if self.sync_seconds <= 0:
+            return self._hit_shared(key, amount, window, now, current, previous)
+
+        synced = self._synced_at.get(key)
+        if synced is None or time.monotonic() - synced[0] >= self.sync_seconds:
+            self._sync(key, window, [previous, current])
+
+        with self._lock:
+            def count(start):
+                pending = self._pending.get((key, start), (0, 0))[0]
+                return self._shared.get((key, start), 0) + pending
+
+            overlap = 1 - (now - current) / window
+            estimate = count(previous) * overlap + count(current)
+            if estimate + 1 > amount:
+                return False, max(1, int(current + window - now))
+            pending, _ = self._pending.get((key, current), (0, 0))
+            self._pending[(key, current)] = (pending + 1, current + 2 * window)
+        return True, 0
+
+    def _hit_shared(
+        self,
+        key: str,
+        amount: int,
+        window: int,
+        now: float,
+        current: int,
+        previous: int,
+    ) -> tuple[bool, int]:
+        expire_at = current + 2 * window
+        count = self.backend.increment((key, current), 1, expire_at)
+        earlier = self.backend.get_counts([(key, previous)])[(key, previous)]
+        overlap = 1 - (now - current) / window
+        if earlier * overlap + count <= amount:
+            return True, 0
+        # Refused hits do not count; racing hits may both be refused.
+        self.backend.increment((key, current), -1, expire_at)
+        return False, max(1, int(current + window - now))
+
+
+class RevocationList:
+    """JWT revocation list with a local Bloom filter in front of the backend.
+
+    A token whose ``jti`` is not in the filter is accepted without a round
+    trip. The filter is topped up from the backend at most every
+    ``sync_seconds`` and rebuilt every ``rebuild_seconds`` to drop expired
+    entries, so a revocation made on another worker takes effect within
+    ``sync_seconds``; revocations made locally apply immediately. Only the
+    first load runs on a request; rebuilds run on a background thread and
+    the old filter keeps answering until the new one is swapped in.
+    """
+
+    def __init__(
+        self,
+        backend,
+        capacity: int,
+        error_rate: float,
+        sync_seconds: float,
+        rebuild_seconds: float,
+    ):
+        self.backend = backend
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._sync_lock = threading.Lock()
+        # Guards filter swaps against concurrent adds.
+        self._swap_lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._synced_until = 0.0
+        self._last_sync = float("-inf")
+        self._last_rebuild = float("-inf")
+        self._rebuilding = False
+        self._rebuild_local: list[str] = []
+        self.lookups = 0
+        self.filtered = 0
+
+    def _maybe_sync(self):
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_seconds:
+            return
+        # Only one request per worker pays for the sync; others skip it.
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            if self._last_rebuild == float("-inf"):
+                # The first sync loads everything into the empty filter.
+                self._last_rebuild = now
+            elif now - self._last_rebuild >= self.rebuild_seconds:
+                self._last_rebuild = now
+                self._start_rebuild()
+            since = self._synced_until
+            started = time.time()
+            jtis = [jti for jti, _ in self.backend.revoked_since(since)]
+            with self._swap_lock:
+                for jti in jtis:
+                    self._bloom.add(jti)
+                # Overlap a little so clock skew between workers loses nothing.
+                self._synced_until = started - 5
+            self._last_sync = now
+        finally:
+            self._sync_lock.release()
+
+    def _start_rebuild(self):
+        with self._swap_lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            self._rebuild_local = []
+        threading.Thread(
+            target=self._rebuild, name="revocation-rebuild", daemon=True
+        ).start()
+
+    def _rebuild(self):
+        """Build a fresh filter without the expired IDs, then swap it in."""
+        started = time.time()
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        try:
+            for jti, _revoked_at in self.backend.revoked_since(0.0):
+                bloom.add(jti)
+        except Exception:
+            logger.exception("Revocation filter rebuild failed")
+            with self._swap_lock:
+                self._rebuilding = False
+            return
+        with self._swap_lock:
+            # Local revocations made during the build are not in the new filter.
+            for jti in self._rebuild_local:
+                bloom.add(jti)
+            self._bloom = bloom
+            self._rebuilding = False
+            self._rebuild_local = []
+            # Syncs from here on also cover what the build may have missed.
+            self._synced_until = min(self._synced_until, started - 5)
+
+    def revoke(self, jti: str, expires_at: float):
+        self.backend.revoke(jti, expires_at)
+        with self._swap_lock:
+            self._bloom.add(jti)
+            if self._rebuilding:
+                self._rebuild_local.append(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        self._maybe_sync()
+        if not self._bloom.might_contain(jti):
+            self.filtered += 1
+            return False
+        self.lookups += 1
+        return self.backend.is_revoked(jti)
+
+    def stats(self) -> dict:
+        return {
+            "bloom_entries": self._bloom.count,
+            "filtered": self.filtered,
+            "backend_lookups": self.lookups,
+        }
+
+
+def init_shared_state(app):
+    """Create the rate limiter and revocation list over the configured backend."""
+    global rate_limiter, revocations, state_backend
+
+    kind = app.config["SHARED_STATE_BACKEND"]
+    if kind == "mongodb":
+        backend = MongoStateBackend()
+    elif kind == "memory":
+        backend = MemoryStateBackend()
+    else:
+        raise ValueError(f"Unknown SHARED_STATE_BACKEND: {kind!r}")
+
+    state_backend = backend
+    rate_limiter = SlidingWindowLimiter(
+        backend, sync_seconds=app.config["RATELIMIT_SYNC_SECONDS"]
+    )
+    revocations = RevocationList(
+        backend,
+        capacity=app.config["REVOCATION_BLOOM_CAPACITY"],
+        error_rate=app.config["REVOCATION_BLOOM_ERROR_RATE"],
+        sync_seconds=app.config["REVOCATION_SYNC_SECONDS"],
+        rebuild_seconds=app.config["REVOCATION_REBUILD_SECONDS"],
+    )
+
+
+def get_rate_limiter() -> SlidingWindowLimiter:
+    if rate_limiter is None:
+        raise RuntimeError("Shared state not initialized. Call init_shared_state(app).")
+    return rate_limiter
+
+
+def get_state_backend():
+    """The configured ``MemoryStateBackend`` or ``MongoStateBackend``."""
+    if state_backend is None:
+        raise RuntimeError("Shared state not initialized. Call init_shared_state(app).")
+    return state_backend
+
+
+def get_revocation_list() -> RevocationList:
+    if revocations is None:
+        raise RuntimeError("Shared state not initialized. Call init_shared_state(app).")
+    return revocations
+
+
+def get_shared_state_stats() -> dict:
+    return revocations.stats() if revocations is not None else {}
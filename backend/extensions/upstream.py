@@ -0,0 +1,215 @@
+import os
+import socket
+import threading
+from typing import TYPE_CHECKING
+
+from utils.buffers import ChunkSizer, iter_sized
+
+if TYPE_CHECKING:
+    import requests
+
+# ``requests`` (with urllib3, certifi and charset_normalizer) is imported when
+# the first session is created, not at app startup; ``server.py`` preloads it.
+
+_lock = threading.Lock()
+_session: "requests.Session | None" = None
+_session_pid: int | None = None
+_settings: dict = {}
+_in_use = 0
+
+
+def _keepalive_adapter(keepalive_seconds: int, **kwargs):
+    """An HTTPAdapter that enables TCP keep-alive probes on pooled sockets."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection
+
+    class _KeepAliveAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            options = list(HTTPConnection.default_socket_options)
+            if keepalive_seconds > 0:
+                options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+                if hasattr(socket, "TCP_KEEPIDLE"):
+                    options.append(
+                        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_seconds)
+                    )
+            kwargs["socket_options"] = options
+            super().init_poolmanager(*args, **kwargs)
+
+    return _KeepAliveAdapter(**kwargs)
+
+
+def init_upstream(app):
+    """Read upstream pool settings from the app config.
+
+    The session itself is created lazily per process, so a pool built in a
+    parent process is never shared with forked workers.
+    """
+    global _settings
+
+    _settings = {
+        "pool_hosts": app.config["UPSTREAM_POOL_HOSTS"],
+        "pool_maxsize": app.config["UPSTREAM_POOL_MAXSIZE"],
+        "keepalive_seconds": app.config["UPSTREAM_KEEPALIVE_SECONDS"],
+        "timeout": (
+            app.config["UPSTREAM_CONNECT_TIMEOUT"],
+            app.config["UPSTREAM_READ_TIMEOUT"],
+        ),
+        "chunk_min_bytes": app.config["STREAM_CHUNK_MIN_BYTES"],
+        "chunk_max_bytes": app.config["STREAM_CHUNK_MAX_BYTES"],
+        "chunk_target_seconds": app.config["STREAM_CHUNK_TARGET_SECONDS"],
+    }
+    _reset_session()
+
+
+def _reset_session():
+    global _session, _session_pid
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def get_upstream_session() -> "requests.Session":
+    """Return this worker's pooled upstream session, creating it on first use."""
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _lock:
+        if _session is None or _session_pid != pid:
+            if not _settings:
+                raise RuntimeError(
+                    "Upstream pool not initialized. Call init_upstream(app) first."
+                )
+            import requests
+
+            adapter = _keepalive_adapter(
+                _settings["keepalive_seconds"],
+                pool_connections=_settings["pool_hosts"],
+                pool_maxsize=_settings["pool_maxsize"],
+                # Block instead of opening overflow sockets past the per-host cap.
+                pool_block=True,
+                max_retries=0,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def open_upstream(url: str, headers: dict | None = None) -> "requests.Response":
+    """Open a streaming GET against the upstream origin through the shared pool.
+
+    Callers must hand the response to ``release_upstream`` once they are done
+    with it, including when the client disconnects mid-stream.
+    """
+    global _in_use
+
+    resp = get_upstream_session().get(
+        url, headers=headers or {}, stream=True, timeout=_settings["timeout"]
+    )
+    with _lock:
+        _in_use += 1
+    resp._upstream_released = False
+    return resp
+
+
+def release_upstream(resp: "requests.Response") -> None:
+    """Close an upstream response and return its connection to the pool.
+
+    Safe to call more than once for the same response.
+    """
+    global _in_use
+
+    if getattr(resp, "_upstream_released", True):
+        return
+    resp._upstream_released = True
+    resp.close()
+    with _lock:
+        _in_use -= 1
+
+
+def new_chunk_sizer() -> ChunkSizer:
+    """A per-stream ``ChunkSizer`` using the ``STREAM_CHUNK_*`` settings."""
+    return ChunkSizer(
+        _settings["chunk_min_bytes"],
+        _settings["chunk_max_bytes"],
+        _settings["chunk_target_seconds"],
+        initial_bytes=64 * 1024,
+    )
+
+
+def iter_upstream_body(resp: "requests.Response", sizer: ChunkSizer):
+    """Yield the body of an open upstream response in ``sizer``-sized chunks.
+
+    Identity-encoded bodies are read from ``http.client`` directly, which
+    reads the socket into the ``bytes`` object it returns. WSGI and ASGI
+    servers need each chunk as ``bytes``, so that is the only allocation and
+    the only copy per chunk. A chunk is at most ``STREAM_CHUNK_MAX_BYTES``,
+    which caps what one stream holds while its client drains it. Compressed
+    bodies go through urllib3 so they are decoded.
+    """
+    raw = resp.raw
+    fp = getattr(raw, "_fp", None)
+    encoding = resp.headers.get("Content-Encoding", "identity").strip().lower()
+    if fp is None or encoding not in ("", "identity"):
+        return iter_sized(lambda size: raw.read(size, decode_content=True), sizer)
+    return _iter_direct(resp, fp, sizer)
+
+
+def _iter_direct(resp: "requests.Response", fp, sizer: ChunkSizer):
+    expected = resp.headers.get("Content-Length")
+    received = 0
+
+    def read(size: int) -> bytes:
+        nonlocal received
+        data = fp.read(size)
+        received += len(data)
+        return data
+
+    yield from iter_sized(read, sizer)
+    if expected is not None and received < int(expected):
+        raise IOError(f"Upstream body ended after {received} of {expected} bytes")
+    if fp.isclosed():
+        # Read to the end outside urllib3, so hand the connection back the
+        # way urllib3 would have.
+        resp.raw.release_conn()
+
+
+def get_upstream_stats() -> dict:
+    """Return pool counters for this worker.
+
+    ``misses`` counts new sockets opened to the origin and ``hits`` counts
+    requests served on an already open pooled connection.
+    """
+    requests_total = 0
+    connections_total = 0
+    idle = 0
+    hosts = 0
+
+    session = _session if _session_pid == os.getpid() else None
+    if session is not None:
+        adapter = session.get_adapter("https://")
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts += 1
+            requests_total += pool.num_requests
+            connections_total += pool.num_connections
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+    return {
+        "hosts": hosts,
+        "hits": max(requests_total - connections_total, 0),
+        "misses": connections_total,
+        "in_use": _in_use,
+        "idle": idle,
+    }
@@ -0,0 +1,274 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from extensions.db import get_db
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "watch_events"  # indexes are declared on models.watch.WatchEvent
+_DUPLICATE_KEY = 11000
+
+event_buffer = None
+
+
+class WatchEventBuffer:
+    """In-process buffer that batches watch events into ``insert_many`` calls.
+
+    Requests enqueue and return immediately; a flusher thread writes a batch
+    once ``batch_size`` events are queued or ``flush_seconds`` have passed.
+    The queue is bounded: when it stays full for ``enqueue_timeout`` seconds
+    the events go to the spill file if one is configured, otherwise they are
+    rejected. Spilled events (and batches that failed to insert) are replayed
+    after the next successful flush.
+
+    ``insert_many`` gives each event its ``_id`` before sending, and a
+    spilled batch keeps those ids. Replaying a batch that was partly written
+    therefore only adds the missing events, and the flush hooks see each
+    stored event once: events rejected as invalid never reach them.
+    """
+
+    def __init__(
+        self,
+        max_queue: int,
+        batch_size: int,
+        flush_seconds: float,
+        enqueue_timeout: float,
+        spill_path: str | None = None,
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_path = spill_path
+
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._spill_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        self._stopping = False
+        self._flush_hooks = []
+        self._counters = {
+            "accepted": 0,
+            "rejected": 0,
+            "flushed": 0,
+            "batches": 0,
+            "failed": 0,
+            "duplicates": 0,
+            "spilled": 0,
+            "replayed": 0,
+        }
+
+    def add_flush_hook(self, hook):
+        """Call ``hook(events)`` on the flusher thread after each batch is stored.
+
+        ``events`` are the events of the batch now in the collection. A
+        duplicate ``_id`` can only come from a spilled batch whose earlier
+        attempt wrote part of it and then failed before any hook ran, so
+        those events are included; invalid events are not.
+        """
+        self._flush_hooks.append(hook)
+
+    def _spill_file(self) -> str:
+        # One file per worker so concurrent appends never interleave.
+        return f"{self.spill_path}.{os.getpid()}"
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        with self._cond:
+            if self._thread is None or self._pid != pid:
+                # A forked child inherits the parent's queue but not its thread.
+                self._queue.clear()
+                self._pid = pid
+                self._thread = threading.Thread(
+                    target=self._run, name="watch-event-flusher", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, events: list[dict]) -> bool:
+        """Queue events for insertion. Returns False if they were rejected."""
+        if not events:
+            return True
+        self._ensure_flusher()
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            while len(self._queue) + len(events) > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+            if len(self._queue) + len(events) <= self.max_queue:
+                self._queue.extend(events)
+                self._counters["accepted"] += len(events)
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify_all()
+                return True
+
+        if self.spill_path and self._spill(events):
+            with self._cond:
+                self._counters["accepted"] += len(events)
+            return True
+        with self._cond:
+            self._counters["rejected"] += len(events)
+        return False
+
+    def _spill(self, events: list[dict]) -> bool:
+        try:
+            with self._spill_lock, open(self._spill_file(), "a") as fh:
+                for event in events:
+                    fh.write(json_util.dumps(event) + "\n")
+        except OSError:
+            logger.exception("Could not spill watch events")
+            return False
+        with self._cond:
+            self._counters["spilled"] += len(events)
+        return True
+
+    def _take_batch(self) -> list[dict]:
+        deadline = time.monotonic() + self.flush_seconds
+        with self._cond:
+            while len(self._queue) < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            if batch:
+                self._cond.notify_all()
+            return batch
+
+    def _insert(self, batch: list[dict]) -> list[dict] | None:
+        """Insert ``batch``; the events stored, or ``None`` if it must be retried."""
+        try:
+            get_db("analytics")[COLLECTION_NAME].insert_many(batch, ordered=False)
+        except BulkWriteError as exc:
+            # Unordered: everything except the reported errors was written.
+            errors = exc.details.get("writeErrors", [])
+            rejected = {
+                error["index"]
+                for error in errors
+                if error.get("code") != _DUPLICATE_KEY
+            }
+            duplicates = len(errors) - len(rejected)
+            invalid = len(rejected)
+            if invalid:
+                logger.warning("Dropped %d invalid watch events", invalid)
+            with self._cond:
+                self._counters["flushed"] += len(batch) - len(errors)
+                self._counters["failed"] += invalid
+                self._counters["duplicates"] += duplicates
+                self._counters["batches"] += 1
+            return [event for i, event in enumerate(batch) if i not in rejected]
+        except PyMongoError:
+            logger.exception("Watch event flush failed")
+            return None
+        with self._cond:
+            self._counters["flushed"] += len(batch)
+            self._counters["batches"] += 1
+        return batch
+
+    def _flush(self, batch: list[dict]) -> bool:
+        inserted = self._insert(batch)
+        if inserted is not None:
+            for hook in self._flush_hooks if inserted else ():
+                try:
+                    hook(inserted)
+                except Exception:
+                    logger.exception("Watch event flush hook failed")
+            return True
+        if self.spill_path and self._spill(batch):
+            return False
+        with self._cond:
+            self._counters["failed"] += len(batch)
+        return False
+
+    def _replay_spill(self):
+        path = self._spill_file()
+        replay_path = path + ".replay"
+        with self._spill_lock:
+            if not os.path.exists(path):
+                return
+            os.replace(path, replay_path)
+
+        batch = []
+        with open(replay_path) as fh:
+            for line in fh:
+                batch.append(json_util.loads(line))
+                if len(batch) >= self.batch_size:
+                    failed = not self._flush(batch)
+                    batch = []
+                    if failed:
+                        # The database went away again; keep the unread tail.
+                        with self._spill_lock, open(self._spill_file(), "a") as out:
+                            shutil.copyfileobj(fh, out)
+                        break
+            if batch:
+                self._flush(batch)
+        # Failed batches were re-spilled by _flush, so the replay file is done.
+        os.unlink(replay_path)
+        with self._cond:
+            self._counters["replayed"] += 1
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                if self._flush(batch) and self.spill_path:
+                    self._replay_spill()
+            elif self._stopping:
+                return
+
+    def flush_and_stop(self, timeout: float = 10.0):
+        """Flush everything still queued; called at interpreter shutdown."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._counters, "queued": len(self._queue)}
+
+
+def init_watch_events(app):
+    """Create the per-process watch event buffer."""
+    global event_buffer
+
+    if event_buffer is not None:
+        event_buffer.flush_and_stop()
+    event_buffer = WatchEventBuffer(
+        max_queue=app.config["WATCH_EVENT_QUEUE_SIZE"],
+        batch_size=app.config["WATCH_EVENT_BATCH_SIZE"],
+        flush_seconds=app.config["WATCH_EVENT_FLUSH_SECONDS"],
+        enqueue_timeout=app.config["WATCH_EVENT_ENQUEUE_TIMEOUT"],
+        spill_path=app.config["WATCH_EVENT_SPILL_PATH"] or None,
+    )
+
+
+def get_watch_event_buffer() -> WatchEventBuffer:
+    if event_buffer is None:
+        raise RuntimeError(
+            "Watch event buffer not initialized. Call init_watch_events(app) first."
+        )
+    return event_buffer
+
+
+def get_watch_event_stats() -> dict:
+    return event_buffer.stats() if event_buffer is not None else {}
+
+
+@atexit.register
+def _flush_on_exit():
+    if event_buffer is not None:
+        event_buffer.flush_and_stop()
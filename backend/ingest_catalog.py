@@ -0,0 +1,483 @@
+"""
+Load or update the video catalog from a JSONL or CSV export.
+
+Records are read lazily, validated, and upserted by ``youtube_id`` in
+unordered ``bulk_write`` batches with several batches in flight. A batch
+that shares a video with one still in flight waits for it, so updates to
+one video are applied in file order. Progress is checkpointed after every
+batch, so an interrupted run resumes where it stopped; the checkpoint is
+removed once the whole file is in. Writes the database refuses go to
+``--rejects``; without it they stop the run before the checkpoint passes
+them.
+
+Run:
+    python ingest_catalog.py sample_videos.jsonl
+    python ingest_catalog.py export.csv.gz --batch-size 1000 --workers 4
+    python ingest_catalog.py export.jsonl --max-rate 2000  # records/s cap
+    python ingest_catalog.py export.jsonl --restart        # ignore checkpoint
+    python ingest_catalog.py export.jsonl --dry-run        # validate only
+
+Fields: ``youtube_id`` and ``title`` are required; ``description``,
+``thumbnail_url`` (defaults to the YouTube thumbnail), ``tags`` (a list, or
+``|``-separated in CSV) and ``is_active`` are optional. Fields a record
+leaves out (or empty CSV cells) are not touched on an existing video, and a
+new video is active unless the record says otherwise. Other fields are
+ignored.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app import create_app
+from config import Config
+from extensions.db import ensure_indexes
+from models.video import Video
+from utils.pacing import TokenBucket
+
+YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+THUMBNAIL_URL = "https://img.youtube.com/vi/{}/hqdefault.jpg"
+
+_TRUE = {"1", "true", "yes", "y"}
+_FALSE = {"0", "false", "no", "n"}
+_MAX_REPORTED_REJECTS = 20
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise ValueError(f"Cannot tell the format of {path!r}; pass --format")
+
+
+def _open_text(path: str):
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    # utf-8-sig drops the BOM spreadsheet exports start with.
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def read_records(path: str, fmt: str, skip: int = 0):
+    """Yield ``(position, record, error)`` for each input record, lazily.
+
+    ``position`` counts input records (JSONL lines or CSV rows) from 1. The
+    first ``skip`` records are passed over without being parsed where the
+    format allows it. ``record`` is ``None`` when the line could not be
+    parsed, and ``error`` says why.
+    """
+    with _open_text(path) as f:
+        if fmt == "jsonl":
+            for position, line in enumerate(f, 1):
+                if position <= skip or not line.strip():
+                    continue
+                try:
+                    yield position, json.loads(line), None
+                except ValueError as exc:
+                    yield position, None, f"invalid JSON: {exc}"
+        else:
+            for position, row in enumerate(csv.DictReader(f), 1):
+                if position > skip:
+                    yield position, row, None
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"is_active must be a boolean, got {value!r}")
+
+
+def validate(raw) -> dict:
+    """The catalog fields of one input record; raises ``ValueError``."""
+    if not isinstance(raw, dict):
+        raise ValueError("record is not an object")
+    present = {k: v for k, v in raw.items() if v is not None and v != ""}
+
+    youtube_id = present.get("youtube_id")
+    if not isinstance(youtube_id, str) or not YOUTUBE_ID_RE.match(youtube_id):
+        raise ValueError(f"invalid youtube_id {youtube_id!r}")
+    title = present.get("title")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("title is required")
+    record = {"youtube_id": youtube_id, "title": title.strip()}
+
+    if "description" in present:
+        if not isinstance(present["description"], str):
+            raise ValueError("description must be a string")
+        record["description"] = present["description"].strip()
+    if "thumbnail_url" in present:
+        url = present["thumbnail_url"]
+        if not isinstance(url, str) or not url.startswith(("https://", "http://")):
+            raise ValueError(f"invalid thumbnail_url {url!r}")
+        record["thumbnail_url"] = url
+    if "tags" in present:
+        tags = present["tags"]
+        if isinstance(tags, str):
+            tags = tags.split("|")
+        if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+            raise ValueError("tags must be a list of strings")
+        record["tags"] = [t.strip() for t in tags if t.strip()]
+    if "is_active" in present:
+        record["is_active"] = _as_bool(present["is_active"])
+    return record
+
+
+def upsert_op(record: dict) -> UpdateOne:
+    """An upsert that leaves a video untouched when nothing in it changes.
+
+    The update is a pipeline so ``updated_at``, which the catalog cache's
+    poll watches, is only stamped when a field differs. An identical record
+    then changes no document: it counts as unchanged, emits no change event
+    and keeps the cache. Values are wrapped in ``$literal`` so strings that
+    start with ``$`` are not read as field paths.
+    """
+    fields = dict(record)
+    youtube_id = fields.pop("youtube_id")
+    values = {name: {"$literal": value} for name, value in fields.items()}
+    # Defaults for new videos; an existing video keeps its own.
+    if "is_active" not in fields:
+        values["is_active"] = {"$ifNull": ["$is_active", True]}
+    if "thumbnail_url" not in fields:
+        values["thumbnail_url"] = {
+            "$ifNull": ["$thumbnail_url", THUMBNAIL_URL.format(youtube_id)]
+        }
+    unchanged = {
+        "$and": [
+            {"$ne": [{"$type": "$updated_at"}, "missing"]},
+            *({"$eq": [f"${name}", value]} for name, value in values.items()),
+        ]
+    }
+    stamp = {"$cond": [unchanged, "$updated_at", "$$NOW"]}
+    pipeline = [{"$set": {"updated_at": stamp}}, {"$set": values}]
+    return UpdateOne({"youtube_id": youtube_id}, pipeline, upsert=True)
+
+
+class Checkpoint:
+    """How many input records are fully written, tied to one input file.
+
+    Batches finish out of order, so the saved position only advances past a
+    batch once every earlier batch has finished too. A resumed run may
+    rewrite a few records, which upserts make harmless.
+    """
+
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        stat = os.stat(input_path)
+        self.identity = {
+            "input": os.path.abspath(input_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        self.position = 0
+
+    def load(self) -> int:
+        """The saved position; raises ``ValueError`` if the input changed."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if any(saved.get(k) != v for k, v in self.identity.items()):
+            raise ValueError(
+                f"{self.path} belongs to a different or modified input; "
+                "pass --restart to ingest from the beginning"
+            )
+        self.position = saved["position"]
+        return self.position
+
+    def save(self, position: int):
+        self.position = position
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({**self.identity, "position": position}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Ingest:
+    """Submits upsert batches and keeps the counters and the checkpoint."""
+
+    def __init__(self, collection, checkpoint, max_rate: float, rejects=None):
+        self.collection = collection
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.bucket = TokenBucket(max_rate, burst=max_rate) if max_rate else None
+        self.counters = {
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "merged": 0,
+            "rejected": 0,
+            "failed": 0,
+        }
+        self._finished: dict[int, int] = {}
+        self._next_seq = 0
+        self._committed_seq = 0
+        self.error: BaseException | None = None
+
+    def write(self, ops: list) -> tuple[dict, list]:
+        try:
+            result = self.collection.bulk_write(ops, ordered=False).bulk_api_result
+            errors = []
+        except BulkWriteError as exc:
+            # Unordered: every other operation in the batch was still applied.
+            result = exc.details
+            errors = result.get("writeErrors", [])
+        return result, errors
+
+    def account(self, result: dict, errors: list):
+        inserted = result.get("nUpserted", 0)
+        matched = result.get("nMatched", 0)
+        modified = result.get("nModified", 0)
+        self.counters["inserted"] += inserted
+        self.counters["updated"] += modified
+        self.counters["unchanged"] += matched - modified
+        self.counters["failed"] += len(errors)
+        for error in errors[:3]:
+            print(f"write error: {error.get('errmsg')}", file=sys.stderr)
+
+    def reject(self, position: int, error: str, record):
+        """Save a record that was not written to ``--rejects``, if given."""
+        if self.rejects is not None:
+            line = {"line": position, "error": error, "record": record}
+            self.rejects.write(json.dumps(line, default=str) + "\n")
+
+    def submit(self, executor, batch: dict, end: int):
+        """Write ``batch`` (youtube_id -> (position, record)) on ``executor``."""
+        if self.bucket is not None:
+            time.sleep(self.bucket.reserve(len(batch)))
+        entries = list(batch.values())
+        ops = [upsert_op(record) for _, record in entries]
+        future = executor.submit(self.write, ops)
+        future.seq, future.end = self._next_seq, end
+        future.entries, future.youtube_ids = entries, set(batch)
+        self._next_seq += 1
+        return future
+
+    def finish(self, future):
+        """Account a completed batch and advance the checkpoint if possible.
+
+        A batch that raised is left unfinished, so the checkpoint never
+        moves past it; ``error`` is set and no more batches are submitted.
+        Writes the database refused are saved to ``rejects``; without it
+        the batch is left unfinished in the same way.
+        """
+        exc = future.exception()
+        if exc is not None:
+            self.error = self.error or exc
+            return
+        result, errors = future.result()
+        self.account(result, errors)
+        if errors and self.rejects is None:
+            self.error = self.error or RuntimeError(
+                f"{len(errors)} writes failed; pass --rejects to save them "
+                "and continue past them"
+            )
+            return
+        for error in errors:
+            position, record = future.entries[error["index"]]
+            self.reject(position, error.get("errmsg", "write failed"), record)
+        self._finished[future.seq] = future.end
+        position = None
+        while self._committed_seq in self._finished:
+            position = self._finished.pop(self._committed_seq)
+            self._committed_seq += 1
+        if position is not None:
+            self.checkpoint.save(position)
+
+
+def _report(ingest: Ingest, position: int, start_position: int, started: float):
+    elapsed = max(time.monotonic() - started, 1e-6)
+    rate = (position - start_position) / elapsed
+    c = ingest.counters
+    print(
+        f"{position} records ({rate:,.0f}/s): {c['inserted']} inserted, "
+        f"{c['updated']} updated, {c['unchanged']} unchanged, "
+        f"{c['merged']} merged, {c['rejected']} rejected, {c['failed']} failed"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL or CSV file, optionally .gz")
+    parser.add_argument("--format", choices=("jsonl", "csv"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--workers", type=int, default=4, help="batches written concurrently"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=0,
+        help="records per second across all workers (0: unlimited)",
+    )
+    parser.add_argument(
+        "--checkpoint", help="checkpoint file (default: INPUT.checkpoint)"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore an existing checkpoint"
+    )
+    parser.add_argument(
+        "--rejects",
+        help="write invalid records and failed writes here as JSONL "
+        "(line, error, record)",
+    )
+    parser.add_argument("--progress-seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="validate without writing"
+    )
+    args = parser.parse_args()
+
+    try:
+        fmt = args.format or detect_format(args.input)
+        checkpoint = Checkpoint(
+            args.checkpoint or f"{args.input}.checkpoint", args.input
+        )
+        if args.restart or args.dry_run:
+            skip = 0
+        else:
+            skip = checkpoint.load()
+    except (OSError, ValueError) as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    if skip:
+        print(f"Resuming after record {skip} ({checkpoint.path}).")
+
+    load_dotenv()
+    app = create_app(Config)
+    with app.app_context():
+        collection = None
+        if not args.dry_run:
+            # The unique youtube_id index makes each upsert an index lookup
+            # and keeps concurrent batches from inserting the same video twice.
+            try:
+                ensure_indexes()
+            except PyMongoError as exc:
+                print(f"Could not create indexes: {exc}", file=sys.stderr)
+                return 1
+            collection = Video.collection("default")
+        rejects = open(args.rejects, "a") if args.rejects else None
+        try:
+            ingest = Ingest(collection, checkpoint, args.max_rate, rejects)
+            return _run(args, fmt, skip, ingest)
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+
+def _run(args, fmt: str, skip: int, ingest: Ingest) -> int:
+    started = last_report = time.monotonic()
+    position = skip
+    batch: dict[str, tuple[int, dict]] = {}
+    in_flight = set()
+    interrupted = False
+
+    def drain(limit: int):
+        nonlocal in_flight
+        while len(in_flight) > limit:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                ingest.finish(future)
+
+    def submit():
+        nonlocal in_flight
+        # A batch in flight may hold an older update to one of these videos.
+        conflicts = {f for f in in_flight if not f.youtube_ids.isdisjoint(batch)}
+        if conflicts:
+            wait(conflicts)
+            for future in conflicts:
+                ingest.finish(future)
+            in_flight -= conflicts
+            if ingest.error is not None:
+                return
+        in_flight.add(ingest.submit(executor, batch, position))
+
+    executor = ThreadPoolExecutor(
+        max_workers=args.workers, thread_name_prefix="catalog-ingest"
+    )
+    try:
+        for position, raw, error in read_records(args.input, fmt, skip):
+            if error is None:
+                try:
+                    record = validate(raw)
+                except ValueError as exc:
+                    error = str(exc)
+            if error is not None:
+                ingest.counters["rejected"] += 1
+                if ingest.counters["rejected"] <= _MAX_REPORTED_REJECTS:
+                    print(f"record {position}: {error}", file=sys.stderr)
+                ingest.reject(position, error, raw)
+                continue
+            if args.dry_run:
+                continue
+
+            previous = batch.get(record["youtube_id"])
+            if previous is not None:
+                # Applied in file order, as if the two were written one by one.
+                previous[1].update(record)
+                batch[record["youtube_id"]] = (position, previous[1])
+                ingest.counters["merged"] += 1
+            else:
+                batch[record["youtube_id"]] = (position, record)
+            if len(batch) < args.batch_size:
+                continue
+
+            # Parse at most one round of batches ahead of the writers.
+            drain(args.workers * 2 - 1)
+            if ingest.error is not None:
+                break
+            submit()
+            if ingest.error is not None:
+                break
+            batch = {}
+
+            if time.monotonic() - last_report >= args.progress_seconds:
+                _report(ingest, ingest.checkpoint.position, skip, started)
+                last_report = time.monotonic()
+        else:
+            if batch:
+                submit()
+        drain(0)
+    except KeyboardInterrupt:
+        print("Interrupted; finishing batches in flight.", file=sys.stderr)
+        interrupted = True
+        drain(0)
+    finally:
+        executor.shutdown(wait=True)
+
+    if args.dry_run:
+        _report(ingest, position, skip, started)
+        return 0
+    _report(ingest, ingest.checkpoint.position, skip, started)
+    if ingest.error is not None or interrupted:
+        if ingest.error is not None:
+            print(f"Ingest stopped: {ingest.error}", file=sys.stderr)
+        print(f"Run again to resume after record {ingest.checkpoint.position}.")
+        return 130 if interrupted else 1
+    ingest.checkpoint.remove()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
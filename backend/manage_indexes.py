@@ -0,0 +1,53 @@
+"""
+Create the MongoDB indexes declared on the models and verify query plans.
+
+Run:
+    python manage_indexes.py          # create indexes (idempotent)
+    python manage_indexes.py --check  # also explain every known query shape
+                                      # and exit non-zero on any COLLSCAN
+"""
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+from app import create_app
+from config import Config
+from extensions.db import ensure_indexes, explain_query_shapes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes.")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="explain all registered query shapes and fail on collection scans",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    app = create_app(Config)
+    with app.app_context():
+        ensure_indexes()
+        print("Indexes ensured.")
+        if not args.check:
+            return 0
+
+        failures = 0
+        for result in explain_query_shapes():
+            status = "COLLSCAN" if result["collscan"] else "ok"
+            failures += result["collscan"]
+            print(
+                f"{status:8} {result['collection']}.{result['query']}: "
+                f"{', '.join(result['stages'])}"
+            )
+        if failures:
+            print(f"{failures} query shape(s) use a collection scan.")
+            return 1
+        print("All query shapes are index-backed.")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
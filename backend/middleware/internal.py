@@ -0,0 +1,34 @@
+import hmac
+import ipaddress
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+
+def _is_loopback(address: str | None) -> bool:
+    try:
+        return ipaddress.ip_address(address or "").is_loopback
+    except ValueError:
+        return False
+
+
+def internal_only(fn):
+    """Restrict a view to operators and scrapers.
+
+    With ``STATS_TOKEN`` set, the request must send it as a bearer token.
+    Without one, only clients on the loopback interface are let in.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_app.config["STATS_TOKEN"]
+        if token:
+            presented = request.headers.get("Authorization", "").encode()
+            allowed = hmac.compare_digest(presented, f"Bearer {token}".encode())
+        else:
+            allowed = _is_loopback(request.remote_addr)
+        if not allowed:
+            return jsonify({"message": "Forbidden"}), 403
+        return fn(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,30 @@
+from functools import wraps
+
+from flask import jsonify, request
+
+from extensions.shared_state import get_rate_limiter, parse_rate_limit
+
+
+def rate_limit(get_limit):
+    """Limit a view per client address using the shared sliding-window limiter.
+
+    ``get_limit`` returns a limit string such as ``"5 per minute"``; it is
+    called per request so the value can come from app config.
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            amount, window = parse_rate_limit(get_limit())
+            key = f"{request.endpoint}:{request.remote_addr or '127.0.0.1'}"
+            allowed, retry_after = get_rate_limiter().hit(key, amount, window)
+            if not allowed:
+                response = jsonify({"message": "Too many requests"})
+                response.status_code = 429
+                response.headers["Retry-After"] = str(retry_after)
+                return response
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
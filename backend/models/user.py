@@ -1,11 +1,13 @@
 from datetime import datetime
 
 from bson import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo import ASCENDING, IndexModel
 
-from extensions.db import get_db
+from extensions.db import get_db, register_model
+from extensions.hashing import HashingBusy, check_password, hash_password, needs_rehash
 
 
+@register_model
 class User:
     """User model backed by MongoDB.
 
@@ -15,6 +17,12 @@ class User:
 
     collection_name = "users"
 
+    indexes = [IndexModel([("email", ASCENDING)], unique=True, name="email_unique")]
+    query_shapes = [
+        {"name": "find_by_email", "filter": {"email": "someone@example.com"}},
+        {"name": "find_by_id", "filter": {"_id": ObjectId()}},
+    ]
+
     def __init__(self, data: dict):
         self.data = data
 
@@ -24,8 +32,9 @@ class User:
 
     @classmethod
     def create(cls, name: str, email: str, password: str):
+        """Insert a user. Raises ``DuplicateKeyError`` if the email is taken."""
         now = datetime.utcnow()
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password(password)
         doc = {
             "name": name,
             "email": email.lower(),
@@ -51,7 +60,23 @@ class User:
         return cls(doc) if doc else None
 
     def verify_password(self, password: str) -> bool:
-        return check_password_hash(self.data["password_hash"], password)
+        """Check the password, upgrading the stored hash if its cost changed.
+
+        Raises ``HashingBusy`` when the hashing pool cannot take the check.
+        A busy pool only postpones the upgrade to a later login.
+        """
+        if not check_password(self.data["password_hash"], password):
+            return False
+        if needs_rehash(self.data["password_hash"]):
+            try:
+                password_hash = hash_password(password)
+            except HashingBusy:
+                return True
+            self.collection().update_one(
+                {"_id": self.data["_id"]}, {"$set": {"password_hash": password_hash}}
+            )
+            self.data["password_hash"] = password_hash
+        return True
 
     def to_public_dict(self) -> dict:
         return {
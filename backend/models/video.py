@@ -1,29 +1,302 @@
+import logging
+import os
+import threading
+import time
+
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from extensions.db import get_db, register_model
+from utils.cache import TTLCache
+from utils.http_cache import json_body_and_etag
+
+logger = logging.getLogger(__name__)
+
+# Fields read by ``to_public_dict``; listings fetch nothing else.
+PUBLIC_PROJECTION = {"title": 1, "description": 1, "thumbnail_url": 1}
+
+# Read-through cache for catalog queries. ``None`` means caching is disabled.
+_cache: TTLCache | None = None
+_catalog_version = 0
+_version_lock = threading.Lock()
+_poll_seconds = 5.0
+_coalesce_seconds = 1.0
+# The watcher thread is per process; a forked worker starts its own.
+_watcher_pid: int | None = None
+
+
+def invalidate_video_cache():
+    """Drop cached catalog reads and bump the catalog version."""
+    global _catalog_version
+    with _version_lock:
+        _catalog_version += 1
+    if _cache is not None:
+        _cache.clear()
+
+
+def get_catalog_version() -> int:
+    """Counter that changes whenever the ``videos`` collection changes."""
+    return _catalog_version
+
+
+def _catalog_fingerprint(collection) -> tuple:
+    """Cheap change signal: document count, newest _id and last update.
+
+    The count comes from collection metadata and both maxima from the end
+    of an index, so a poll costs the same for ten videos or a million.
+    Writers stamp ``updated_at`` (see ``ingest_catalog.upsert_op``); edits
+    that skip it are picked up when cache entries expire.
+    """
+    newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    touched = collection.find_one(
+        {}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)]
+    )
+    return (
+        collection.estimated_document_count(),
+        newest and newest["_id"],
+        touched and touched.get("updated_at"),
+    )
+
+
+def _copy_doc(doc: dict) -> dict:
+    """Copy of a cached document, so callers cannot change the shared entry.
+
+    Catalog documents are flat apart from lists such as ``tags``, so one
+    level of copying is enough and far cheaper than ``copy.deepcopy``.
+    """
+    return {
+        key: value.copy() if isinstance(value, (list, dict)) else value
+        for key, value in doc.items()
+    }
+
+
+def _watch_catalog(collection, poll_seconds: float, coalesce_seconds: float):
+    """Invalidate on change-stream events, polling when they are unavailable.
+
+    Change streams need a replica set; on a standalone server the watcher
+    falls back to comparing a cheap fingerprint of the collection every
+    ``poll_seconds``. Events are coalesced: the cache is dropped at most
+    once per ``coalesce_seconds``, so a bulk catalog import (one event per
+    written document) does not send every dashboard read to MongoDB.
+    """
+    await_ms = int(coalesce_seconds * 1000) or None
+    while True:
+        try:
+            with collection.watch(max_await_time_ms=await_ms) as stream:
+                # Changes between the last read and the stream opening.
+                invalidate_video_cache()
+                invalidated_at, dirty = time.monotonic(), False
+                while stream.alive:
+                    if stream.try_next() is not None:
+                        dirty = True
+                    now = time.monotonic()
+                    if dirty and now - invalidated_at >= coalesce_seconds:
+                        invalidate_video_cache()
+                        invalidated_at, dirty = now, False
+        except OperationFailure as exc:
+            logger.info("Video change stream unavailable (%s); polling instead", exc)
+            break
+        except PyMongoError as exc:
+            logger.warning("Video change stream interrupted: %s", exc)
+            invalidate_video_cache()
+            time.sleep(poll_seconds)
+
+    fingerprint = None
+    while True:
+        try:
+            current = _catalog_fingerprint(collection)
+        except PyMongoError as exc:
+            logger.warning("Video catalog poll failed: %s", exc)
+        else:
+            if fingerprint is not None and current != fingerprint:
+                invalidate_video_cache()
+            fingerprint = current
+        time.sleep(poll_seconds)
+
 
-from extensions.db import get_db
+def init_video_cache(app):
+    """Enable the catalog read cache; its watcher starts on first use."""
+    global _cache, _poll_seconds, _coalesce_seconds
 
+    if not app.config["VIDEO_CACHE_ENABLED"]:
+        _cache = None
+        return
+    _cache = TTLCache(
+        max_entries=app.config["VIDEO_CACHE_MAX_ENTRIES"],
+        ttl=app.config["VIDEO_CACHE_TTL_SECONDS"],
+    )
+    _poll_seconds = app.config["VIDEO_CACHE_POLL_SECONDS"]
+    _coalesce_seconds = app.config["VIDEO_CACHE_COALESCE_SECONDS"]
 
+
+def _ensure_watcher():
+    global _watcher_pid
+
+    pid = os.getpid()
+    if _watcher_pid == pid:
+        return
+    with _version_lock:
+        if _watcher_pid == pid:
+            return
+        _watcher_pid = pid
+    # Entries copied from a parent process were never watched here.
+    invalidate_video_cache()
+    threading.Thread(
+        target=_watch_catalog,
+        args=(Video.collection(), _poll_seconds, _coalesce_seconds),
+        name="video-cache-watcher",
+        daemon=True,
+    ).start()
+
+
+def get_video_cache_stats() -> dict:
+    if _cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "catalog_version": _catalog_version, **_cache.stats()}
+
+
+@register_model
 class Video:
     """Video model wrapping YouTube IDs which are never exposed to the client."""
 
     collection_name = "videos"
 
+    indexes = [
+        IndexModel(
+            [("is_active", ASCENDING), ("_id", DESCENDING)], name="active_newest"
+        ),
+        IndexModel(
+            [("is_active", ASCENDING), ("tags", ASCENDING), ("_id", DESCENDING)],
+            name="active_tag_newest",
+        ),
+        IndexModel(
+            [("title", TEXT), ("description", TEXT)],
+            weights={"title": 5, "description": 1},
+            name="catalog_text",
+        ),
+        # Catalog imports upsert by YouTube ID (see ingest_catalog.py).
+        IndexModel([("youtube_id", ASCENDING)], unique=True, name="youtube_id_unique"),
+        # The cache watcher's poll reads the latest update from this index.
+        IndexModel([("updated_at", DESCENDING)], name="updated_newest"),
+    ]
+    query_shapes = [
+        {
+            "name": "find_active_dashboard_videos",
+            "filter": {"is_active": True},
+            "sort": [("_id", -1)],
+            "limit": 2,
+        },
+        {"name": "find_by_id", "filter": {"_id": ObjectId(), "is_active": True}},
+        {
+            "name": "list_page",
+            "filter": {"is_active": True, "_id": {"$lt": ObjectId()}},
+            "sort": [("_id", -1)],
+            "limit": 21,
+        },
+        {
+            "name": "list_page_by_tag",
+            "filter": {"is_active": True, "tags": "tag", "_id": {"$lt": ObjectId()}},
+            "sort": [("_id", -1)],
+            "limit": 21,
+        },
+        {
+            "name": "list_page_by_text",
+            "filter": {"is_active": True, "$text": {"$search": "startup"}},
+            "sort": [("_id", -1)],
+            "limit": 21,
+        },
+        {"name": "upsert_by_youtube_id", "filter": {"youtube_id": "dQw4w9WgXcQ"}},
+        {
+            "name": "catalog_poll_last_update",
+            "filter": {},
+            "sort": [("updated_at", -1)],
+            "limit": 1,
+        },
+    ]
+
     def __init__(self, data: dict):
         self.data = data
 
     @classmethod
-    def collection(cls):
-        return get_db()[cls.collection_name]
+    def collection(cls, workload: str = "catalog"):
+        return get_db(workload)[cls.collection_name]
+
+    @classmethod
+    def _cached(cls, key, load):
+        if _cache is None:
+            return load()
+        _ensure_watcher()
+        value = _cache.get(key)
+        if value is None:
+            version = _catalog_version
+            value = load()
+            # Skip the write if an invalidation raced with the load.
+            if version == _catalog_version:
+                _cache.set(key, value)
+        return value
+
+    @classmethod
+    def cached_json(cls, key: tuple, build) -> tuple[bytes, str]:
+        """Serialized ``build()`` and its ETag, reused until the catalog changes.
+
+        Repeat polls skip both the query and the JSON encoding, and a client
+        holding the current ETag can be answered with a 304 from memory.
+        """
+        return cls._cached(("json",) + key, lambda: json_body_and_etag(build()))
 
     @classmethod
     def find_active_dashboard_videos(cls, limit: int = 2):
-        cursor = (
-            cls.collection()
-            .find({"is_active": True})
-            .sort("_id", -1)
-            .limit(limit)
-        )
-        return [cls(doc) for doc in cursor]
+        def load():
+            cursor = (
+                cls.collection()
+                .find({"is_active": True}, PUBLIC_PROJECTION)
+                .sort("_id", -1)
+                .limit(limit)
+            )
+            return list(cursor)
+
+        docs = cls._cached(("dashboard", limit), load)
+        return [cls(_copy_doc(doc)) for doc in docs]
+
+    @classmethod
+    def list_page(
+        cls,
+        limit: int,
+        after: ObjectId | None = None,
+        tag: str | None = None,
+        text: str | None = None,
+    ) -> tuple[list["Video"], ObjectId | None]:
+        """One page of active videos, newest first, after the ``after`` _id.
+
+        Keyset pagination: each page is an index range scan starting at the
+        cursor, so page 1000 costs the same as page 1. Unfiltered and tag
+        pages use ``active_newest`` / ``active_tag_newest``. A text search
+        matches through ``catalog_text`` and then sorts the matches by _id,
+        so its cost grows with the number of matches rather than the depth.
+        Only public fields are fetched. Returns the page and the cursor for
+        the next one (``None`` on the last page).
+        """
+        query: dict = {"is_active": True}
+        if after is not None:
+            query["_id"] = {"$lt": after}
+        if tag:
+            query["tags"] = tag
+        if text:
+            query["$text"] = {"$search": text}
+
+        def load():
+            cursor = (
+                cls.collection()
+                .find(query, PUBLIC_PROJECTION)
+                .sort("_id", -1)
+                .limit(limit + 1)
+            )
+            return list(cursor)
+
+        docs = cls._cached(("page", limit, after, tag, text), load)
+        next_cursor = docs[limit - 1]["_id"] if len(docs) > limit else None
+        return [cls(_copy_doc(doc)) for doc in docs[:limit]], next_cursor
 
     @classmethod
     def find_by_id(cls, video_id: str):
@@ -31,8 +304,16 @@ class Video:
             oid = ObjectId(video_id)
         except Exception:
             return None
-        doc = cls.collection().find_one({"_id": oid, "is_active": True})
-        return cls(doc) if doc else None
+
+        def load():
+            # Cache misses as well, so unknown IDs do not bypass the cache.
+            return (
+                cls.collection("stream").find_one({"_id": oid, "is_active": True})
+                or {}
+            )
+
+        doc = cls._cached(("id", oid), load)
+        return cls(_copy_doc(doc)) if doc else None
 
     def to_public_dict(self) -> dict:
         """Public representation without leaking YouTube implementation details."""
@@ -43,7 +324,10 @@ class Video:
             "thumbnail_url": self.data.get("thumbnail_url"),
         }
 
+    @property
+    def is_active(self) -> bool:
+        return bool(self.data.get("is_active"))
+
     def get_youtube_id(self) -> str:
         """Internal accessor. Never send to client."""
         return self.data["youtube_id"]
-
@@ -0,0 +1,332 @@
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from extensions.db import get_db, register_model
+
+logger = logging.getLogger(__name__)
+
+_DUPLICATE_KEY = 11000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _bucket_start(when: datetime, bucket_seconds: int) -> datetime:
+    """Start of the UTC bucket containing ``when`` (naive UTC, like ``utcnow``)."""
+    seconds = int((when - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+@register_model
+class WatchEvent:
+    """Raw append-only watch events, written by the watch event buffer."""
+
+    collection_name = "watch_events"
+
+    indexes = [
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("video_id", ASCENDING),
+                ("recorded_at", DESCENDING),
+            ],
+            name="user_video_recent",
+        ),
+        IndexModel(
+            [("video_id", ASCENDING), ("recorded_at", DESCENDING)],
+            name="video_recent",
+        ),
+    ]
+    query_shapes = [
+        {
+            "name": "user_video_history",
+            "filter": {"user_id": "user", "video_id": "video"},
+            "sort": [("recorded_at", -1)],
+            "limit": 50,
+        },
+        {
+            "name": "video_events_since",
+            "filter": {
+                "video_id": "video",
+                "recorded_at": {"$gte": datetime(2024, 1, 1)},
+            },
+        },
+    ]
+
+
+@register_model
+class WatchProgress:
+    """Latest playback position per (user, video), kept for resume.
+
+    One document per pair, keyed by ``"<user_id>:<video_id>"``, so reads are a
+    single ``_id`` lookup regardless of how many raw events exist.
+    """
+
+    collection_name = "watch_progress"
+
+    indexes = []
+    query_shapes = [{"name": "find", "filter": {"_id": "user:video"}}]
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    @classmethod
+    def collection(cls):
+        return get_db("analytics")[cls.collection_name]
+
+    @staticmethod
+    def _key(user_id: str, video_id: str) -> str:
+        return f"{user_id}:{video_id}"
+
+    @classmethod
+    def find(cls, user_id: str, video_id: str):
+        doc = cls.collection().find_one({"_id": cls._key(user_id, video_id)})
+        return cls(doc) if doc else None
+
+    @classmethod
+    def update_ops(cls, events: list[dict]) -> list[UpdateOne]:
+        """Reduce a batch to one conditional upsert per (user, video).
+
+        The position is only replaced when the event is newer than what is
+        stored, so batches flushed out of order cannot move it backwards.
+        """
+        latest: dict[str, dict] = {}
+        for event in events:
+            if not isinstance(event.get("timestamp"), (int, float)):
+                continue
+            key = cls._key(event["user_id"], event["video_id"])
+            current = latest.get(key)
+            if current is None or event["recorded_at"] >= current["recorded_at"]:
+                latest[key] = event
+
+        ops = []
+        for key, event in latest.items():
+            recorded_at = event["recorded_at"]
+            is_newer = {
+                "$gte": [recorded_at, {"$ifNull": ["$updated_at", _EPOCH]}]
+            }
+            ops.append(
+                UpdateOne(
+                    {"_id": key},
+                    [
+                        {
+                            "$set": {
+                                "user_id": event["user_id"],
+                                "video_id": event["video_id"],
+                                "position": {
+                                    "$cond": [
+                                        is_newer,
+                                        {"$literal": event["timestamp"]},
+                                        "$position",
+                                    ]
+                                },
+                                "last_event": {
+                                    "$cond": [
+                                        is_newer,
+                                        {"$literal": event["event"]},
+                                        "$last_event",
+                                    ]
+                                },
+                                "updated_at": {
+                                    "$cond": [is_newer, recorded_at, "$updated_at"]
+                                },
+                            }
+                        }
+                    ],
+                    upsert=True,
+                )
+            )
+        return ops
+
+    def to_public_dict(self) -> dict:
+        return {
+            "video_id": self.data["video_id"],
+            "position": self.data.get("position", 0),
+            "last_event": self.data.get("last_event"),
+            "updated_at": self.data["updated_at"].isoformat() + "Z",
+        }
+
+
+@register_model
+class VideoBucketViewer:
+    """One document per (video, bucket, user) seen in that bucket.
+
+    The ``_id`` is the triple, so inserting a viewer who is already counted
+    (a repeat event, or a replayed batch) fails with a duplicate key. Only
+    successful inserts add to ``VideoWatchStats.unique_viewers``, which
+    keeps the stats document a fixed size however many viewers it has.
+    """
+
+    collection_name = "video_bucket_viewers"
+
+    indexes = []
+    query_shapes = [{"name": "find", "filter": {"_id": "video:bucket:user"}}]
+
+    @classmethod
+    def collection(cls):
+        return get_db("analytics")[cls.collection_name]
+
+    @classmethod
+    def record(cls, events: list[dict], bucket_seconds: int) -> dict[str, int]:
+        """Insert the batch's viewers; new viewers per ``VideoWatchStats`` key."""
+        docs: dict[str, dict] = {}
+        for event in events:
+            bucket = _bucket_start(event["recorded_at"], bucket_seconds)
+            stats_key = VideoWatchStats._key(event["video_id"], bucket)
+            docs.setdefault(
+                f"{stats_key}:{event['user_id']}",
+                {
+                    "stats_key": stats_key,
+                    "video_id": event["video_id"],
+                    "bucket": bucket,
+                    "user_id": event["user_id"],
+                },
+            )
+        if not docs:
+            return {}
+
+        batch = [{"_id": _id, **doc} for _id, doc in docs.items()]
+        failed: set[int] = set()
+        try:
+            cls.collection().insert_many(batch, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                failed.add(error["index"])
+                if error.get("code") != _DUPLICATE_KEY:
+                    logger.error("Failed to record viewer: %s", error.get("errmsg"))
+        except PyMongoError:
+            logger.exception("Failed to record viewers")
+            return {}
+
+        added: dict[str, int] = {}
+        for index, doc in enumerate(batch):
+            if index not in failed:
+                added[doc["stats_key"]] = added.get(doc["stats_key"], 0) + 1
+        return added
+
+
+@register_model
+class VideoWatchStats:
+    """Per-video event counts and unique viewers rolled up by time bucket."""
+
+    collection_name = "video_watch_stats"
+
+    indexes = []
+    query_shapes = [
+        {"name": "recent", "filter": {"_id": {"$in": ["video:2024-01-01T00:00:00"]}}}
+    ]
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    @classmethod
+    def collection(cls):
+        return get_db("analytics")[cls.collection_name]
+
+    @staticmethod
+    def _key(video_id: str, bucket: datetime) -> str:
+        return f"{video_id}:{bucket.isoformat()}"
+
+    @classmethod
+    def update_ops(
+        cls, events: list[dict], bucket_seconds: int, new_viewers: dict[str, int]
+    ) -> list[UpdateOne]:
+        """One upsert per (video, bucket) touched by the batch.
+
+        ``new_viewers`` comes from ``VideoBucketViewer.record`` for the same
+        batch.
+        """
+        rollups: dict[str, dict] = {}
+        for event in events:
+            bucket = _bucket_start(event["recorded_at"], bucket_seconds)
+            key = cls._key(event["video_id"], bucket)
+            rollup = rollups.setdefault(
+                key,
+                {"video_id": event["video_id"], "bucket": bucket, "counts": {}},
+            )
+            name = str(event["event"]).replace(".", "_").replace("$", "_")
+            rollup["counts"][name] = rollup["counts"].get(name, 0) + 1
+
+        ops = []
+        for key, rollup in rollups.items():
+            inc = {f"events.{name}": n for name, n in rollup["counts"].items()}
+            inc["total_events"] = sum(rollup["counts"].values())
+            if new_viewers.get(key):
+                inc["unique_viewers"] = new_viewers[key]
+            ops.append(
+                UpdateOne(
+                    {"_id": key},
+                    {
+                        "$setOnInsert": {
+                            "video_id": rollup["video_id"],
+                            "bucket": rollup["bucket"],
+                        },
+                        "$inc": inc,
+                    },
+                    upsert=True,
+                )
+            )
+        return ops
+
+    @classmethod
+    def recent(cls, video_id: str, buckets: int, bucket_seconds: int) -> list[dict]:
+        """Rollups for the last ``buckets`` buckets, newest first.
+
+        Looks the buckets up by ``_id``, so the cost depends only on
+        ``buckets``.
+        """
+        newest = _bucket_start(datetime.utcnow(), bucket_seconds)
+        keys = [
+            cls._key(video_id, newest - timedelta(seconds=bucket_seconds * i))
+            for i in range(buckets)
+        ]
+        cursor = cls.collection().find(
+            {"_id": {"$in": keys}},
+            {
+                "bucket": 1,
+                "events": 1,
+                "total_events": 1,
+                # Buckets written before viewers moved out kept an array.
+                "unique_viewers": {
+                    "$ifNull": [
+                        "$unique_viewers",
+                        {"$size": {"$ifNull": ["$viewers", []]}},
+                    ]
+                },
+            },
+        )
+        docs = sorted(cursor, key=lambda d: d["bucket"], reverse=True)
+        return [
+            {
+                "bucket_start": doc["bucket"].isoformat() + "Z",
+                "total_events": doc.get("total_events", 0),
+                "events": doc.get("events", {}),
+                "unique_viewers": doc.get("unique_viewers", 0),
+            }
+            for doc in docs
+        ]
+
+
+def apply_watch_aggregates(events: list[dict], bucket_seconds: int) -> None:
+    """Fold a flushed batch of raw watch events into the aggregate collections.
+
+    Registered as a flush hook on the watch event buffer. Failures are logged
+    and do not affect the raw events, which are already stored. Viewers are
+    recorded first, so the stats upserts count only the new ones.
+    """
+    new_viewers = VideoBucketViewer.record(events, bucket_seconds)
+    for model, ops in (
+        (WatchProgress, WatchProgress.update_ops(events)),
+        (
+            VideoWatchStats,
+            VideoWatchStats.update_ops(events, bucket_seconds, new_viewers),
+        ),
+    ):
+        if not ops:
+            continue
+        try:
+            model.collection().bulk_write(ops, ordered=False)
+        except PyMongoError:
+            logger.exception("Failed to update %s", model.collection_name)
@@ -1,32 +1,25 @@
-from datetime import timedelta
-
 from flask import Blueprint, jsonify, request, current_app
-from flask_jwt_extended import (
-    create_access_token,
-    create_refresh_token,
-    decode_token,
-    get_jwt_identity,
-    jwt_required,
-)
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask_jwt_extended import decode_token, get_current_user, get_jwt, jwt_required
+from pymongo.errors import DuplicateKeyError
 
+from extensions.hashing import HashingBusy
+from extensions.sessions import SessionError, get_sessions
+from extensions.shared_state import get_revocation_list
+from middleware.rate_limit import rate_limit
 from models.user import User
 
 auth_bp = Blueprint("auth", __name__)
 
-# Global limiter; will attach to the app without extra kwargs.
-limiter = Limiter(key_func=get_remote_address, default_limits=[])
 
+def _busy_response():
+    response = jsonify({"message": "Server busy, retry shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
 
-@auth_bp.record_once
-def on_load(state):
-    """Hook blueprint into the Flask app and bind the limiter."""
 
-    app = state.app
-    # For the installed Flask-Limiter version, we just call init_app(app).
-    # Storage backend can be configured via app.config if needed.
-    limiter.init_app(app)
+def _email_taken_response():
+    return jsonify({"message": "Email already registered"}), 400
 
 
 @auth_bp.post("/signup")
@@ -40,14 +33,21 @@ def signup():
         return jsonify({"message": "name, email and password are required"}), 400
 
     if User.find_by_email(email):
-        return jsonify({"message": "Email already registered"}), 400
+        return _email_taken_response()
 
-    User.create(name=name, email=email, password=password)
+    try:
+        User.create(name=name, email=email, password=password)
+    except HashingBusy:
+        return _busy_response()
+    except DuplicateKeyError:
+        # A concurrent signup won the race past the check above; the
+        # email_unique index rejected this one.
+        return _email_taken_response()
     return jsonify({"message": "User registered successfully"}), 201
 
 
 @auth_bp.post("/login")
-@limiter.limit(lambda: current_app.config.get("LOGIN_RATE_LIMIT", "5 per minute"))
+@rate_limit(lambda: current_app.config.get("LOGIN_RATE_LIMIT", "5 per minute"))
 def login():
     data = request.get_json() or {}
     email = data.get("email")
@@ -57,43 +57,29 @@ def login():
         return jsonify({"message": "email and password are required"}), 400
 
     user = User.find_by_email(email)
-    if not user or not user.verify_password(password):
-        return jsonify({"message": "Invalid credentials"}), 401
-
-    identity = str(user.data["_id"])
-    access_expires: timedelta = current_app.config["JWT_ACCESS_TOKEN_EXPIRES"]
-    refresh_expires: timedelta = current_app.config["JWT_REFRESH_TOKEN_EXPIRES"]
-
-    access_token = create_access_token(identity=identity, expires_delta=access_expires)
-    refresh_token = create_refresh_token(
-        identity=identity, expires_delta=refresh_expires
-    )
-
-    return (
-        jsonify(
-            {
-                "access_token": access_token,
-                "refresh_token": refresh_token,
-                "expires_in": int(access_expires.total_seconds()),
-            }
-        ),
-        200,
-    )
+    try:
+        if not user or not user.verify_password(password):
+            return jsonify({"message": "Invalid credentials"}), 401
+    except HashingBusy:
+        return _busy_response()
+
+    return jsonify(get_sessions().start(user.to_public_dict())), 200
 
 
 @auth_bp.get("/me")
 @jwt_required()
 def me():
-    user_id = get_jwt_identity()
-    user = User.find_by_id(user_id)
-    if not user:
-        return jsonify({"message": "User not found"}), 404
-    return jsonify(user.to_public_dict())
+    # Resolved from the token's profile claims (cached by jti), not MongoDB.
+    return jsonify(get_current_user())
 
 
 @auth_bp.post("/refresh")
 def refresh():
-    """Issue a new access token from a refresh token in the request body."""
+    """Rotate a refresh token: returns new access and refresh tokens.
+
+    The presented refresh token stops working. Presenting it again ends the
+    whole session.
+    """
     data = request.get_json() or {}
     refresh_token = data.get("refresh_token")
     if not refresh_token:
@@ -107,28 +93,47 @@ def refresh():
     if decoded.get("type") != "refresh":
         return jsonify({"message": "Invalid token type"}), 401
 
-    user_id = decoded.get("sub")
-    if not user_id:
+    if get_sessions().is_revoked(decoded):
+        return jsonify({"message": "Token has been revoked"}), 401
+
+    if not decoded.get("sub"):
         return jsonify({"message": "Invalid token payload"}), 401
 
-    access_expires: timedelta = current_app.config["JWT_ACCESS_TOKEN_EXPIRES"]
-    access_token = create_access_token(identity=user_id, expires_delta=access_expires)
-    return (
-        jsonify(
-            {
-                "access_token": access_token,
-                "expires_in": int(access_expires.total_seconds()),
-            }
-        ),
-        200,
-    )
+    try:
+        tokens = get_sessions().rotate(decoded)
+    except SessionError as exc:
+        return jsonify({"message": str(exc)}), 401
+    return jsonify(tokens), 200
 
 
 @auth_bp.post("/logout")
 @jwt_required()
 def logout():
-    # For this assignment, we mock logout by simply returning success.
-    # In a real implementation you would maintain a token blacklist or
-    # rotate secrets.
+    """End the session, revoking its access and refresh tokens.
+
+    Tokens from before sessions existed are revoked individually: the access
+    token, and the refresh token if one is supplied.
+    """
+    revocations = get_revocation_list()
+    sessions = get_sessions()
+    claims = get_jwt()
+    revocations.revoke(claims["jti"], claims["exp"])
+    sessions.forget(claims["jti"])
+    if claims.get("sid"):
+        sessions.end(claims["sid"])
+
+    refresh_token = (request.get_json(silent=True) or {}).get("refresh_token")
+    if refresh_token:
+        try:
+            decoded = decode_token(refresh_token)
+        except Exception:
+            decoded = None
+        if (
+            decoded
+            and decoded.get("type") == "refresh"
+            and decoded.get("sub") == claims["sub"]
+        ):
+            revocations.revoke(decoded["jti"], decoded["exp"])
+
     return jsonify({"message": "Logged out"}), 200
 
@@ -1,7 +1,8 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint
 from flask_jwt_extended import jwt_required
 
 from models.video import Video
+from utils.http_cache import conditional_json
 
 dashboard_bp = Blueprint("dashboard", __name__)
 
@@ -9,7 +10,14 @@ dashboard_bp = Blueprint("dashboard", __name__)
 @dashboard_bp.get("/dashboard")
 @jwt_required()
 def dashboard():
-    """Return exactly two active videos for the dashboard."""
-    videos = Video.find_active_dashboard_videos(limit=2)
-    return jsonify({"videos": [v.to_public_dict() for v in videos]})
+    """Return exactly two active videos for the dashboard.
 
+    Clients polling with ``If-None-Match`` get a 304 until the catalog changes.
+    """
+
+    def build():
+        videos = Video.find_active_dashboard_videos(limit=2)
+        return {"videos": [v.to_public_dict() for v in videos]}
+
+    body, etag = Video.cached_json(("dashboard", 2), build)
+    return conditional_json(body, etag, "private, no-cache")
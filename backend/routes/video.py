@@ -1,17 +1,90 @@
+import time
 from datetime import datetime
+from functools import partial
 
-import requests
-from flask import Blueprint, jsonify, request, Response, stream_with_context
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    send_file,
+    stream_with_context,
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from extensions.db import get_db
+from extensions.admission import get_stream_admission
+from extensions.coalesce import open_coalesced
+from extensions.hls import get_hls_packager
+from extensions.metrics import meter_stream, observe_stage, request_started_at
+from extensions.prefetch import get_stream_prefetcher
+from extensions.resolver import (
+    ResolutionError,
+    get_upstream_resolver,
+    resolve_upstream_url,
+)
+from extensions.segment_cache import get_segment_cache
+from extensions.upstream import new_chunk_sizer
+from extensions.watch_events import get_watch_event_buffer
 from models.video import Video
-from utils.token import generate_playback_token, verify_playback_token
-from utils.youtube import get_video_upstream_url
+from models.watch import VideoWatchStats, WatchProgress
+from utils.http_cache import conditional_json
+from utils.proxy import forwarded_response_headers, upstream_request_headers
+from utils.token import decode_playback_token, generate_playback_token
 
 video_bp = Blueprint("video", __name__)
 
 
+@video_bp.get("/videos")
+@jwt_required()
+def list_videos():
+    """Cursor-paginated catalog listing.
+
+    Query: ``limit``, ``cursor`` (from the previous page's ``next``), and
+    optional ``tag`` or ``q`` (text search). Response:
+    ``{"items": [...], "next": cursor-or-null}``.
+    """
+    max_limit = current_app.config["CATALOG_PAGE_MAX"]
+    try:
+        limit = int(request.args.get("limit", current_app.config["CATALOG_PAGE_SIZE"]))
+    except ValueError:
+        return jsonify({"message": "limit must be an integer"}), 400
+    if not 1 <= limit <= max_limit:
+        return jsonify({"message": f"limit must be between 1 and {max_limit}"}), 400
+
+    cursor = request.args.get("cursor")
+    try:
+        after = ObjectId(cursor) if cursor else None
+    except InvalidId:
+        return jsonify({"message": "Invalid cursor"}), 400
+    tag = request.args.get("tag") or None
+    text = (request.args.get("q") or "").strip() or None
+
+    def build():
+        videos, next_id = Video.list_page(limit, after=after, tag=tag, text=text)
+        return {
+            "items": [v.to_public_dict() for v in videos],
+            "next": str(next_id) if next_id else None,
+        }
+
+    body, etag = Video.cached_json(("list", limit, after, tag, text), build)
+    return conditional_json(body, etag, "private, no-cache")
+
+
+@video_bp.get("/video/<video_id>")
+@jwt_required()
+def video_metadata(video_id):
+    """Public metadata for one active video, with ETag revalidation."""
+    video = Video.find_by_id(video_id)
+    if not video:
+        return jsonify({"message": "Video not found"}), 404
+    body, etag = Video.cached_json(("video", video_id), video.to_public_dict)
+    return conditional_json(body, etag, "private, no-cache")
+
+
 @video_bp.post("/video/<video_id>/play")
 @jwt_required()
 def generate_play_token(video_id):
@@ -19,17 +92,105 @@ def generate_play_token(video_id):
     if not video:
         return jsonify({"message": "Video not found"}), 404
 
-    token, expires_in = generate_playback_token(video_id=video_id)
-    return (
-        jsonify(
-            {
-                "video_id": video_id,
-                "playback_token": token,
-                "expires_in": expires_in,
-            }
-        ),
-        200,
+    youtube_id = video.get_youtube_id()
+    token, expires_in = generate_playback_token(
+        video_id=video_id,
+        youtube_id=youtube_id,
+        user_id=get_jwt_identity(),
+        active=video.is_active,
+    )
+
+    # The stream request follows within seconds; resolve its upstream URL now
+    # and start fetching the opening range while the player sets up.
+    get_upstream_resolver().prefetch(youtube_id)
+    prefetcher = get_stream_prefetcher()
+    if prefetcher is not None:
+        prefetcher.warm(youtube_id, expires_at=time.time() + expires_in)
+
+    # Adaptive playback is offered once the video has been packaged; asking
+    # starts packaging so the next play can use it.
+    packager = get_hls_packager()
+    adaptive = (
+        packager is not None
+        and packager.ensure(youtube_id, partial(resolve_upstream_url, youtube_id))
+        == "ready"
     )
+    payload = {
+        "video_id": video_id,
+        "playback_token": token,
+        "expires_in": expires_in,
+        "adaptive": adaptive,
+    }
+    if adaptive:
+        # Playlists embed the token in every segment URI, so it has to last a
+        # viewing session. It is only issued here, behind the user's JWT and
+        # the active check above; /hls never extends a token.
+        payload["hls_token"], payload["hls_expires_in"] = generate_playback_token(
+            video_id=video_id,
+            youtube_id=youtube_id,
+            expires_in=current_app.config["HLS_TOKEN_EXPIRES_SECONDS"],
+            user_id=get_jwt_identity(),
+            active=video.is_active,
+            scope="hls",
+        )
+    return jsonify(payload), 200
+
+
+def authorize_stream(token: str, video_id: str, scope: str | None = None):
+    """Check a playback token and resolve the video's YouTube ID.
+
+    Returns ``(youtube_id, claims, 200, "")`` on success, otherwise ``(None,
+    None, status, message)``. ``claims`` are the verified token claims, for
+    admission and read-ahead; callers must not decode the token again, as it
+    may expire in between.
+
+    The video must still be active: a token outlives a deactivation by at
+    most the catalog cache's invalidation delay. The lookup is served from
+    that cache, so only a cache miss reaches MongoDB. Sealed tokens carry
+    the YouTube ID; older ones take it from the video document.
+    """
+    started = time.perf_counter()
+    claims = decode_playback_token(token=token, video_id=video_id, scope=scope)
+    observe_stage("token_verify", time.perf_counter() - started)
+    if claims is None:
+        return None, None, 403, "Invalid or expired playback token"
+    if claims["upstream_key"] is not None and not claims["active"]:
+        return None, None, 404, "Video not found"
+
+    started = time.perf_counter()
+    video = Video.find_by_id(video_id)
+    observe_stage("db_lookup", time.perf_counter() - started)
+    if not video:
+        return None, None, 404, "Video not found"
+    return claims["upstream_key"] or video.get_youtube_id(), claims, 200, ""
+
+
+def _open_with_failover(upstream_urls: list[str], headers: dict):
+    """Open the first origin that answers without a server error.
+
+    Origins that fail to connect or answer 5xx are reported to the resolver
+    so later requests try a mirror first. The last origin's 5xx is passed
+    through; ``(None, None)`` means none could be reached.
+    """
+    import requests  # loaded with the upstream session, not at startup
+
+    resolver = get_upstream_resolver()
+    req = None
+    for attempt, upstream_url in enumerate(upstream_urls, 1):
+        try:
+            req = open_coalesced(upstream_url, headers=headers)
+        except requests.RequestException:
+            resolver.report_failure(upstream_url)
+            continue
+        if req.status_code < 500:
+            return req, upstream_url
+        resolver.report_failure(upstream_url)
+        if attempt < len(upstream_urls):
+            req.close()
+            req = None
+    if req is None:
+        return None, None
+    return req, upstream_urls[-1]
 
 
 @video_bp.get("/video/<video_id>/stream")
@@ -38,50 +199,233 @@ def stream_video(video_id):
     if not token:
         return jsonify({"message": "Missing playback token"}), 400
 
-    video = Video.find_by_id(video_id)
-    if not video:
-        return jsonify({"message": "Video not found"}), 404
+    started_at = request_started_at()
+    youtube_id, claims, status, message = authorize_stream(token, video_id)
+    if youtube_id is None:
+        return jsonify({"message": message}), status
+
+    ticket, retry_after = admit_stream(claims, token)
+    if ticket is None:
+        return _busy_response("Too many streams, retry later", retry_after)
+    # Read-ahead for this token stops when the token expires.
+    expires_at = claims["exp"]
+    try:
+        response = make_response(
+            _proxy_stream(youtube_id, ticket, started_at, token, expires_at)
+        )
+    except BaseException:
+        ticket.release()
+        raise
+    response.call_on_close(ticket.release)
+    return response
 
-    if not verify_playback_token(token=token, video_id=video_id):
-        return jsonify({"message": "Invalid or expired playback token"}), 403
 
-    youtube_id = video.get_youtube_id()
-    upstream_url = get_video_upstream_url(youtube_id)
-
-    headers = {}
-    if "Range" in request.headers:
-        headers["Range"] = request.headers["Range"]
-
-    req = requests.get(upstream_url, headers=headers, stream=True)
-
-    excluded_headers = [
-        "content-encoding",
-        "content-length",
-        "transfer-encoding",
-        "connection",
-    ]
-    headers_to_forward = [
-        (k, v)
-        for k, v in req.headers.items()
-        if k.lower() not in excluded_headers
-    ]
+def admit_stream(claims: dict, token: str):
+    """Admission ticket for an authorized stream, or ``(None, retry_after)``.
+
+    ``claims`` are the ones ``authorize_stream`` returned for ``token``.
+    """
+    return get_stream_admission().admit(claims["user_id"], token)
+
+
+def _with_read_ahead(chunks, token, url, youtube_id, headers, expires_at):
+    """Wrap a body so the range after it is prefetched once it is sent."""
+    prefetcher = get_stream_prefetcher()
+    if prefetcher is None:
+        return chunks
+    return prefetcher.after_body(chunks, token, url, youtube_id, headers, expires_at)
+
+
+def _proxy_stream(
+    youtube_id: str, ticket, started_at: float, token: str, expires_at: float
+):
+    started = time.perf_counter()
+    try:
+        upstream_urls = get_upstream_resolver().resolve(youtube_id)
+    except ResolutionError:
+        return jsonify({"message": "Upstream unavailable"}), 502
+    observe_stage("resolve", time.perf_counter() - started)
+
+    range_header = request.headers.get("Range")
+    sizer = new_chunk_sizer()
+    cache = get_segment_cache()
+    if cache is not None:
+        started = time.perf_counter()
+        plan = cache.plan(
+            upstream_urls[0],
+            range_header,
+            request_headers=request.headers,
+            source=youtube_id,
+            sizer=sizer,
+        )
+        observe_stage("cache_lookup", time.perf_counter() - started)
+        if plan is not None:
+            body = plan["body"]
+            if body is not None:
+                body = _with_read_ahead(
+                    body,
+                    token,
+                    upstream_urls[0],
+                    youtube_id,
+                    plan["headers"],
+                    expires_at,
+                )
+            return Response(
+                stream_with_context(
+                    meter_stream(ticket.paced(body), "cache", started_at)
+                )
+                if body is not None
+                else None,
+                status=plan["status"],
+                headers=plan["headers"],
+            )
+
+    started = time.perf_counter()
+    req, upstream_url = _open_with_failover(
+        upstream_urls,
+        upstream_request_headers(range_header, request.headers.get("If-Range")),
+    )
+    if req is None:
+        return jsonify({"message": "Upstream unavailable"}), 502
+    observe_stage("upstream_connect", time.perf_counter() - started)
+
+    if cache is not None and req.ok:
+        cache.observe(
+            upstream_url, req.status_code, req.headers, range_header, source=youtube_id
+        )
+
+    headers_to_forward = forwarded_response_headers(req.headers)
+
+    def generate():
+        # Runs the release on normal completion and on client abort (the WSGI
+        # server closes the iterator, raising GeneratorExit here).
+        try:
+            body = req.iter_body(sizer)
+            if req.ok:
+                body = _with_read_ahead(
+                    body, token, upstream_url, youtube_id, req.headers, expires_at
+                )
+            yield from meter_stream(
+                ticket.paced(body),
+                "upstream",
+                started_at,
+            )
+        finally:
+            req.close()
 
     response = Response(
-        stream_with_context(req.iter_content(chunk_size=1024 * 1024)),
+        stream_with_context(generate()),
         status=req.status_code,
         headers=headers_to_forward,
     )
-    
+    response.call_on_close(req.close)
+
     if "Content-Length" in req.headers:
         response.headers["Content-Length"] = req.headers["Content-Length"]
-        
+
+    return response
+
+
+@video_bp.get("/video/<video_id>/hls/<path:asset>")
+def hls_asset(video_id, asset):
+    """Serve an HLS playlist or segment for a packaged video.
+
+    Playlists are rewritten so every URI carries the presented playback
+    token. Only the session-long ``hls_token`` from ``/play`` is accepted,
+    and it is refused on ``/stream``. Segments
+    are immutable and are served with ETags and long-lived cache headers.
+    Each request is admitted like ``/stream`` and segment bodies are paced.
+    """
+    token = request.args.get("token")
+    if not token:
+        return jsonify({"message": "Missing playback token"}), 400
+
+    packager = get_hls_packager()
+    if packager is None:
+        return jsonify({"message": "Adaptive streaming is not available"}), 404
+
+    youtube_id, claims, status, message = authorize_stream(
+        token, video_id, scope="hls"
+    )
+    if youtube_id is None:
+        return jsonify({"message": message}), status
+
+    state = packager.ensure(youtube_id, partial(resolve_upstream_url, youtube_id))
+    if state == "failed":
+        return jsonify({"message": "Adaptive stream could not be prepared"}), 502
+    if state == "pending":
+        response = jsonify({"message": "Adaptive stream is being prepared"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+
+    ticket, retry_after = admit_stream(claims, token)
+    if ticket is None:
+        return _busy_response("Too many streams, retry later", retry_after)
+    try:
+        response = _hls_response(packager, youtube_id, asset, token)
+        if ticket.is_paced and response.status_code in (200, 206):
+            response.response = ticket.paced(response.response)
+    except BaseException:
+        ticket.release()
+        raise
+    response.call_on_close(ticket.release)
+    return response
+
+
+def _hls_response(packager, youtube_id: str, asset: str, token: str):
+    if asset.endswith(".m3u8"):
+        body = packager.playlist(youtube_id, asset, token)
+        if body is None:
+            return make_response(jsonify({"message": "Not found"}), 404)
+        response = Response(body, mimetype="application/vnd.apple.mpegurl")
+        # The URIs embed a token, so only the requesting client may reuse it.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+
+    path = packager.asset_path(youtube_id, asset)
+    if path is None:
+        return make_response(jsonify({"message": "Not found"}), 404)
+    response = send_file(
+        path, mimetype="video/mp2t", conditional=True, etag=True, max_age=31536000
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
     return response
 
 
+def _watch_event_doc(user_id: str, video_id: str, event, timestamp) -> dict:
+    return {
+        "user_id": user_id,
+        "video_id": video_id,
+        "event": event,
+        "timestamp": timestamp,
+        "recorded_at": datetime.utcnow(),
+    }
+
+
+def _busy_response(message: str, retry_after: int):
+    response = jsonify({"message": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def _queue_full_response():
+    return _busy_response("Analytics busy, retry later", 1)
+
+
 @video_bp.post("/video/<video_id>/watch")
 @jwt_required()
 def track_watch(video_id):
-    """Track watch analytics events (progress, resume, etc.)."""
+    """Track watch analytics events (progress, resume, etc.).
+
+    Events are buffered and written in batches, so the response only
+    confirms the event was accepted.
+    """
     user_id = get_jwt_identity()
     video = Video.find_by_id(video_id)
     if not video:
@@ -94,16 +438,85 @@ def track_watch(video_id):
     if event is None or timestamp is None:
         return jsonify({"message": "event and timestamp are required"}), 400
 
-    db = get_db()
-    db["watch_events"].insert_one(
+    doc = _watch_event_doc(user_id, video_id, event, timestamp)
+    if not get_watch_event_buffer().submit([doc]):
+        return _queue_full_response()
+
+    return jsonify({"message": "Watch event accepted"}), 202
+
+
+@video_bp.post("/video/watch/batch")
+@jwt_required()
+def track_watch_batch():
+    """Accept many watch events in one request.
+
+    Body: ``{"events": [{"video_id", "event", "timestamp"}, ...]}``. Invalid
+    entries are skipped and reported by index; the valid ones are queued.
+    """
+    user_id = get_jwt_identity()
+    payload = request.get_json() or {}
+    events = payload.get("events")
+    if not isinstance(events, list) or not events:
+        return jsonify({"message": "events must be a non-empty list"}), 400
+
+    max_batch = current_app.config["WATCH_EVENT_MAX_BATCH"]
+    if len(events) > max_batch:
+        return jsonify({"message": f"At most {max_batch} events per request"}), 413
+
+    docs = []
+    rejected = []
+    for index, item in enumerate(events):
+        if not isinstance(item, dict):
+            rejected.append(index)
+            continue
+        video_id = item.get("video_id")
+        event = item.get("event")
+        timestamp = item.get("timestamp")
+        if (
+            not isinstance(video_id, str)
+            or event is None
+            or timestamp is None
+            or not Video.find_by_id(video_id)
+        ):
+            rejected.append(index)
+            continue
+        docs.append(_watch_event_doc(user_id, video_id, event, timestamp))
+
+    if not get_watch_event_buffer().submit(docs):
+        return _queue_full_response()
+
+    return jsonify({"accepted": len(docs), "rejected": rejected}), 202
+
+
+@video_bp.get("/video/<video_id>/resume")
+@jwt_required()
+def resume_position(video_id):
+    """Latest known playback position of the current user for a video."""
+    user_id = get_jwt_identity()
+    progress = WatchProgress.find(user_id, video_id)
+    if not progress:
+        return jsonify({"video_id": video_id, "position": 0, "updated_at": None})
+    return jsonify(progress.to_public_dict())
+
+
+@video_bp.get("/video/<video_id>/stats")
+@jwt_required()
+def video_stats(video_id):
+    """Watch rollups for the most recent time buckets of a video."""
+    max_buckets = current_app.config["WATCH_STATS_MAX_BUCKETS"]
+    try:
+        buckets = int(request.args.get("buckets", "1"))
+    except ValueError:
+        return jsonify({"message": "buckets must be an integer"}), 400
+    buckets = max(1, min(buckets, max_buckets))
+
+    bucket_seconds = current_app.config["WATCH_STATS_BUCKET_SECONDS"]
+    rollups = VideoWatchStats.recent(video_id, buckets, bucket_seconds)
+    return jsonify(
         {
-            "user_id": user_id,
             "video_id": video_id,
-            "event": event,
-            "timestamp": timestamp,
-            "recorded_at": datetime.utcnow(),
+            "bucket_seconds": bucket_seconds,
+            "total_events": sum(r["total_events"] for r in rollups),
+            "buckets": rollups,
         }
     )
-
-    return jsonify({"message": "Watch event recorded"}), 201
-
@@ -0,0 +1,583 @@
+"""
+Production entry point: preforked WSGI workers with split thread pools.
+
+The parent process binds the listening socket, builds the Flask app once
+(``SERVER_PRELOAD=1``) and forks ``SERVER_WORKERS`` workers that share it
+copy-on-write. Each worker serves the shared socket from two bounded thread
+pools: ``SERVER_STREAM_THREADS`` for ``/stream`` and ``/hls`` requests, which
+hold a thread for as long as the client is watching, and
+``SERVER_API_THREADS`` for everything else, so open streams cannot starve
+logins and catalog reads. Per-process resources (the MongoDB client,
+background threads, upstream pools) are created after the fork, on first use.
+
+Signals to the parent:
+    TERM, INT   stop: workers stop accepting, finish in-flight requests for
+                up to SERVER_GRACEFUL_TIMEOUT seconds, then exit. A second
+                signal kills them immediately.
+    HUP         reload: fork a new set of workers, then drain the old ones.
+                Without preloading, the new workers import the code afresh.
+
+Run:
+    python server.py [--bind 0.0.0.0:5000] [--workers 4] [--no-preload]
+"""
+
+import argparse
+import atexit
+import gc
+import logging
+import os
+import re
+import select
+import selectors
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from config import Config
+
+logger = logging.getLogger("server")
+
+# Matched against the start of the request line, e.g.
+# ``GET /api/video/<id>/stream?token=... HTTP/1.1``.
+STREAM_REQUEST_RE = re.compile(rb"^[A-Z]+ /api/video/[^/?# ]+/(?:stream|hls/)")
+
+_STREAMS_FULL = b'{"message": "Too many streams, retry later"}'
+_STREAMS_FULL_RESPONSE = (
+    b"HTTP/1.1 503 SERVICE UNAVAILABLE\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: %d\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n" % len(_STREAMS_FULL)
+) + _STREAMS_FULL
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """Werkzeug's handler, reading each request under a socket timeout.
+
+    The timeout applies to every read of the request line, the headers and
+    any body the app reads before it responds, so a client that stops
+    sending gives its pool thread back. It is lifted once the response
+    starts: a paused player may stop reading its stream for a long time.
+    """
+
+    def setup(self):
+        super().setup()
+        self.connection.settimeout(self.server.request_read_timeout)
+
+    def send_response(self, code, message=None):
+        self.connection.settimeout(None)
+        super().send_response(code, message)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Serves an inherited listening socket from per-class thread pools.
+
+    The main thread accepts connections and waits, in a selector, for each
+    one's request line; the connection then goes to the stream or the API
+    pool by its path. Werkzeug answers every request with
+    ``Connection: close``, so a connection carries one request and never
+    changes pool. The first byte must arrive within
+    ``request_line_timeout``; after that, each read of the request must make
+    progress within ``request_read_timeout``.
+
+    A stream request that finds every stream thread busy is refused with
+    ``503`` and ``Retry-After``, like stream admission control. While every
+    API thread is busy the worker stops accepting, leaving new connections
+    in the shared backlog for the other workers.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(
+        self,
+        app,
+        fd: int,
+        host: str,
+        port: int,
+        api_threads: int,
+        stream_threads: int,
+        request_line_timeout: float,
+        request_read_timeout: float,
+    ):
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+        self.request_line_timeout = request_line_timeout
+        self.request_read_timeout = request_read_timeout
+        self._threads = {"api": api_threads, "stream": stream_threads}
+        self._executors = {
+            name: ThreadPoolExecutor(n, thread_name_prefix=f"{name}-request")
+            for name, n in self._threads.items()
+        }
+        self._cond = threading.Condition()
+        self._in_flight = {"api": 0, "stream": 0}
+        self._connections: set = set()
+        self._counters = {
+            "accepted": 0,
+            "served_api": 0,
+            "served_stream": 0,
+            "refused_stream": 0,
+            "request_line_timeouts": 0,
+            "accept_pauses": 0,
+        }
+
+    # Main thread -------------------------------------------------------
+
+    def serve(self, should_stop):
+        """Accept and dispatch connections until ``should_stop()`` is true."""
+        self.socket.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        accepting = True
+        # Connections waiting for their request line, oldest first.
+        waiting: dict = {}
+        deadlines: deque = deque()
+        try:
+            while not should_stop():
+                saturated = self._api_saturated()
+                if accepting and saturated:
+                    selector.unregister(self.socket)
+                    accepting = False
+                    self._count("accept_pauses")
+                elif not accepting and not saturated:
+                    selector.register(self.socket, selectors.EVENT_READ)
+                    accepting = True
+
+                for key, _ in selector.select(0.5 if accepting else 0.05):
+                    if key.fileobj is self.socket:
+                        self._accept(selector, waiting, deadlines)
+                    else:
+                        conn = key.fileobj
+                        selector.unregister(conn)
+                        self._dispatch(conn, waiting.pop(conn))
+
+                now = time.monotonic()
+                while deadlines and deadlines[0][0] <= now:
+                    _, conn = deadlines.popleft()
+                    if waiting.pop(conn, None) is not None:
+                        selector.unregister(conn)
+                        self._count("request_line_timeouts")
+                        self.shutdown_request(conn)
+        finally:
+            for conn in waiting:
+                self.shutdown_request(conn)
+            selector.close()
+            self.socket.close()
+
+    def _accept(self, selector, waiting: dict, deadlines: deque):
+        deadline = time.monotonic() + self.request_line_timeout
+        # Every worker wakes for a new connection; most find nothing.
+        for _ in range(64):
+            try:
+                conn, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                logger.warning("accept failed: %s", exc)
+                return
+            self._count("accepted")
+            conn.setblocking(True)
+            selector.register(conn, selectors.EVENT_READ)
+            waiting[conn] = address
+            deadlines.append((deadline, conn))
+
+    def _dispatch(self, conn, address):
+        try:
+            head = conn.recv(1024, socket.MSG_PEEK)
+        except OSError:
+            head = b""
+        if not head:
+            # Closed before sending a request.
+            self.shutdown_request(conn)
+            return
+
+        pool = "stream" if STREAM_REQUEST_RE.match(head) else "api"
+        with self._cond:
+            refused = (
+                pool == "stream" and self._in_flight[pool] >= self._threads[pool]
+            )
+            if not refused:
+                self._in_flight[pool] += 1
+                self._connections.add(conn)
+        if refused:
+            self._count("refused_stream")
+            try:
+                conn.settimeout(0)
+                conn.send(_STREAMS_FULL_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(conn)
+            return
+        self._executors[pool].submit(self._serve_connection, pool, conn, address)
+
+    def _api_saturated(self) -> bool:
+        with self._cond:
+            return self._in_flight["api"] >= self._threads["api"]
+
+    # Pool threads ------------------------------------------------------
+
+    def _serve_connection(self, pool: str, conn, address):
+        try:
+            self.finish_request(conn, address)
+        except Exception:
+            self.handle_error(conn, address)
+        finally:
+            self.shutdown_request(conn)
+            with self._cond:
+                self._in_flight[pool] -= 1
+                self._connections.discard(conn)
+                self._counters[f"served_{pool}"] += 1
+                self._cond.notify_all()
+
+    # Shutdown ----------------------------------------------------------
+
+    def drain(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` for in-flight requests, then cut the rest.
+
+        Returns whether every request finished in time.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._connections:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            leftover = list(self._connections)
+        for conn in leftover:
+            # The handler's next write fails and its thread unwinds.
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        return not leftover
+
+    def _count(self, name: str):
+        with self._cond:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pid": os.getpid(),
+                **self._counters,
+                **{
+                    pool: {"threads": n, "in_flight": self._in_flight[pool]}
+                    for pool, n in self._threads.items()
+                },
+            }
+
+
+class _Worker:
+    __slots__ = ("generation", "started", "kill_at")
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.started = time.monotonic()
+        self.kill_at: float | None = None
+
+
+class PreforkServer:
+    """Parent process: owns the socket and keeps ``workers`` children alive.
+
+    A worker that exits unexpectedly is replaced (after a one second pause
+    if it died within a second of starting, so a broken app does not fork in
+    a tight loop). Draining workers that outlive ``graceful_timeout`` are
+    killed.
+    """
+
+    def __init__(
+        self,
+        bind: str,
+        workers: int,
+        preload: bool,
+        api_threads: int,
+        stream_threads: int,
+        backlog: int,
+        request_line_timeout: float,
+        request_read_timeout: float,
+        graceful_timeout: float,
+    ):
+        host, _, port = bind.rpartition(":")
+        self.host = host.strip("[]") or "0.0.0.0"
+        self.port = int(port)
+        self.workers = workers
+        self.preload = preload
+        self.api_threads = api_threads
+        self.stream_threads = stream_threads
+        self.backlog = backlog
+        self.request_line_timeout = request_line_timeout
+        self.request_read_timeout = request_read_timeout
+        self.graceful_timeout = graceful_timeout
+
+        self.app = None
+        self.listener: socket.socket | None = None
+        self._children: dict[int, _Worker] = {}
+        self._generation = 0
+        self._next_spawn = 0.0
+        self._signals: deque = deque()
+        self._stopping = False
+
+    def run(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.listener = socket.create_server(
+            (self.host, self.port), family=family, backlog=self.backlog
+        )
+        self.port = self.listener.getsockname()[1]
+
+        if self.preload:
+            from app import create_app
+            from extensions.db import close_db
+
+            self.app = create_app()
+            # Loaded on the first stream otherwise; load it here so the
+            # workers share it too.
+            import requests  # noqa: F401
+
+            # create_app does not connect, but make sure no client (and no
+            # socket) is inherited; every worker connects after the fork.
+            close_db()
+            # Keep the preloaded objects out of the collector's reach, so
+            # collections in the workers do not write to (and copy) the
+            # pages they share with the parent.
+            gc.collect()
+            gc.freeze()
+
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        self._wake_fds = (wake_r, wake_w)
+
+        logger.info(
+            "Listening on %s:%d with %d workers (preload=%s)",
+            self.host,
+            self.port,
+            self.workers,
+            self.preload,
+        )
+        try:
+            while not (self._stopping and not self._children):
+                self._handle_signals()
+                self._reap()
+                if not self._stopping:
+                    self._spawn_missing()
+                self._kill_overdue()
+                select.select([wake_r], [], [], 1.0)
+                try:
+                    while os.read(wake_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+        finally:
+            signal.set_wakeup_fd(-1)
+            os.close(wake_r)
+            os.close(wake_w)
+            self.listener.close()
+        logger.info("Stopped")
+
+    # Signals -----------------------------------------------------------
+
+    def _on_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self._signals.append(signum)
+
+    def _handle_signals(self):
+        while self._signals:
+            signum = self._signals.popleft()
+            if signum == signal.SIGHUP and not self._stopping:
+                self._reload()
+            elif signum in (signal.SIGTERM, signal.SIGINT):
+                if self._stopping:
+                    logger.info("Stopping now")
+                    for pid in self._children:
+                        self._kill(pid, signal.SIGKILL)
+                else:
+                    logger.info("Draining workers")
+                    self._stopping = True
+                    self._retire(list(self._children))
+
+    def _reload(self):
+        old = [
+            pid
+            for pid, worker in self._children.items()
+            if worker.generation == self._generation
+        ]
+        self._generation += 1
+        logger.info("Reloading: replacing %d workers", len(old))
+        self._spawn_missing()
+        self._retire(old)
+
+    # Workers -----------------------------------------------------------
+
+    def _spawn_missing(self):
+        current = sum(
+            1
+            for worker in self._children.values()
+            if worker.generation == self._generation and worker.kill_at is None
+        )
+        now = time.monotonic()
+        if current < self.workers and now < self._next_spawn:
+            return
+        for _ in range(self.workers - current):
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = _Worker(self._generation)
+            return
+        code = 1
+        try:
+            code = self._run_worker()
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+        finally:
+            # Never return into the parent's loop.
+            os._exit(code)
+
+    def _run_worker(self) -> int:
+        parent = os.getppid()
+        signal.set_wakeup_fd(-1)
+        for fd in self._wake_fds:
+            os.close(fd)
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        app = self.app
+        if app is None:
+            from app import create_app
+
+            app = create_app()
+        from utils.stats import register_stats
+
+        server = PooledWSGIServer(
+            app,
+            self.listener.fileno(),
+            self.host,
+            self.port,
+            api_threads=self.api_threads,
+            stream_threads=self.stream_threads,
+            request_line_timeout=self.request_line_timeout,
+            request_read_timeout=self.request_read_timeout,
+        )
+        self.listener.close()
+        register_stats("server", server.stats)
+        logger.info("Worker %d serving", os.getpid())
+
+        server.serve(lambda: stopping.is_set() or os.getppid() != parent)
+        if not server.drain(self.graceful_timeout):
+            logger.warning(
+                "Worker %d cut open requests after %.0fs",
+                os.getpid(),
+                self.graceful_timeout,
+            )
+        # os._exit skips interpreter shutdown; flush buffers (watch events).
+        atexit._run_exitfuncs()
+        return 0
+
+    def _retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for pid in pids:
+            worker = self._children.get(pid)
+            if worker is not None and worker.kill_at is None:
+                worker.kill_at = deadline
+                self._kill(pid, signal.SIGTERM)
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            worker = self._children.pop(pid, None)
+            if worker is None or worker.kill_at is not None:
+                continue
+            logger.warning(
+                "Worker %d exited unexpectedly (status %d)",
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            if time.monotonic() - worker.started < 1.0:
+                self._next_spawn = time.monotonic() + 1.0
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, worker in list(self._children.items()):
+            if worker.kill_at is not None and now >= worker.kill_at:
+                logger.warning("Worker %d did not drain in time; killing", pid)
+                self._kill(pid, signal.SIGKILL)
+                worker.kill_at = float("inf")
+
+    @staticmethod
+    def _kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bind", default=Config.SERVER_BIND)
+    parser.add_argument("--workers", type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument(
+        "--no-preload",
+        dest="preload",
+        action="store_false",
+        default=Config.SERVER_PRELOAD,
+        help="build the app in each worker (reload then picks up code changes)",
+    )
+    parser.add_argument("--api-threads", type=int, default=Config.SERVER_API_THREADS)
+    parser.add_argument(
+        "--stream-threads", type=int, default=Config.SERVER_STREAM_THREADS
+    )
+    parser.add_argument(
+        "--access-log", action="store_true", help="log every request (werkzeug)"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s",
+    )
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    workers = args.workers or os.cpu_count() or 1
+    # Read by create_app: host-wide budgets are split across the workers.
+    Config.SERVER_WORKERS = workers
+    PreforkServer(
+        bind=args.bind,
+        workers=workers,
+        preload=args.preload,
+        api_threads=args.api_threads,
+        stream_threads=args.stream_threads,
+        backlog=Config.SERVER_BACKLOG,
+        request_line_timeout=Config.SERVER_REQUEST_LINE_TIMEOUT,
+        request_read_timeout=Config.SERVER_REQUEST_READ_TIMEOUT,
+        graceful_timeout=Config.SERVER_GRACEFUL_TIMEOUT,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# Config reads the environment at import time. Tests run without MongoDB,
+# Redis or ffmpeg.
+os.environ.setdefault("MONGODB_ENSURE_INDEXES", "0")
+os.environ.setdefault("SHARED_STATE_BACKEND", "memory")
+os.environ.setdefault("HLS_ENABLED", "0")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# The benchmarks' local origin stands in for the YouTube upstream.
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The Flask app, which also sets up the upstream pools and caches."""
+    from app import create_app
+
+    return create_app()
+
+
+@pytest.fixture
+def origin():
+    from origin import MediaOrigin
+
+    server = MediaOrigin(3500).start()
+    yield server
+    server.stop()
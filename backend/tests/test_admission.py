@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+from extensions import admission
+from extensions.admission import StreamAdmission, init_stream_admission
+from extensions.shared_state import MemoryStateBackend
+
+
+def _worker(backend, **limits):
+    settings = {
+        "per_user": 1,
+        "per_token": 2,
+        "max_streams": 0,
+        "egress_bytes_per_second": 0,
+        "egress_burst_bytes": 0,
+        "max_backlog": 0,
+        "retry_after": 2,
+        **limits,
+    }
+    return StreamAdmission(backend, **settings)
+
+
+class _CountingBackend(MemoryStateBackend):
+    def __init__(self):
+        super().__init__()
+        self.opened = 0
+
+    def open_stream(self, lease_id, limits, expires_at):
+        self.opened += 1
+        return super().open_stream(lease_id, limits, expires_at)
+
+
+def test_user_limit_holds_across_workers():
+    backend = MemoryStateBackend()
+    first, second = _worker(backend), _worker(backend)
+
+    ticket, _ = first.admit("user-1", "token-a")
+    assert ticket is not None
+    refused, retry_after = second.admit("user-1", "token-b")
+    assert refused is None and retry_after == 2
+    assert second.stats()["rejected_user"] == 1
+    assert second.stats()["active"] == 0
+
+    ticket.release()
+    ticket.release()
+    # The idle lease is kept for a seek until the renewer closes it.
+    assert second.admit("user-1", "token-b")[0] is None
+    first._renew_once(idle_before=float("inf"))
+    assert second.admit("user-1", "token-b")[0] is not None
+
+
+def test_seek_reuses_the_token_lease():
+    backend = _CountingBackend()
+    worker = _worker(backend)
+
+    streaming, _ = worker.admit("user-1", "token-a")
+    # The player seeks before the first range has been closed.
+    seek, _ = worker.admit("user-1", "token-a")
+    assert streaming is not None and seek is not None
+    streaming.release()
+    seek.release()
+    again, _ = worker.admit("user-1", "token-a")
+    assert again is not None
+    assert backend.opened == 1
+
+
+def test_token_lease_is_shared_across_workers():
+    backend = MemoryStateBackend()
+    first, second = _worker(backend), _worker(backend)
+
+    assert first.admit("user-1", "token-a")[0] is not None
+    assert second.admit("user-1", "token-a")[0] is not None
+
+
+def test_token_request_limit():
+    worker = _worker(MemoryStateBackend(), per_user=0)
+
+    assert worker.admit(None, "token-a")[0] is not None
+    assert worker.admit(None, "token-a")[0] is not None
+    assert worker.admit(None, "token-a")[0] is None
+    assert worker.stats()["rejected_token"] == 1
+    assert worker.stats()["active"] == 2
+
+
+def test_host_budgets_are_split_across_workers(app):
+    config = {
+        **app.config,
+        "SERVER_WORKERS": 4,
+        "STREAM_MAX_CONCURRENT": 10,
+        "STREAM_EGRESS_BYTES_PER_SECOND": 8_000_000,
+    }
+    try:
+        init_stream_admission(SimpleNamespace(config=config))
+        controller = admission.get_stream_admission()
+        assert controller.max_streams == 3
+        assert controller.bucket.rate == 2_000_000
+    finally:
+        init_stream_admission(app)
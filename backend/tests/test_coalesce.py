@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from extensions import coalesce
+from extensions.coalesce import open_coalesced
+
+SIZE = 2 * 1024 * 1024
+
+
+@pytest.fixture
+def big_origin():
+    from origin import MediaOrigin
+
+    server = MediaOrigin(SIZE).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def coalescing(app, monkeypatch):
+    monkeypatch.setitem(coalesce._settings, "enabled", True)
+    monkeypatch.setitem(coalesce._settings, "buffer_bytes", 256 * 1024)
+    monkeypatch.setitem(coalesce._settings, "stall_seconds", 0.2)
+
+
+def _drain(reader, into: list):
+    try:
+        for chunk in reader.iter_content(64 * 1024):
+            into.append(chunk)
+    finally:
+        reader.close()
+
+
+def test_stalled_reader_detaches_and_resumes(coalescing, big_origin):
+    with open(big_origin.server.media_path, "rb") as fh:
+        expected = fh.read()
+    headers = {"Range": f"bytes=0-{SIZE - 1}"}
+    fast = open_coalesced(big_origin.url, headers)
+    slow = open_coalesced(big_origin.url, headers)
+    assert slow._flight is fast._flight
+    detached_before = coalesce.get_coalesce_stats()["detached"]
+
+    slow_chunks = slow.iter_content(64 * 1024)
+    first = next(slow_chunks)
+    # The slow reader takes nothing more; the fast one must still finish.
+    fast_body = []
+    worker = threading.Thread(target=_drain, args=(fast, fast_body))
+    worker.start()
+    worker.join(10)
+    assert not worker.is_alive()
+    assert b"".join(fast_body) == expected
+    assert slow.detached
+    assert coalesce.get_coalesce_stats()["detached"] == detached_before + 1
+
+    # It carries on from where it stopped on its own connection.
+    try:
+        rest = b"".join(slow_chunks)
+    finally:
+        slow.close()
+    assert first + rest == expected
+
+
+def test_fallback_requires_partial_content(coalescing, big_origin, monkeypatch):
+    reader = open_coalesced(big_origin.url, {"Range": f"bytes=0-{SIZE - 1}"})
+    original = coalesce.open_upstream
+    # An origin that ignores Range answers the resume with the whole file.
+    monkeypatch.setattr(
+        coalesce, "open_upstream", lambda url, headers=None: original(url)
+    )
+    reader.pos = 1024
+    try:
+        with pytest.raises(coalesce.FallbackError):
+            reader._open_fallback()
+        assert reader._fallback is None
+    finally:
+        reader.close()
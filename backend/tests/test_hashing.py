@@ -0,0 +1,51 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from extensions import hashing
+from extensions.hashing import HashingBusy, needs_rehash
+
+
+def _init(method="pbkdf2:sha256", timeout=5.0, max_pending=4):
+    hashing.init_password_hasher(
+        SimpleNamespace(
+            config={
+                "PASSWORD_HASH_METHOD": method,
+                "PASSWORD_HASH_WORKERS": 1,
+                "PASSWORD_HASH_TIMEOUT": timeout,
+                "PASSWORD_HASH_MAX_PENDING": max_pending,
+            }
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "method, stored, expected",
+    [
+        ("pbkdf2:sha256", "pbkdf2:sha256:600000$salt$hash", False),
+        ("pbkdf2", "pbkdf2:sha256:600000$salt$hash", False),
+        ("pbkdf2:sha256:600000", "pbkdf2:sha256:260000$salt$hash", True),
+        ("scrypt", "scrypt:32768:8:1$salt$hash", False),
+        ("scrypt:65536:8:1", "scrypt:32768:8:1$salt$hash", True),
+        ("scrypt", "pbkdf2:sha256:600000$salt$hash", True),
+    ],
+)
+def test_needs_rehash_compares_parameters(method, stored, expected):
+    _init(method)
+    assert needs_rehash(stored) is expected
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    # Start the pool's worker process before timing anything.
+    _init()
+    hashing._run(time.sleep, 0)
+    _init(timeout=0.1, max_pending=1)
+
+    with pytest.raises(HashingBusy, match="timed out"):
+        hashing._run(time.sleep, 1)
+    with pytest.raises(HashingBusy, match="saturated"):
+        hashing._run(time.sleep, 0)
+
+    time.sleep(1.5)
+    hashing._run(time.sleep, 0)
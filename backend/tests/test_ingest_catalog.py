@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError
+
+from ingest_catalog import Checkpoint, Ingest, _run
+
+
+def _evaluate(expr, doc: dict, now):
+    """The aggregation expressions ``upsert_op`` uses, against ``doc``."""
+    if isinstance(expr, str) and expr == "$$NOW":
+        return now
+    if isinstance(expr, str) and expr.startswith("$"):
+        return doc.get(expr[1:], _MISSING)
+    if not isinstance(expr, dict):
+        return expr
+    ((op, args),) = expr.items()
+    if op == "$literal":
+        return args
+    if not isinstance(args, list):
+        args = [args]
+    values = [_evaluate(arg, doc, now) for arg in args]
+    if op == "$and":
+        return all(values)
+    if op == "$eq":
+        return values[0] == values[1]
+    if op == "$ne":
+        return values[0] != values[1]
+    if op == "$type":
+        return "missing" if values[0] is _MISSING else type(values[0]).__name__
+    if op == "$ifNull":
+        return values[1] if values[0] in (_MISSING, None) else values[0]
+    if op == "$cond":
+        return values[1] if values[0] else values[2]
+    raise AssertionError(f"unexpected operator {op}")
+
+
+_MISSING = object()
+
+
+class _Collection:
+    """Applies upsert pipelines in memory; refuses "bad" titles."""
+
+    def __init__(self):
+        self.docs = {}
+        self.applied = []
+        self.lock = threading.Lock()
+
+    def bulk_write(self, ops, ordered=True):
+        # Let a later batch overtake this one if nothing orders them.
+        if any(_title(op) == "first" for op in ops):
+            time.sleep(0.1)
+        errors = []
+        result = {"nUpserted": 0, "nMatched": 0, "nModified": 0}
+        for index, op in enumerate(ops):
+            if _title(op) == "bad":
+                errors.append({"index": index, "errmsg": "document failed"})
+                continue
+            youtube_id = op._filter["youtube_id"]
+            with self.lock:
+                old = self.docs.get(youtube_id)
+                doc = dict(old or op._filter)
+                now = time.time()
+                for stage in op._doc:
+                    evaluated = {
+                        name: _evaluate(expr, doc, now)
+                        for name, expr in stage["$set"].items()
+                    }
+                    doc.update(evaluated)
+                self.docs[youtube_id] = doc
+                self.applied.append((youtube_id, doc.get("title")))
+            if old is None:
+                result["nUpserted"] += 1
+            else:
+                result["nMatched"] += 1
+                result["nModified"] += doc != old
+        if errors:
+            raise BulkWriteError({**result, "writeErrors": errors})
+        return SimpleNamespace(bulk_api_result=result)
+
+
+def _title(op) -> str:
+    return op._doc[-1]["$set"]["title"]["$literal"]
+
+
+def _ingest(tmp_path, records, rejects=None, collection=None):
+    path = tmp_path / "catalog.jsonl"
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    args = SimpleNamespace(
+        input=str(path),
+        batch_size=2,
+        workers=4,
+        dry_run=False,
+        progress_seconds=60,
+    )
+    collection = collection or _Collection()
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"), str(path))
+    ingest = Ingest(collection, checkpoint, 0, rejects)
+    return _run(args, "jsonl", 0, ingest), collection, checkpoint, ingest
+
+
+def _video(youtube_id: str, title: str) -> dict:
+    return {"youtube_id": youtube_id * 11, "title": title}
+
+
+def test_updates_to_one_video_apply_in_file_order(tmp_path):
+    records = [
+        _video("a", "first"),
+        _video("b", "x"),
+        _video("a", "second"),
+        _video("c", "x"),
+    ]
+    status, collection, _, _ = _ingest(tmp_path, records)
+
+    assert status == 0
+    titles = [title for youtube_id, title in collection.applied if youtube_id[0] == "a"]
+    assert titles == ["first", "second"]
+
+
+def test_failed_writes_go_to_rejects(tmp_path):
+    records = [_video("a", "ok"), _video("b", "bad"), _video("c", "ok")]
+    with open(tmp_path / "rejects.jsonl", "w") as rejects:
+        status, _, _, _ = _ingest(tmp_path, records, rejects)
+
+    assert status == 0
+    saved = [json.loads(line) for line in open(tmp_path / "rejects.jsonl")]
+    assert [(r["line"], r["record"]["title"]) for r in saved] == [(2, "bad")]
+
+
+def test_failed_writes_hold_the_checkpoint_without_rejects(tmp_path):
+    records = [_video("a", "ok"), _video("b", "bad"), _video("c", "ok")]
+    status, _, checkpoint, _ = _ingest(tmp_path, records)
+
+    assert status == 1
+    assert checkpoint.load() == 0
+
+
+def test_identical_record_is_unchanged(tmp_path):
+    records = [{**_video("a", "same"), "tags": ["x"]}, _video("b", "old")]
+    _, collection, _, _ = _ingest(tmp_path, records)
+    stamped = {k: doc["updated_at"] for k, doc in collection.docs.items()}
+
+    (tmp_path / "checkpoint").unlink(missing_ok=True)
+    records[1] = _video("b", "new")
+    status, _, _, ingest = _ingest(tmp_path, records, collection=collection)
+
+    assert status == 0
+    assert ingest.counters["unchanged"] == 1
+    assert ingest.counters["updated"] == 1
+    assert collection.docs["a" * 11]["updated_at"] == stamped["a" * 11]
+    assert collection.docs["b" * 11]["updated_at"] > stamped["b" * 11]
@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/api/metrics", "/api/health/stats"])
+def test_loopback_only_without_token(app, path):
+    client = app.test_client()
+    remote = client.get(path, environ_base={"REMOTE_ADDR": "203.0.113.7"})
+    local = client.get(path, environ_base={"REMOTE_ADDR": "127.0.0.1"})
+    assert remote.status_code == 403
+    assert local.status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/api/metrics", "/api/health/stats"])
+def test_token_required_when_set(app, monkeypatch, path):
+    monkeypatch.setitem(app.config, "STATS_TOKEN", "s3cret")
+    client = app.test_client()
+    local = client.get(path, environ_base={"REMOTE_ADDR": "127.0.0.1"})
+    authorized = client.get(path, headers={"Authorization": "Bearer s3cret"})
+    assert local.status_code == 403
+    assert authorized.status_code == 200
+
+
+def test_samples_carry_the_worker_label(app):
+    body = app.test_client().get("/api/metrics").get_data(as_text=True)
+    samples = [line for line in body.splitlines() if not line.startswith("#")]
+    assert samples
+    assert all('worker="' in line for line in samples)
@@ -0,0 +1,26 @@
+from utils.token import decode_playback_token, generate_playback_token
+
+VIDEO_ID = "64b000000000000000000002"
+
+
+def _token(app, **kwargs) -> str:
+    with app.app_context():
+        return generate_playback_token(
+            VIDEO_ID, youtube_id="yt-1", active=True, user_id="u1", **kwargs
+        )[0]
+
+
+def test_hls_token_is_refused_on_stream(app):
+    token = _token(app, expires_in=4 * 3600, scope="hls")
+    response = app.test_client().get(f"/api/video/{VIDEO_ID}/stream?token={token}")
+    assert response.status_code == 403
+
+
+def test_scope_must_match(app):
+    hls_token = _token(app, scope="hls")
+    stream_token = _token(app)
+    with app.app_context():
+        assert decode_playback_token(hls_token, VIDEO_ID, scope="hls") is not None
+        assert decode_playback_token(hls_token, VIDEO_ID) is None
+        assert decode_playback_token(stream_token, VIDEO_ID, scope="hls") is None
+        assert decode_playback_token(stream_token, VIDEO_ID) is not None
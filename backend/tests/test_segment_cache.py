@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from extensions.segment_cache import SegmentCache, _url_key
+
+
+@pytest.fixture
+def cache(app, tmp_path):
+    return SegmentCache(str(tmp_path), block_size=1000, max_bytes=10**9)
+
+
+def _wait_for_blocks(cache, count: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while cache.stats()["blocks"] < count:
+        assert time.monotonic() < deadline, "blocks were not written"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("contents", [b"x" * 10, b""])
+def test_short_block_is_refetched(cache, origin, contents):
+    assert cache.probe(origin.url, source="v") == 3500
+    expected = cache.read(origin.url, 0, 3499, source="v")
+    _wait_for_blocks(cache, 4)
+    path = cache._block_path(_url_key("v"), 1)
+    with open(path, "wb") as fh:
+        fh.write(contents)
+
+    assert cache.read(origin.url, 0, 3499, source="v") == expected
+    _wait_for_blocks(cache, 4)
+    assert os.path.getsize(path) == 1000
+
+
+def test_final_block_is_shorter(cache, origin):
+    cache.probe(origin.url, source="v")
+    expected = cache.read(origin.url, 2900, 3499, source="v")
+    _wait_for_blocks(cache, 2)
+    hits = cache.stats()["hits"]
+
+    assert cache.read(origin.url, 2900, 3499, source="v") == expected
+    assert cache.stats()["hits"] == hits + 2
+
+
+def test_meta_is_rechecked_after_ttl(app, origin, tmp_path):
+    first = SegmentCache(str(tmp_path), block_size=1000, max_bytes=10**9, meta_ttl=0)
+    other = SegmentCache(str(tmp_path), block_size=1000, max_bytes=10**9, meta_ttl=0)
+    first.probe(origin.url, source="v")
+    assert other.size_of(origin.url, source="v") == 3500
+
+    # Another worker sees the origin file change size.
+    first._learn(_url_key("v"), 200, {"Content-Length": "4000"})
+    assert other.size_of(origin.url, source="v") == 4000
@@ -0,0 +1,89 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from server import PooledWSGIServer
+
+release_streams = threading.Event()
+
+
+def _app(environ, start_response):
+    if environ["PATH_INFO"].endswith("/stream"):
+        release_streams.wait(5)
+    start_response("200 OK", [("Content-Length", "2")])
+    return [b"ok"]
+
+
+@pytest.fixture
+def server():
+    release_streams.clear()
+    listener = socket.create_server(("127.0.0.1", 0))
+    host, port = listener.getsockname()
+    srv = PooledWSGIServer(
+        _app,
+        listener.fileno(),
+        host,
+        port,
+        api_threads=1,
+        stream_threads=1,
+        request_line_timeout=5,
+        request_read_timeout=0.5,
+    )
+    listener.close()
+    stop = threading.Event()
+    thread = threading.Thread(target=srv.serve, args=(stop.is_set,), daemon=True)
+    thread.start()
+    yield srv, port
+    release_streams.set()
+    stop.set()
+    thread.join(5)
+    srv.drain(1)
+
+
+def _wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _request(port: int, path: str) -> bytes:
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+        data = b""
+        while chunk := sock.recv(4096):
+            data += chunk
+    return data
+
+
+def test_stalled_request_gives_its_thread_back(server):
+    srv, port = server
+    stalled = socket.create_connection(("127.0.0.1", port), timeout=5)
+    # Dispatched to the only API thread, then nothing more arrives.
+    stalled.sendall(b"GET /api/health HT")
+
+    started = time.monotonic()
+    assert _request(port, "/api/health").startswith(b"HTTP/1.1 200")
+    assert time.monotonic() - started < 3
+    assert stalled.recv(1024) == b""
+    stalled.close()
+    _wait_until(lambda: srv.stats()["api"]["in_flight"] == 0)
+
+
+def test_full_stream_pool_is_refused(server):
+    srv, port = server
+    first = threading.Thread(target=_request, args=(port, "/api/video/v1/stream"))
+    first.start()
+    _wait_until(lambda: srv.stats()["stream"]["in_flight"] == 1)
+
+    refused = _request(port, "/api/video/v2/stream?token=t")
+    assert refused.startswith(b"HTTP/1.1 503")
+    assert b"Retry-After: 1" in refused
+    # API requests have their own pool.
+    assert _request(port, "/api/health").startswith(b"HTTP/1.1 200")
+
+    release_streams.set()
+    first.join(5)
+    assert srv.stats()["refused_stream"] == 1
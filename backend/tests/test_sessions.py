@@ -0,0 +1,49 @@
+import pytest
+from flask_jwt_extended import decode_token
+
+from extensions.sessions import SessionError, SessionStore
+from extensions.shared_state import MemoryStateBackend, RevocationList
+
+USER = {
+    "id": "64b000000000000000000001",
+    "name": "Ada",
+    "email": "ada@example.com",
+    "created_at": "2024-01-01T00:00:00Z",
+}
+
+
+@pytest.fixture
+def store(app):
+    backend = MemoryStateBackend()
+    revocations = RevocationList(
+        backend, capacity=1000, error_rate=0.01, sync_seconds=0, rebuild_seconds=3600
+    )
+    with app.app_context():
+        yield SessionStore(backend, revocations, identity_cache_size=100)
+
+
+def _decode(tokens: dict) -> tuple[dict, dict]:
+    return decode_token(tokens["access_token"]), decode_token(tokens["refresh_token"])
+
+
+def test_rotation_retires_the_old_refresh_token(store):
+    _, refresh = _decode(store.start(USER))
+    access, rotated = _decode(store.rotate(refresh))
+
+    assert rotated["sid"] == refresh["sid"]
+    assert rotated["jti"] != refresh["jti"]
+    assert not store.is_revoked(access)
+
+
+def test_reused_refresh_token_ends_the_session(store):
+    _, stolen = _decode(store.start(USER))
+    access, current = _decode(store.rotate(stolen))
+
+    with pytest.raises(SessionError, match="reuse"):
+        store.rotate(stolen)
+
+    # The legitimate holder's tokens stop working as well.
+    with pytest.raises(SessionError, match="ended"):
+        store.rotate(current)
+    assert store.is_revoked(access)
+    assert store.stats()["reuse_detected"] == 1
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from extensions.shared_state import (
+    MemoryStateBackend,
+    RevocationList,
+    SlidingWindowLimiter,
+)
+
+
+def test_limit_holds_across_concurrent_workers():
+    backend = MemoryStateBackend()
+    limiters = [SlidingWindowLimiter(backend, sync_seconds=0) for _ in range(4)]
+    allowed = []
+    start = threading.Barrier(len(limiters) * 5)
+
+    def attempt(limiter):
+        start.wait()
+        allowed.append(limiter.hit("login:1.2.3.4", 5, 3600)[0])
+
+    threads = [
+        threading.Thread(target=attempt, args=(limiter,))
+        for limiter in limiters
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert allowed.count(True) == 5
+    # Refused attempts give their increment back.
+    current = int(time.time() // 3600) * 3600
+    assert backend.get_counts([("login:1.2.3.4", current)]) == {
+        ("login:1.2.3.4", current): 5
+    }
+
+
+def test_refused_hit_reports_retry_after():
+    limiter = SlidingWindowLimiter(MemoryStateBackend(), sync_seconds=0)
+    assert limiter.hit("k", 1, 60) == (True, 0)
+    allowed, retry_after = limiter.hit("k", 1, 60)
+    assert not allowed and 1 <= retry_after <= 60
+
+
+class _SlowBackend(MemoryStateBackend):
+    """Holds full reloads until released, like a large collection scan."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.full_loads = 0
+
+    def revoked_since(self, since):
+        if since == 0.0:
+            self.full_loads += 1
+            if self.full_loads > 1:
+                self.release.wait(5)
+        return super().revoked_since(since)
+
+
+def test_rebuild_runs_off_the_request_thread():
+    backend = _SlowBackend()
+    backend.revoke("old", time.time() + 3600)
+    revocations = RevocationList(
+        backend, capacity=1000, error_rate=0.01, sync_seconds=0, rebuild_seconds=0
+    )
+    assert revocations.is_revoked("old")
+
+    # The rebuild is due; the request must not wait for it.
+    began = time.monotonic()
+    assert not revocations.is_revoked("fresh")
+    assert time.monotonic() - began < 1
+    assert revocations._rebuilding
+
+    revocations.revoke("during", time.time() + 3600)
+    backend.release.set()
+    deadline = time.monotonic() + 5
+    while revocations._rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not revocations._rebuilding
+    assert revocations._bloom.might_contain("old")
+    assert revocations._bloom.might_contain("during")
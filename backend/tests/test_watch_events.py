@@ -0,0 +1,87 @@
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import extensions.watch_events as watch_events
+from extensions.watch_events import WatchEventBuffer
+
+
+class _Collection:
+    """Enough of ``insert_many(ordered=False)`` to replay spilled batches."""
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_after = None
+
+    def insert_many(self, docs, ordered=True):
+        assert not ordered
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        errors = []
+        for index, doc in enumerate(docs):
+            if self.fail_after is not None and len(self.docs) >= self.fail_after:
+                raise AutoReconnect("connection lost mid-batch")
+            if doc.get("invalid"):
+                errors.append({"index": index, "code": 121, "errmsg": "invalid"})
+            elif doc["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000, "errmsg": "dup"})
+            else:
+                self.docs[doc["_id"]] = dict(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = _Collection()
+    monkeypatch.setattr(
+        watch_events, "get_db", lambda workload: {"watch_events": collection}
+    )
+    return collection
+
+
+def _event(n: int) -> dict:
+    return {"video_id": "v", "event": "progress", "n": n}
+
+
+def test_replaying_a_partly_written_batch_is_idempotent(collection, tmp_path):
+    buffer = WatchEventBuffer(
+        max_queue=100,
+        batch_size=4,
+        flush_seconds=0.05,
+        enqueue_timeout=0,
+        spill_path=str(tmp_path / "spill.jsonl"),
+    )
+    seen = []
+    buffer.add_flush_hook(lambda events: seen.extend(e["n"] for e in events))
+
+    # Two of four events are written before the connection drops.
+    collection.fail_after = 2
+    assert not buffer._flush([_event(n) for n in range(4)])
+    assert seen == []
+
+    collection.fail_after = None
+    assert buffer._flush([_event(4)])
+    buffer._replay_spill()
+    buffer._replay_spill()
+
+    assert sorted(doc["n"] for doc in collection.docs.values()) == [0, 1, 2, 3, 4]
+    # Each stored event reaches the hooks once, including the two written
+    # by the attempt that failed before any hook ran.
+    assert sorted(seen) == [0, 1, 2, 3, 4]
+    stats = buffer.stats()
+    assert stats["duplicates"] == 2
+    assert stats["failed"] == 0
+
+
+def test_hooks_skip_invalid_events(collection):
+    buffer = WatchEventBuffer(
+        max_queue=100, batch_size=4, flush_seconds=0.05, enqueue_timeout=0
+    )
+    seen = []
+    buffer.add_flush_hook(lambda events: seen.extend(e["n"] for e in events))
+
+    assert buffer._flush([_event(0), {**_event(1), "invalid": True}, _event(2)])
+
+    assert seen == [0, 2]
+    assert buffer.stats()["failed"] == 1
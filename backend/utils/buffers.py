@@ -0,0 +1,50 @@
+import time
+
+
+class ChunkSizer:
+    """Picks a stream's chunk size from how fast its client drains data.
+
+    ``observe`` is fed the size of each chunk and how long the consumer took
+    to take it (for a WSGI body iterator: the time from ``yield`` until the
+    server asks for the next chunk, i.e. until the socket write returned).
+    The next chunk is sized to what the client drains in about
+    ``target_seconds``, between ``min_bytes`` and ``max_bytes``. A slow
+    client therefore pins only a small chunk while it reads, and a fast one
+    gets large chunks and few iterations.
+    """
+
+    def __init__(
+        self,
+        min_bytes: int,
+        max_bytes: int,
+        target_seconds: float,
+        initial_bytes: int | None = None,
+    ):
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.chunk_size = min(max_bytes, max(min_bytes, initial_bytes or min_bytes))
+        self._rate: float | None = None
+
+    def observe(self, nbytes: int, seconds: float):
+        rate = nbytes / max(seconds, 1e-4)
+        # Exponential moving average, so one stalled write does not collapse
+        # the size and one burst into socket buffers does not inflate it.
+        self._rate = rate if self._rate is None else 0.7 * self._rate + 0.3 * rate
+        wanted = int(self._rate * self.target_seconds)
+        self.chunk_size = min(self.max_bytes, max(self.min_bytes, wanted))
+
+
+def iter_sized(read, sizer: ChunkSizer):
+    """Yield ``read(size)`` until it returns nothing, adapting ``size``.
+
+    ``read`` gets the sizer's current chunk size; the time each chunk spends
+    with the consumer is fed back into the sizer.
+    """
+    while True:
+        data = read(sizer.chunk_size)
+        if not data:
+            return
+        handed_out = time.perf_counter()
+        yield data
+        sizer.observe(len(data), time.perf_counter() - handed_out)
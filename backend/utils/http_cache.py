@@ -0,0 +1,80 @@
+import hashlib
+import json
+from email.utils import parsedate_to_datetime
+
+from flask import Response, request
+
+
+def _parse_date(value: str | None):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: str | None, etag: str | None) -> bool:
+    """Weak comparison of an ``If-None-Match`` list against ``etag``."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+
+
+def not_modified_since(
+    if_modified_since: str | None, last_modified: str | None
+) -> bool:
+    since, modified = _parse_date(if_modified_since), _parse_date(last_modified)
+    return since is not None and modified is not None and modified <= since
+
+
+def if_range_matches(
+    if_range: str | None, etag: str | None, last_modified: str | None
+) -> bool:
+    """Whether a Range may be honoured under ``If-Range`` (RFC 9110 13.1.5).
+
+    An entity tag must match strongly; a date must equal ``Last-Modified``.
+    Without an ``If-Range`` header the Range always applies.
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return bool(etag) and not etag.startswith("W/") and if_range == etag
+    date = _parse_date(if_range)
+    return date is not None and date == _parse_date(last_modified)
+
+
+def is_not_modified(request_headers, etag: str | None, last_modified: str | None):
+    """Evaluate ``If-None-Match`` / ``If-Modified-Since`` for a GET.
+
+    ``If-Modified-Since`` only counts when no ``If-None-Match`` was sent.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    return not_modified_since(request_headers.get("if-modified-since"), last_modified)
+
+
+def json_body_and_etag(payload) -> tuple[bytes, str]:
+    """Serialize ``payload`` once and derive a strong ETag from the bytes."""
+    body = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def conditional_json(body: bytes, etag: str, cache_control: str) -> Response:
+    """A JSON response, or a bodiless ``304`` when the client's copy matches."""
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,33 @@
+import struct
+
+
+def find_top_level_box(read_at, size: int, box_type: bytes, max_boxes: int = 64):
+    """Locate a top-level ISO BMFF (MP4/MOV) box without reading the file.
+
+    ``read_at(offset, n)`` returns up to ``n`` bytes at ``offset``. Only box
+    headers are read, so a ``moov`` stored after a large ``mdat`` costs one
+    small read per preceding box. Returns ``(offset, length)``, or ``None``
+    when the box is missing or the data does not look like ISO BMFF.
+    """
+    offset = 0
+    for _ in range(max_boxes):
+        if offset + 8 > size:
+            return None
+        header = read_at(offset, 16)
+        if len(header) < 8:
+            return None
+        length, kind = struct.unpack(">I4s", header[:8])
+        if not all(32 <= c < 127 for c in kind):
+            return None
+        if length == 1:
+            if len(header) < 16:
+                return None
+            length = struct.unpack(">Q", header[8:16])[0]
+        elif length == 0:
+            length = size - offset
+        if length < 8:
+            return None
+        if kind == box_type:
+            return offset, min(length, size - offset)
+        offset += length
+    return None
@@ -0,0 +1,29 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Byte-rate token bucket kept as a single "theoretical arrival time".
+
+    ``reserve(n)`` books ``n`` bytes and returns how long the caller must
+    wait before sending them; reservations are served strictly in order, so
+    callers that reserve in small equal slices share the rate evenly.
+    ``burst`` bytes may go out back to back after an idle period.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tat = 0.0
+
+    def reserve(self, nbytes: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._tat = max(self._tat, now) + nbytes / self.rate
+            return max(0.0, self._tat - now - self.burst / self.rate)
+
+    def backlog(self) -> float:
+        """Seconds of already-reserved bytes beyond the burst allowance."""
+        with self._lock:
+            return max(0.0, self._tat - time.monotonic() - self.burst / self.rate)
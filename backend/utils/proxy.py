@@ -0,0 +1,37 @@
+# Hop-by-hop and body-encoding headers that must not be copied from the
+# upstream response; the proxy sets its own framing.
+EXCLUDED_RESPONSE_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+}
+
+
+def upstream_request_headers(
+    range_header: str | None, if_range: str | None = None
+) -> dict:
+    """Headers sent to the origin for a client stream request.
+
+    ``If-Range`` is only forwarded alongside a Range, so the origin can fall
+    back to a full response when the client's copy is stale.
+    """
+    headers = {}
+    if range_header:
+        headers["Range"] = range_header
+        if if_range:
+            headers["If-Range"] = if_range
+    return headers
+
+
+def forwarded_response_headers(upstream_headers) -> list[tuple[str, str]]:
+    """Upstream response headers that are passed back to the client.
+
+    ``Content-Length`` is forwarded separately by the callers once they know
+    the body will be streamed unchanged.
+    """
+    return [
+        (k, v)
+        for k, v in upstream_headers.items()
+        if k.lower() not in EXCLUDED_RESPONSE_HEADERS
+    ]
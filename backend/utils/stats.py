@@ -0,0 +1,13 @@
+from typing import Callable
+
+_providers: dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, provider: Callable[[], dict]) -> None:
+    """Register a callable that reports counters for one subsystem."""
+    _providers[name] = provider
+
+
+def collect_stats() -> dict:
+    """Snapshot counters from every registered subsystem."""
+    return {name: provider() for name, provider in _providers.items()}
@@ -1,17 +1,93 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
 from datetime import datetime, timedelta, timezone
 
 import jwt
 from flask import current_app
 
+from utils.cache import TTLCache
 
-def generate_playback_token(video_id: str) -> tuple[str, int]:
+# Verified playback tokens, kept until the token itself expires so repeated
+# Range requests skip the HMAC check and JSON decode.
+_verified_tokens: TTLCache | None = None
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _keystream(secret: str, nonce: bytes, length: int) -> bytes:
+    out = bytearray()
+    counter = 0
+    while len(out) < length:
+        out += hmac.new(
+            secret.encode("utf-8"),
+            b"playback-upstream-key" + nonce + counter.to_bytes(4, "big"),
+            hashlib.sha256,
+        ).digest()
+        counter += 1
+    return bytes(out[:length])
+
+
+def _seal(value: str, secret: str) -> str:
+    """Hide an upstream key inside a token claim.
+
+    JWT payloads are only signed, not encrypted, so the YouTube ID is XORed
+    with an HMAC-SHA256 keystream before it goes into the token. Integrity
+    comes from the token signature.
+    """
+    nonce = secrets.token_bytes(12)
+    raw = value.encode("utf-8")
+    sealed = bytes(a ^ b for a, b in zip(raw, _keystream(secret, nonce, len(raw))))
+    return f"{_b64(nonce)}.{_b64(sealed)}"
+
+
+def _unseal(sealed: str, secret: str) -> str:
+    nonce_part, data_part = sealed.split(".", 1)
+    nonce, data = _unb64(nonce_part), _unb64(data_part)
+    raw = bytes(a ^ b for a, b in zip(data, _keystream(secret, nonce, len(data))))
+    return raw.decode("utf-8")
+
+
+def _get_verified_cache() -> TTLCache:
+    global _verified_tokens
+    if _verified_tokens is None:
+        _verified_tokens = TTLCache(
+            max_entries=current_app.config["PLAYBACK_TOKEN_CACHE_SIZE"],
+            ttl=current_app.config["PLAYBACK_TOKEN_EXPIRES_SECONDS"],
+        )
+    return _verified_tokens
+
+
+def generate_playback_token(
+    video_id: str,
+    youtube_id: str | None = None,
+    expires_in: int | None = None,
+    user_id: str | None = None,
+    active: bool = False,
+    scope: str | None = None,
+) -> tuple[str, int]:
     """Generate a short-lived, video-specific signed playback token.
 
     The token is a compact JWT signed with a backend-only secret. The client
     never sees any YouTube identifiers and can only present this opaque token
-    back to the backend.
+    back to the backend. When ``youtube_id`` is given it is sealed into the
+    token, so the stream proxy can authorize and resolve the upstream without
+    a database lookup; ``active`` is the video's ``is_active`` at minting
+    time. ``expires_in`` overrides the configured lifetime.
+    ``user_id`` records who the token was issued to, for per-user stream
+    limits. A ``scope`` (e.g. ``"hls"``) limits the token to the routes that
+    ask for that scope; unscoped tokens are only for ``/stream``.
     """
-    expires_in = current_app.config["PLAYBACK_TOKEN_EXPIRES_SECONDS"]
+    if expires_in is None:
+        expires_in = current_app.config["PLAYBACK_TOKEN_EXPIRES_SECONDS"]
     secret = current_app.config["PLAYBACK_TOKEN_SECRET"]
 
     now = datetime.now(timezone.utc)
@@ -23,24 +99,81 @@ def generate_playback_token(video_id: str) -> tuple[str, int]:
         "exp": exp,
         "iat": now,
     }
+    if youtube_id is not None:
+        payload["active"] = active
+        payload["upk"] = _seal(youtube_id, secret)
+    if user_id is not None:
+        payload["uid"] = user_id
+    if scope is not None:
+        payload["scope"] = scope
 
     encoded = jwt.encode(payload, secret, algorithm="HS256")
     return encoded, expires_in
 
 
-def verify_playback_token(token: str, video_id: str) -> bool:
-    """Validate that the playback token is valid, unexpired, and video-specific."""
-    secret = current_app.config["PLAYBACK_TOKEN_SECRET"]
+def _decode_playback_claims(token: str, secret: str) -> dict | None:
+    """Verify signature and expiry; return the normalized claims or None."""
     try:
         payload = jwt.decode(token, secret, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
-        return False
+        return None
     except jwt.InvalidTokenError:
-        return False
+        return None
 
     if payload.get("sub") != "playback":
-        return False
-    if payload.get("video_id") != video_id:
-        return False
-    return True
+        return None
+
+    upstream_key = None
+    if "upk" in payload:
+        try:
+            upstream_key = _unseal(payload["upk"], secret)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    return {
+        "video_id": payload.get("video_id"),
+        "active": payload.get("active"),
+        "upstream_key": upstream_key,
+        "user_id": payload.get("uid"),
+        "scope": payload.get("scope"),
+        "exp": payload["exp"],
+    }
+
+
+def decode_playback_token(
+    token: str, video_id: str, scope: str | None = None
+) -> dict | None:
+    """Return verified claims for a playback token bound to ``video_id``.
+
+    The token's scope must be exactly ``scope``, so a long-lived HLS token
+    is refused where an unscoped one is expected and vice versa.
+    ``upstream_key`` is ``None`` for tokens minted without a sealed YouTube
+    ID; callers then have to look the video up themselves.
+    """
+    cache = _get_verified_cache()
+    claims = cache.get(token)
+    if claims is None:
+        claims = _decode_playback_claims(
+            token, current_app.config["PLAYBACK_TOKEN_SECRET"]
+        )
+        if claims is None:
+            return None
+        cache.set(token, claims, ttl=claims["exp"] - time.time())
+    elif claims["exp"] <= time.time():
+        cache.pop(token)
+        return None
+
+    if claims["video_id"] != video_id or claims["scope"] != scope:
+        return None
+    return claims
+
+
+def verify_playback_token(token: str, video_id: str) -> bool:
+    """Validate that the playback token is valid, unexpired, and video-specific."""
+    return decode_playback_token(token, video_id) is not None
+
 
+def get_playback_token_cache_stats() -> dict:
+    if _verified_tokens is None:
+        return {"entries": 0}
+    return _verified_tokens.stats()
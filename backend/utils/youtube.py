@@ -1,3 +0,0 @@
-def get_video_upstream_url(youtube_id: str) -> str:
-    return "http://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4"
-
@@ -29,9 +29,16 @@ export default function VideoScreen() {
           throw new Error('Unable to start playback');
         }
         const playData = await playRes.json();
-        const token = playData.playback_token as string;
-
-        const proxyUrl = `${API_URL}/video/${id}/stream?token=${encodeURIComponent(token)}`;
+        // Prefer the segmented HLS stream once the backend has packaged the
+        // video (its token lasts a viewing session); fall back to the
+        // progressive MP4 proxy otherwise.
+        const proxyUrl = playData.adaptive
+          ? `${API_URL}/video/${id}/hls/master.m3u8?token=${encodeURIComponent(
+              playData.hls_token as string,
+            )}`
+          : `${API_URL}/video/${id}/stream?token=${encodeURIComponent(
+              playData.playback_token as string,
+            )}`;
 
         setStreamUrl(proxyUrl);
       } catch (e: any) {
@@ -92,7 +99,10 @@ export default function VideoScreen() {
     <View style={styles.container}>
       <Video
         ref={videoRef}
-        source={{ uri: streamUrl }}
+        source={{
+          uri: streamUrl,
+          overrideFileExtensionAndroid: streamUrl.includes('.m3u8') ? 'm3u8' : undefined,
+        }}
         style={styles.video}
         useNativeControls={false}
         resizeMode={ResizeMode.CONTAIN}